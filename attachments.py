@@ -0,0 +1,104 @@
+# Archivio locale degli allegati, indirizzato per contenuto.
+#
+# Gli upload vengono copiati a blocchi su disco in un file il cui nome è lo
+# SHA-256 del contenuto: file identici, anche caricati da sessioni diverse,
+# occupano spazio una sola volta. Nello stato della sessione restano solo
+# gli Handle, e le letture passano da una mappatura in memoria del file.
+import hashlib
+import mmap
+import os
+import tempfile
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass
+from pathlib import Path
+
+import settings
+
+CHUNK_SIZE = 1024 * 1024
+
+
+@dataclass(frozen=True, slots=True)
+class Handle:
+    digest: str
+    name: str
+    size: int
+    mime: str = ""
+
+    def to_dict(self):
+        return asdict(self)
+
+    @classmethod
+    def from_dict(cls, data):
+        return cls(**data)
+
+
+# Handle contenuti in un valore dello stato (liste e dizionari annidati, voci
+# delle liste dinamiche)
+def iter_handles(value):
+    if isinstance(value, Handle):
+        yield value
+    elif hasattr(value, "astuple"):
+        yield from iter_handles(value.astuple())
+    elif isinstance(value, (list, tuple)):
+        for item in value:
+            yield from iter_handles(item)
+    elif isinstance(value, dict):
+        for item in value.values():
+            yield from iter_handles(item)
+
+
+class AttachmentStore:
+    def __init__(self, root):
+        self.root = Path(root)
+
+    def path(self, digest):
+        return self.root / digest[:2] / digest[2:]
+
+    def exists(self, digest):
+        return self.path(digest).is_file()
+
+    # Copia il file a blocchi calcolando l'hash nello stesso passaggio; se il
+    # contenuto è già presente il file temporaneo viene scartato
+    def put(self, fileobj, name, mime=""):
+        tmp_dir = self.root / "tmp"
+        tmp_dir.mkdir(parents=True, exist_ok=True)
+        if hasattr(fileobj, "seek"):
+            fileobj.seek(0)
+
+        sha = hashlib.sha256()
+        size = 0
+        with tempfile.NamedTemporaryFile(dir=tmp_dir, delete=False) as tmp:
+            while chunk := fileobj.read(CHUNK_SIZE):
+                sha.update(chunk)
+                tmp.write(chunk)
+                size += len(chunk)
+
+        digest = sha.hexdigest()
+        dest = self.path(digest)
+        if dest.exists():
+            os.unlink(tmp.name)
+        else:
+            dest.parent.mkdir(parents=True, exist_ok=True)
+            os.replace(tmp.name, dest)
+        return Handle(digest, name, size, mime or "")
+
+    @contextmanager
+    def open_mmap(self, handle):
+        with open(self.path(handle.digest), "rb") as f:
+            if handle.size == 0:
+                yield b""
+                return
+            mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            try:
+                yield mm
+            finally:
+                mm.close()
+
+    # Lettura a blocchi per esportazioni in streaming
+    def iter_chunks(self, handle, chunk_size=CHUNK_SIZE):
+        with self.open_mmap(handle) as mm:
+            for start in range(0, handle.size, chunk_size):
+                yield bytes(mm[start:start + chunk_size])
+
+
+store = AttachmentStore(settings.ATTACHMENTS_DIR)
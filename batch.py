@@ -0,0 +1,134 @@
+# Validazione ed esportazione delle bozze fuori dal browser.
+#
+# Legge bozze (stato piatto della sessione) o record dell'archivio invii da
+# file .json, .jsonl o da cartelle che li contengono, e per ciascuna produce
+# una riga JSONL con progresso, campi mancanti, errori di validazione ed
+# esportazione normalizzata. Il lavoro è distribuito su un pool di processi
+# a blocchi; le righe vengono lette e scritte in streaming, mantenendo
+# l'ordine di ingresso e un numero limitato di blocchi in volo.
+#
+#   python batch.py bozze/ invii.jsonl -o risultati.jsonl -j 8
+import argparse
+import os
+import sys
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from pathlib import Path
+
+import schema
+import validation
+from drafts import decode, encode
+
+CHUNK_SIZE = 256
+
+
+# Restituisce coppie (origine, testo JSON) senza caricare i file interi
+def iter_inputs(paths):
+    for path in map(Path, paths):
+        if path.is_dir():
+            yield from iter_inputs(sorted(p for p in path.iterdir()
+                                          if p.suffix in (".json", ".jsonl")))
+        elif path.suffix == ".jsonl":
+            with open(path, encoding="utf-8") as f:
+                for number, line in enumerate(f, 1):
+                    if line.strip():
+                        yield f"{path}:{number}", line
+        else:
+            yield str(path), path.read_text(encoding="utf-8")
+
+
+# Valida ed esporta una bozza; accetta anche i record dell'archivio invii.
+# Un record che non si riesce a elaborare diventa una riga di errore, così un
+# solo record difettoso non interrompe l'intero archivio
+def process_draft(source, text):
+    try:
+        record = decode(text)
+    except ValueError as exc:
+        return {'source': source, 'error': f"JSON non valido: {exc}"}
+    if not isinstance(record, dict):
+        return {'source': source, 'error': f"record non valido: atteso un oggetto JSON, "
+                                           f"trovato {type(record).__name__}"}
+    state = record['state'] if 'state' in record and 'payload' in record else record
+    if not isinstance(state, dict):
+        return {'source': source, 'error': "record non valido: lo stato non è un oggetto JSON"}
+
+    try:
+        normalized = schema.normalize(state)
+        summary = schema.summarize(normalized)
+        errors = validation.validate_all(normalized).errors
+        export = schema.generate_json(normalized, schema.calculate_projections(normalized))
+    except Exception as exc:
+        return {'source': source, 'id': record.get('id'),
+                'error': f"elaborazione non riuscita: {type(exc).__name__}: {exc}"}
+    return {
+        'source': source,
+        'id': record.get('id'),
+        'valid': not summary.missing and not errors,
+        'progress': round(summary.progress, 4),
+        'missing': list(summary.missing),
+        'errors': errors,
+        'export': export,
+    }
+
+
+# Coppie (valida, riga JSONL) per un blocco di bozze
+def process_chunk(chunk):
+    results = []
+    for source, text in chunk:
+        result = process_draft(source, text)
+        results.append((result.get('valid', False), encode(result)))
+    return results
+
+
+def chunked(items, size):
+    chunk = []
+    for item in items:
+        chunk.append(item)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# Risultati in ordine di ingresso, con al massimo max_pending blocchi in volo
+def run(paths, jobs=None, chunk_size=CHUNK_SIZE):
+    jobs = jobs or os.cpu_count() or 1
+    max_pending = jobs * 2
+    with ProcessPoolExecutor(max_workers=jobs) as pool:
+        pending = deque()
+        for chunk in chunked(iter_inputs(paths), chunk_size):
+            pending.append(pool.submit(process_chunk, chunk))
+            if len(pending) >= max_pending:
+                yield from pending.popleft().result()
+        while pending:
+            yield from pending.popleft().result()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Valida ed esporta bozze di business plan in parallelo")
+    parser.add_argument("inputs", nargs="+", help="file .json/.jsonl o cartelle che li contengono")
+    parser.add_argument("-o", "--output", help="file JSONL di uscita (predefinito: stdout)")
+    parser.add_argument("-j", "--jobs", type=int, help="processi di lavoro (predefinito: numero di CPU)")
+    parser.add_argument("--chunk-size", type=int, default=CHUNK_SIZE, help="bozze per blocco di lavoro")
+    parser.add_argument("--fail-on-invalid", action="store_true",
+                        help="esce con codice 1 se almeno una bozza non è valida")
+    args = parser.parse_args(argv)
+
+    out = open(args.output, "w", encoding="utf-8") if args.output else sys.stdout
+    total = invalid = 0
+    try:
+        for valid, line in run(args.inputs, args.jobs, args.chunk_size):
+            out.write(line + "\n")
+            total += 1
+            invalid += not valid
+    finally:
+        if out is not sys.stdout:
+            out.close()
+
+    print(f"{total} bozze elaborate, {invalid} non valide", file=sys.stderr)
+    return 1 if args.fail_on_invalid and invalid else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
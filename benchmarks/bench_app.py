@@ -0,0 +1,214 @@
+# Benchmark di scalabilità dell'app eseguiti senza browser con AppTest.
+#
+# Ogni traccia simula una sequenza di interazioni (aggiunta di concorrenti,
+# caricamento di immagini, compilazione del piano a 5 anni) e misura il tempo
+# di ogni rerun, il picco di memoria residente e il numero di elementi e di
+# widget renderizzati. Ogni traccia gira in un processo separato, così il
+# picco di RSS non si somma tra tracce diverse. I risultati vanno in un file JSON e
+# vengono confrontati con la baseline del repository (benchmarks/baseline.json,
+# o quella indicata con --baseline): l'esecuzione fallisce (codice 1) se una
+# metrica peggiora oltre la tolleranza. I tempi dipendono dalla macchina:
+# dopo un cambio di hardware o un miglioramento voluto la baseline si
+# rigenera con --update-baseline.
+#
+#   python benchmarks/bench_app.py
+#   python benchmarks/bench_app.py -k concorrenti_100 --tolerance 0.5
+#   python benchmarks/bench_app.py --update-baseline
+import argparse
+import io
+import json
+import os
+import platform
+import resource
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+ROOT = Path(__file__).resolve().parent.parent
+APP = ROOT / "business_plan_app.py"
+BASELINE = Path(__file__).resolve().parent / "baseline.json"
+TIMEOUT = 120
+
+# Metriche confrontate con la baseline: più alto è peggio
+COMPARED = ("median_ms", "p95_ms", "max_rss_mb", "elements", "widgets")
+
+
+def _app():
+    from streamlit.testing.v1 import AppTest
+    return AppTest.from_file(str(APP), default_timeout=TIMEOUT)
+
+
+def _widgets(elements):
+    from streamlit.testing.v1.element_tree import Widget
+    return sum(isinstance(element, Widget) for element in elements)
+
+
+def _timed(at, timings):
+    start = time.perf_counter()
+    at.run()
+    timings.append((time.perf_counter() - start) * 1000)
+    if at.exception:
+        raise RuntimeError(at.exception[0].value)
+    return at
+
+
+def _button(at, label):
+    return next(b for b in at.button if b.label == label)
+
+
+def _entries(label, count):
+    def trace(at, timings):
+        _timed(at, timings)
+        for _ in range(count - 1):
+            _button(at, label).click()
+            _timed(at, timings)
+        # rerun a regime dopo una modifica di testo
+        at.text_input(key="nome_azienda").input("Benchmark Srl")
+        _timed(at, timings)
+    return trace
+
+
+def _images(count):
+    def trace(at, timings):
+        import attachments
+        from PIL import Image
+
+        handles = []
+        for i in range(count):
+            data = io.BytesIO()
+            Image.new("RGB", (1920, 1080), (i * 37 % 256, 80, 160)).save(data, "PNG")
+            data.seek(0)
+            handles.append(attachments.store.put(data, f"screenshot_{i}.png", "image/png"))
+        at.session_state["sito_azienda"] = handles
+        _timed(at, timings)
+        at.text_input(key="nome_azienda").input("Benchmark Srl")
+        _timed(at, timings)
+    return trace
+
+
+def _financial_plan(at, timings):
+    _timed(at, timings)
+    at.number_input(key="anni_bp").set_value(5)
+    _timed(at, timings)
+    for anno in range(1, 6):
+        at.number_input(key=f"ricavi_anno{anno}").set_value(100_000 * anno)
+        _timed(at, timings)
+        at.number_input(key=f"costi_anno{anno}").set_value(80_000 + 10_000 * anno)
+        _timed(at, timings)
+
+
+TRACES = {
+    "concorrenti_1": _entries("➕ Aggiungi Altro Concorrente", 1),
+    "concorrenti_10": _entries("➕ Aggiungi Altro Concorrente", 10),
+    "concorrenti_100": _entries("➕ Aggiungi Altro Concorrente", 100),
+    "prodotti_10": _entries("➕ Aggiungi Altro Prodotto/Servizio", 10),
+    "team_10": _entries("➕ Aggiungi Membro del Team", 10),
+    "immagini_1": _images(1),
+    "immagini_10": _images(10),
+    "immagini_50": _images(50),
+    "piano_5_anni": _financial_plan,
+}
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))]
+
+
+# Eseguita nel processo figlio: stampa su stdout il risultato della traccia
+def run_trace(name):
+    sys.path.insert(0, str(ROOT))
+    at = _app()
+    timings = []
+    TRACES[name](at, timings)
+    elements = list(at.main) + list(at.sidebar)
+    # il primo run include import e avvio: misurato a parte
+    warm = timings[1:] or timings
+    result = {
+        "reruns": len(timings),
+        "cold_ms": round(timings[0], 2),
+        "median_ms": round(statistics.median(warm), 2),
+        "p95_ms": round(_percentile(warm, 95), 2),
+        "last_ms": round(timings[-1], 2),
+        "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "elements": len(elements),
+        "widgets": _widgets(elements),
+    }
+    print(json.dumps(result))
+
+
+def run_all(names):
+    results = {}
+    with tempfile.TemporaryDirectory() as data_dir:
+        env = dict(os.environ, BP_DATA_DIR=data_dir)
+        for name in names:
+            proc = subprocess.run([sys.executable, __file__, "--trace", name],
+                                  capture_output=True, text=True, env=env, check=False)
+            if proc.returncode != 0:
+                raise SystemExit(f"traccia {name} fallita:\n{proc.stderr}")
+            results[name] = json.loads(proc.stdout.strip().splitlines()[-1])
+            print(f"{name:>18}: {results[name]}", file=sys.stderr)
+    return results
+
+
+# Regressioni rispetto alla baseline: (traccia, metrica, base, attuale)
+def compare(results, baseline, tolerance):
+    regressions = []
+    for name, base in baseline.get("results", {}).items():
+        current = results.get(name)
+        if current is None:
+            continue
+        for metric in COMPARED:
+            if metric in base and current[metric] > base[metric] * (1 + tolerance):
+                regressions.append((name, metric, base[metric], current[metric]))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di scalabilità dell'app con AppTest")
+    parser.add_argument("--trace", help=argparse.SUPPRESS)
+    parser.add_argument("-o", "--output", default="bench_output.json", help="file JSON dei risultati")
+    parser.add_argument("-k", "--select", action="append",
+                        help="esegue solo le tracce indicate (ripetibile)")
+    parser.add_argument("--baseline", default=str(BASELINE),
+                        help="file JSON di una esecuzione precedente da confrontare")
+    parser.add_argument("--tolerance", type=float, default=0.25,
+                        help="peggioramento relativo ammesso rispetto alla baseline")
+    parser.add_argument("--update-baseline", action="store_true",
+                        help="salva i risultati come nuova baseline invece di confrontarli")
+    args = parser.parse_args(argv)
+
+    if args.trace:
+        run_trace(args.trace)
+        return 0
+
+    names = args.select or list(TRACES)
+    report = {
+        "meta": {
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpu_count": os.cpu_count(),
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        },
+        "results": run_all(names),
+    }
+    Path(args.output).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+
+    if args.update_baseline:
+        Path(args.baseline).write_text(json.dumps(report, indent=2) + "\n", encoding="utf-8")
+        return 0
+    if Path(args.baseline).exists():
+        baseline = json.loads(Path(args.baseline).read_text(encoding="utf-8"))
+        regressions = compare(report["results"], baseline, args.tolerance)
+        for name, metric, base, current in regressions:
+            print(f"REGRESSIONE {name}.{metric}: {base} -> {current}", file=sys.stderr)
+        if regressions:
+            return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,130 @@
+# Pacchetto completo di un invio: dati del modulo più tutti gli allegati.
+#
+# Il pacchetto è uno zip scritto in streaming: per primo il manifest, con la
+# versione del formato e lo SHA-256 del payload e di ogni allegato, poi il
+# payload compatto (JSON senza spazi, compresso con zstd se il pacchetto
+# zstandard è installato, altrimenti con deflate dello zip) e infine gli
+# allegati, copiati a blocchi dall'archivio su disco. Dato che gli allegati
+# sono già indirizzati per SHA-256, chi riceve il pacchetto può leggere solo
+# il manifest e saltare i file che possiede già; con skip si possono anche
+# escludere in partenza, lasciandoli elencati nel manifest.
+import hashlib
+import json
+import re
+import time
+import zipfile
+from datetime import datetime, timezone
+
+from attachments import iter_handles, store
+from drafts import decode, encode
+from submissions import SCHEMA_VERSION
+
+BUNDLE_VERSION = 1
+EXTENSION = "zip"
+MIME = "application/zip"
+
+# Formati già compressi: archiviati senza ricompressione
+STORED_SUFFIXES = (".jpg", ".jpeg", ".png", ".gif", ".webp", ".pdf", ".docx", ".xlsx",
+                   ".pptx", ".zip", ".gz", ".zst")
+
+
+# Dati del pacchetto: il JSON esportato e i valori compilati, con gli Handle
+def contents(payload, state_items):
+    return {'payload': payload, 'state': dict(state_items)}
+
+
+def _compress(raw):
+    try:
+        import zstandard
+    except ImportError:
+        return "payload.json", raw, "deflate"
+    return "payload.json.zst", zstandard.ZstdCompressor(level=10).compress(raw), "zstd"
+
+
+def _safe_name(name):
+    return re.sub(r"[^\w.\-]+", "_", name).strip("._") or "file"
+
+
+# Allegati dello stato, una volta per contenuto, con i campi che li citano
+def attachments(state):
+    found = {}
+    for key, value in state.items():
+        for handle in iter_handles(value):
+            entry = found.setdefault(handle.digest, {'handle': handle, 'fields': []})
+            if key not in entry['fields']:
+                entry['fields'].append(key)
+    return list(found.values())
+
+
+def _member(path, compress=True):
+    info = zipfile.ZipInfo(path, time.localtime()[:6])
+    info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+    return info
+
+
+# Scrive il pacchetto in out; progress riceve l'avanzamento (0-1) in
+# proporzione ai byte copiati
+def write(out, data, progress=None, skip=()):
+    raw = encode({'schema_version': SCHEMA_VERSION, **data}).encode("utf-8")
+    payload_path, payload, compression = _compress(raw)
+    items = attachments(data.get('state', {}))
+    included = [item for item in items if item['handle'].digest not in skip
+                and store.exists(item['handle'].digest)]
+    paths = {item['handle'].digest: f"allegati/{item['handle'].digest[:16]}/"
+                                     f"{_safe_name(item['handle'].name)}"
+             for item in included}
+
+    manifest = {
+        'bundle_version': BUNDLE_VERSION,
+        'schema_version': SCHEMA_VERSION,
+        'created_at': datetime.now(timezone.utc).isoformat(),
+        'payload': {
+            'path': payload_path,
+            'encoding': "json",
+            'compression': compression,
+            'sha256': hashlib.sha256(raw).hexdigest(),     # del JSON non compresso
+            'size': len(raw),
+        },
+        'attachments': [{
+            'sha256': item['handle'].digest,
+            'name': item['handle'].name,
+            'mime': item['handle'].mime,
+            'size': item['handle'].size,
+            'fields': item['fields'],
+            'path': paths.get(item['handle'].digest),
+        } for item in items],
+    }
+
+    total = len(payload) + sum(item['handle'].size for item in included) or 1
+    done = 0
+    with zipfile.ZipFile(out, "w") as bundle:
+        bundle.writestr(_member("manifest.json"),
+                        json.dumps(manifest, ensure_ascii=False, indent=1))
+        bundle.writestr(_member(payload_path, compress=compression == "deflate"), payload)
+        done += len(payload)
+        for item in included:
+            handle = item['handle']
+            path = paths[handle.digest]
+            with bundle.open(_member(path, not path.lower().endswith(STORED_SUFFIXES)),
+                             "w", force_zip64=handle.size > 2 ** 31) as member:
+                for chunk in store.iter_chunks(handle):
+                    member.write(chunk)
+                    done += len(chunk)
+                    if progress is not None:
+                        progress(done / total)
+    if progress is not None:
+        progress(1.0)
+    return manifest
+
+
+# Legge payload e manifest di un pacchetto, senza estrarre gli allegati
+def read(path):
+    with zipfile.ZipFile(path) as bundle:
+        manifest = json.loads(bundle.read("manifest.json"))
+        payload = bundle.read(manifest['payload']['path'])
+    if manifest['payload']['compression'] == "zstd":
+        import zstandard
+        payload = zstandard.ZstdDecompressor().decompress(payload)
+    if hashlib.sha256(payload).hexdigest() != manifest['payload']['sha256']:
+        raise ValueError("Payload del pacchetto danneggiato")
+    return manifest, decode(payload.decode("utf-8"))
@@ -1,6 +1,26 @@
 import streamlit as st
 import json
 
+import numpy as np
+import pandas as pd
+
+import attachments
+import bundles
+import documents
+import drafts
+import duplicates
+import extraction
+import importer
+import jobs
+import memory
+import profiler
+import projections
+import schema
+import submissions
+import thumbnails
+import validation
+import websites
+
 # Configurazione tema
 st.set_page_config(
     page_title="Business Plan App",
@@ -9,79 +29,70 @@ st.set_page_config(
     initial_sidebar_state="expanded"
 )
 
-# Funzione per inizializzare lo stato della sessione se non esiste
+# Funzione per inizializzare lo stato della sessione se non esiste; se l'URL
+# contiene il token di una bozza, i dati salvati vengono ricaricati. Le bozze
+# con chiavi legacy (tab*_, immagini dei prodotti in slot separati) vengono
+# migrate: le impronte restano quelle salvate, così il primo salvataggio
+# riscrive le chiavi canoniche e rimuove le legacy
 def initialize_session_state():
-    fields = [
-        'nome_azienda', 'motivazione_bp', 'nome_prodotto', 'mercato_target',
-        'strategia_marketing', 'piano_operativo', 'canali_distribuzione',
-        'budget_marketing', 'nome_fondatore', 'ruolo_fondatore',
-        'sito_web', 'budget_marketing',
-        'stato_azienda', 'descrizione_attivita', 'contesto_aziendale',
-        'storia_aziendale', 'obiettivi_aziendali'
-    ]
-    
-    for field in fields:
-        if field not in st.session_state:
-            st.session_state[field] = ""
-    
-    if 'budget_marketing' not in st.session_state or not isinstance(st.session_state['budget_marketing'], (int, float)):
-        st.session_state['budget_marketing'] = 0
-    
-    if 'stato_azienda' not in st.session_state or st.session_state['stato_azienda'] not in ["Esistente", "Da Creare"]:
-        st.session_state['stato_azienda'] = "Esistente"
-
-# Calcola il progresso di compilazione
-def calculate_progress():
-    required_fields = [
-        'nome_azienda', 'motivazione_bp', 'descrizione_attivita', 'nome_prodotto',
-        'mercato_target', 'strategia_marketing', 'piano_operativo',
-        'canali_distribuzione', 'team_members'
-    ]
-    
-    completed = 0
-    for field in required_fields:
-        if field == 'team_members':
-            # Check if at least one team member has been added with required fields
-            if (st.session_state.get('team_members') and
-                any(member['nome'].strip() and member['ruolo'].strip()
-                    for member in st.session_state['team_members'])):
-                completed += 1
+    if '_bozza' not in st.session_state:
+        token = st.query_params.get("bozza")
+        saved = {}
+        if token:
+            loaded = drafts.store.load(token)
+            saved = {key: drafts.fingerprint(drafts.encode(value))
+                     for key, value in loaded.items()}
+            for key, value in schema.migrate_legacy(dict(loaded)).items():
+                if key in schema.LISTS or schema.is_persistent(key):
+                    st.session_state[key] = value
         else:
-            if st.session_state.get(field, "").strip():
-                completed += 1
-    
-    return completed / len(required_fields)
+            token = drafts.new_token()
+        st.session_state['_bozza'] = {'token': token, 'saved': saved}
+        st.query_params["bozza"] = token
+
+    schema.initialize_state(st.session_state)
+    validation.session_issues(st.session_state)
+
+
+# Esiti di validazione mostrati all'ultimo rerun completo
+def issues_snapshot():
+    issues = validation.session_issues(st.session_state)
+    return dict(issues.errors), dict(issues.warnings)
+
+
+# Accoda al salvataggio della bozza solo le chiavi cambiate
+def autosave():
+    bozza = st.session_state['_bozza']
+    drafts.autosave(drafts.store, st.session_state, bozza['token'], bozza['saved'],
+                    memory.shapes(st.session_state), keep=memory.spilled(st.session_state))
 
 st.title("Raccolta Informazioni Business Plan")
 
+profiler.begin(st.session_state)
+memory.begin(st.session_state)
 initialize_session_state()
 
-# Mostra progresso compilazione nella sidebar
-st.sidebar.markdown("### Progresso Compilazione")
-progress_value = calculate_progress()
-st.sidebar.progress(progress_value)
-st.sidebar.caption(f"Completamento: {int(progress_value*100)}%")
-
-# Mostra indicatori per ogni tab
-st.sidebar.markdown("**Completamento Sezioni:**")
-tabs = {
-    "Informazioni Generali": ['nome_azienda', 'motivazione_bp'],
-    "Prodotto/Servizio": ['nome_prodotto'],
-    "Analisi di Mercato": ['mercato_target'],
-    "Strategia": ['strategia_marketing', 'piano_operativo', 'canali_distribuzione'],
-    "Team": ['nome_fondatore', 'ruolo_fondatore', 'esperiencia_team']
-}
+# Riepilogo unico di progresso e sezioni, calcolato una volta per rerun
+# completo e condiviso con i frammenti delle schede
+with profiler.section("Riepilogo"):
+    summary = schema.summarize(st.session_state)
+    st.session_state['_summary'] = summary
+    st.session_state['_esiti'] = issues_snapshot()
+
+    # Mostra progresso compilazione nella sidebar
+    st.sidebar.markdown("### Progresso Compilazione")
+    st.sidebar.progress(summary.progress)
+    st.sidebar.caption(f"Completamento: {int(summary.progress*100)}%")
 
-for tab_name, fields in tabs.items():
-    completed = sum(1 for f in fields if st.session_state.get(f, "").strip())
-    total = len(fields)
-    st.sidebar.markdown(f"- {tab_name}: {'✅' if completed == total else '🟡'} ({completed}/{total})")
+    # Mostra indicatori per ogni tab
+    st.sidebar.markdown("**Completamento Sezioni:**")
+    for tab_name, (completed, total) in summary.sections.items():
+        st.sidebar.markdown(f"- {tab_name}: {'✅' if completed == total else '🟡'} ({completed}/{total})")
 
-# Mostra progresso compilazione nella sidebar
-progress_value = calculate_progress()
-st.sidebar.markdown("---")
-st.sidebar.markdown(f"### Progresso Compilazione: {int(progress_value*100)}%")
-st.sidebar.progress(progress_value)
+    # Mostra progresso compilazione nella sidebar
+    st.sidebar.markdown("---")
+    st.sidebar.markdown(f"### Progresso Compilazione: {int(summary.progress*100)}%")
+    st.sidebar.progress(summary.progress)
 
 # Aggiungi istruzioni per la navigazione
 st.markdown("""
@@ -105,152 +116,455 @@ tab_analisi_mercato, tab_strategia, tab_team, tab_piano_finanziario = \
     st.tabs(["📋 Informazioni Generali", "📎 Allegati Iniziali", "🛠️ Prodotto/Servizio",
              "📊 Analisi di Mercato", "🎯 Strategia", "👥 Team", "💰 Piano Finanziario"])
 
-# Contenuto per ogni tab
-with tab_info_generali:
-    st.header("📋 Informazioni Generali dell'Azienda")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        nome_azienda = st.text_input("Nome dell'Azienda *",
-                                  key="tab1_nome_azienda",
-                                  placeholder="Es. InnovaTech Srl")
-        if not nome_azienda.strip():
-            st.error("Il nome dell'azienda è obbligatorio")
-        
-        forma_giuridica = st.selectbox("Forma Giuridica *",
-                                    ["Seleziona...", "Individuale", "Società di Persone",
-                                     "Società di Capitali", "Altro"],
-                                    key="tab1_forma_giuridica")
-    
-    with col2:
-        email = st.text_input("Email Aziendale *",
-                           key="tab1_email",
-                           placeholder="esempio@azienda.com")
-        if email and "@" not in email:
-            st.error("Inserisci un indirizzo email valido")
-        
-        stato_azienda = st.radio("Stato Azienda",
-                              ["Esistente", "Da Creare"],
-                              key="tab1_stato_azienda")
-    
-    motivazione = st.text_area("Motivazione alla Creazione di questo Business Plan *",
-                            key="tab1_motivazione_bp",
-                            placeholder="Es. Stiamo cercando finanziamenti seed per espandere il nostro team...")
-    if not motivazione.strip():
-        st.error("La motivazione è obbligatoria")
+# Le schede sono frammenti rieseguibili in modo indipendente, cronometrati
+# dal profiler; keys sono le liste e gli slot di allegati che la scheda usa,
+# ricaricati se erano stati scaricati su disco
+def tab_fragment(label, keys=()):
+    def decorator(func):
+        return st.fragment(profiler.timed(label)(memory.resident(keys)(func)))
+    return decorator
 
-with tab_allegati_iniziali:
-    st.header("📎 Allegati Iniziali")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        st.subheader("Documenti Ufficiali")
-        visura = st.file_uploader("Carica Visura Camerale",
-                               key="tab2_visura",
-                               accept_multiple_files=False,
-                               type=['pdf'])
-    
-    with col2:
-        st.subheader("Business Plan Esistenti")
-        business_plan = st.file_uploader("Carica Business Plan",
-                                     key="tab2_business_plan",
-                                     accept_multiple_files=True,
-                                     type=['pdf', 'doc', 'docx'])
 
-with tab_prodotto_servizio:
-    st.header("🛠️ Prodotto o Servizio")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        st.text_input("Nome del Prodotto/Servizio *",
-                    key="tab3_nome_prodotto",
-                    placeholder="Es. Software di gestione progetti")
-    
-    with col2:
-        st.text_input("Prezzo Indicativo",
-                    key="tab3_prezzo",
-                    placeholder="Es. €99/mese")
-    
-    st.text_area("Descrizione Dettagliata *",
-               key="tab3_descrizione",
-               placeholder="Descrivi le funzionalità principali...")
+# Fine di ogni frammento: salva la bozza e, se il rerun parziale ha cambiato
+# il riepilogo di completamento o gli esiti di validazione (elenco nella
+# sidebar, avvisi che dipendono da campi di altre schede), aggiorna la
+# pagina con un rerun completo; altrimenti il rerun resta limitato al
+# frammento. Nel rerun completo la bozza si salva una volta, a fine script
+def finish_fragment():
+    if not memory.fragment_run():
+        return
+    autosave()
+    current = schema.summarize(st.session_state), issues_snapshot()
+    if current != (st.session_state.get('_summary'), st.session_state.get('_esiti')):
+        st.session_state['_summary'], st.session_state['_esiti'] = current
+        st.rerun()
 
-with tab_analisi_mercato:
-    st.header("📊 Analisi di Mercato")
-    
-    st.text_area("Descrizione del Mercato *",
-               key="tab4_mercato",
-               placeholder="Descrivi il mercato di riferimento...")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        st.text_area("Punti di Forza",
-                   key="tab4_forza",
-                   placeholder="Elenca i punti di forza...")
-    with col2:
-        st.text_area("Punti di Debolezza",
-                   key="tab4_debolezza",
-                   placeholder="Elenca i punti di debolezza...")
 
-with tab_strategia:
-    st.header("🎯 Strategia e Implementazione")
-    
-    st.text_area("Strategia di Marketing",
-               key="tab5_marketing",
-               placeholder="Descrivi la tua strategia di marketing...")
-    st.text_area("Piano Operativo",
-               key="tab5_operativo",
-               placeholder="Descrivi il piano operativo...")
-    st.text_input("Canali di Distribuzione",
-                key="tab5_canali",
-                placeholder="Es. E-commerce, negozi fisici...")
+# Anteprima ridotta e in cache di un'immagine archiviata: l'originale a piena
+# risoluzione non viene più decodificato né inviato al browser a ogni rerun.
+# Le anteprime mancanti vengono preparate in background: restituisce True
+# se l'anteprima è ancora in preparazione
+def show_thumbnail(handle, caption):
+    thumb, in_attesa = thumbnails.request_stored(attachments.store, handle,
+                                                 memory.session_id())
+    if in_attesa:
+        st.caption(f"⏳ Anteprima di {handle.name} in preparazione...")
+    elif thumb is None:
+        st.warning(f"Anteprima non disponibile per {handle.name}")
+    else:
+        st.image(thumb, caption=caption)
+    return in_attesa
 
-with tab_team:
-    st.header("👥 Team di Gestione")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        st.text_input("Nome Fondatore",
-                    key="tab6_nome",
-                    placeholder="Nome e cognome del fondatore")
-    with col2:
-        st.text_input("Ruolo",
-                    key="tab6_ruolo",
-                    placeholder="Es. CEO, CTO...")
-    
-    st.text_area("Esperienza",
-               key="tab6_esperienza",
-               placeholder="Descrivi l'esperienza del team...")
 
-with tab_piano_finanziario:
-    st.header("💰 Piano Finanziario")
-    
-    col1, col2 = st.columns(2)
-    with col1:
-        st.number_input("Budget Marketing (€)",
-                     key="tab7_budget",
-                     min_value=0,
-                     step=1000)
-    with col2:
-        st.number_input("Investimento Iniziale (€)",
-                     key="tab7_investimento",
-                     min_value=0,
-                     step=5000)
-    
-    st.text_area("Proiezioni Finanziarie",
-               key="tab7_proiezioni",
-               placeholder="Descrivi le proiezioni finanziarie...")
+# Controlla ogni secondo le anteprime in preparazione, senza rieseguire la
+# pagina; quando sono tutte pronte un rerun completo le mostra
+@st.fragment(run_every=1.0)
+def await_thumbnails(handles):
+    session = memory.session_id()
+    if not any(thumbnails.request_stored(attachments.store, handle, session)[1]
+               for handle in handles):
+        st.rerun()
 
-# Definisci l'ordine delle sezioni
-SECTIONS = ["Informazioni Generali", "Allegati Iniziali", "Prodotto/Servizio",
-           "Analisi di Mercato", "Strategia e Implementazione",
-           "Team di Gestione", "Piano Finanziario"]
 
+# Callback degli uploader: copia i file caricati nell'archivio su disco e
+# cambia la chiave del widget, così l'UploadedFile viene rilasciato e nella
+# sessione resta solo l'elenco degli Handle
+@memory.restoring(keys=memory.first_arg)
+def ingest_upload(slot, widget_key):
+    uploaded = st.session_state.get(widget_key)
+    if not uploaded:
+        return
+    multiple = isinstance(uploaded, list)
+    files = uploaded if multiple else [uploaded]
+    handles = [attachments.store.put(f, f.name, f.type) for f in files]
+    st.session_state[slot] = st.session_state.get(slot, []) + handles if multiple else handles
+    st.session_state[f"_{slot}_nonce"] = st.session_state.get(f"_{slot}_nonce", 0) + 1
 
-st.markdown("---")
 
-with tab_info_generali:
-    st.header("Informazioni Generali dell'Azienda")
+@memory.restoring(keys=memory.first_arg)
+def remove_attachment(slot, index):
+    handles = list(st.session_state.get(slot, []))
+    handles.pop(index)
+    st.session_state[slot] = handles
+
+
+# Uploader appoggiato all'archivio degli allegati: restituisce gli Handle
+# dei file già caricati nello slot
+def attachment_uploader(label, slot, accept_multiple_files=True, **kwargs):
+    widget_key = f"{slot}__{st.session_state.get(f'_{slot}_nonce', 0)}"
+    st.file_uploader(label, key=widget_key,
+                     accept_multiple_files=accept_multiple_files,
+                     on_change=ingest_upload, args=(slot, widget_key),
+                     **kwargs)
+    handles = st.session_state.get(slot, [])
+    for index, handle in enumerate(handles):
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            st.caption(f"📄 {handle.name} ({handle.size / 1024:,.0f} KB)")
+        with col2:
+            st.button("🗑️", key=f"{slot}_rimuovi_{index}",
+                      on_click=remove_attachment, args=(slot, index))
+    return handles
+
+
+# Esito della verifica di un link, dalla cache condivisa dei metadati dei
+# siti; restituisce True se la verifica è ancora in corso
+def link_status(url):
+    if not websites.normalize_url(url):
+        st.caption(f"⚠️ URL non valido: {url}")
+        return False
+    info = websites.fetcher.poll(url)
+    if info is None:
+        st.caption(f"⏳ Verifica di {url} in corso...")
+        return True
+    if info.ok:
+        descrizione = f" — {info.description}" if info.description else ""
+        st.caption(f"🌐 {info.title or info.final_url}{descrizione}")
+    else:
+        st.caption(f"⚠️ Link non raggiungibile: {url} ({info.error})")
+    return False
+
+
+SUGGESTED_LABELS = {
+    'nome_azienda': "Nome dell'Azienda",
+    'partita_iva': "Partita IVA",
+    'descrizione_attivita': "Descrizione Attività",
+    'storia_aziendale': "Storia Aziendale",
+}
+
+
+# Suggerimenti per i campi ancora vuoti, ricavati dai documenti caricati negli
+# slot indicati (i primi hanno la precedenza); in_corso è vero se qualche
+# estrazione non è ancora terminata
+def document_suggestions(slots):
+    suggerimenti = {}
+    in_corso = False
+    for slot in slots:
+        for handle in st.session_state.get(slot, []):
+            text = extraction.extractor.poll(attachments.store, handle)
+            if text is None:
+                in_corso = True
+                continue
+            for key, value in extraction.suggest_fields(text).items():
+                suggerimenti.setdefault(key, value)
+    return {key: value for key, value in suggerimenti.items()
+            if not schema.is_filled(schema.BY_KEY[key],
+                                    schema.get_value(st.session_state, schema.BY_KEY[key]))}, in_corso
+
+
+# Callback che scrive valori in campi di altre schede: invalida il riepilogo
+# condiviso, così il frammento corrente chiude con un rerun completo
+@memory.restoring(keys=())
+def apply_values(values):
+    for key, value in values.items():
+        st.session_state[key] = value
+    st.session_state.pop('_summary', None)
+    validation.revalidate(st.session_state, validation.session_issues(st.session_state),
+                          values.keys())
+
+
+# Callback dei campi con regole di validazione: rivaluta solo le regole che
+# dipendono dal campo modificato
+@memory.restoring(keys=())
+def revalidate(key):
+    validation.revalidate(st.session_state, validation.session_issues(st.session_state), (key,))
+
+
+# Messaggio di validazione già calcolato per la chiave, se presente
+def show_issue(key):
+    issues = validation.session_issues(st.session_state)
+    if key in issues.errors:
+        st.error(issues.errors[key])
+    elif key in issues.warnings:
+        st.warning(issues.warnings[key])
+
+
+EXPORT_FORMATS = {"Word (DOCX)": "docx", "PDF": "pdf", "Markdown": "md",
+                  "Pacchetto completo con allegati (ZIP)": bundles.EXTENSION}
+
+
+# Callback dell'esportazione: il documento viene generato su un thread di
+# lavoro e nella sessione resta solo l'identificativo del lavoro
+@memory.restoring
+def start_export():
+    data = schema.generate_json(st.session_state, schema.calculate_projections(st.session_state))
+    fmt = EXPORT_FORMATS[st.session_state['_export_formato']]
+    if fmt == bundles.EXTENSION:
+        data = bundles.contents(data, schema.persistent_items(st.session_state))
+    try:
+        st.session_state['_export'] = documents.exporter.start(data, fmt, memory.session_id()).id
+    except jobs.Busy as exc:
+        st.session_state['_export'] = None
+        st.session_state['_export_errore'] = str(exc)
+
+
+# Avanzamento del lavoro, aggiornato ogni secondo senza rieseguire la pagina;
+# a lavoro concluso un rerun completo mostra il pulsante di download
+@st.fragment(run_every=1.0)
+def export_progress(job_id):
+    job = documents.exporter.poll(job_id)
+    if job is None or job.done or job.error:
+        st.rerun()
+    st.progress(job.progress, text=f"Generazione del documento... {int(job.progress * 100)}%")
+
+
+def export_panel():
+    st.markdown("### Esporta Business Plan")
+    st.selectbox("Formato", list(EXPORT_FORMATS), key='_export_formato')
+    st.button("📄 Genera documento", on_click=start_export, use_container_width=True)
+    errore = st.session_state.pop('_export_errore', None)
+    if errore:
+        st.warning(errore)
+    job = documents.exporter.poll(st.session_state.get('_export'))
+    if job is None:
+        return
+    if job.error:
+        st.error(f"Esportazione non riuscita: {job.error}")
+    elif not job.done:
+        export_progress(job.id)
+    elif job.path.exists():
+        # il file viene letto dal disco solo quando si preme il pulsante
+        st.download_button(f"Scarica {job.format.upper()}", data=job.path.read_bytes,
+                           file_name=f"business_plan_{st.session_state.get('nome_azienda')}"
+                                     f".{job.format}",
+                           mime=job.mime, use_container_width=True)
+
+
+# Invii precedenti molto simili al piano appena inviato
+def show_duplicates(matches):
+    if matches:
+        st.warning("Il piano è molto simile a invii precedenti:")
+        for match in matches:
+            st.caption(f"- {match.nome_azienda or 'Senza nome'} ({match.id[:8]}, "
+                       f"{match.submitted_at[:10]}): {match.similarity:.0%}")
+
+
+# Controllo dei duplicati in attesa dei testi dei business plan, seguito
+# ogni secondo senza rieseguire la pagina; a lavoro concluso un rerun
+# completo ne mostra l'esito
+@st.fragment(run_every=1.0)
+def duplicates_progress(job_id):
+    job = jobs.scheduler.poll(job_id)
+    if job is None or job.finished:
+        st.rerun()
+    st.caption("⏳ Confronto con gli invii precedenti in corso...")
+
+
+PAGE_SIZE = 10
+
+
+def _pages(count):
+    return max(1, -(-count // PAGE_SIZE))
+
+
+# Callback delle liste dinamiche: modificano lo stato prima del rerun del
+# frammento, senza bisogno di un st.rerun() esplicito. Una nuova voce azzera
+# la ricerca e porta all'ultima pagina, dove compare
+@memory.restoring(keys=memory.first_arg)
+def add_entry(list_key):
+    st.session_state[list_key].append(schema.RECORDS[list_key]())
+    st.session_state[f"_{list_key}_cerca"] = ""
+    st.session_state[f"_{list_key}_pagina"] = _pages(len(st.session_state[list_key]))
+    _reset_grid(list_key)
+
+
+@memory.restoring(keys=memory.first_arg)
+def remove_last_entry(list_key):
+    st.session_state[list_key].pop()
+    _reset_grid(list_key)
+
+
+# Nuova chiave per la tabella di una lista: le modifiche già applicate alle
+# voci non vengono riproposte sui dati aggiornati
+def _reset_grid(list_key):
+    st.session_state[f"_{list_key}_griglia_nonce"] = st.session_state.get(f"_{list_key}_griglia_nonce", 0) + 1
+
+
+# Le voci sono cambiate fuori dai widget delle schede: i valori rimasti nei
+# widget per indice non corrispondono più
+def _forget_entry_widgets(list_key):
+    prefix, attrs = schema.LISTS[list_key]
+    for i in range(len(st.session_state[list_key]) + 1):
+        for attr in attrs:
+            st.session_state.pop(f"{prefix}_{i}_{attr}", None)
+
+
+# Copia il valore di un widget nella voce corrispondente: le voci restano
+# complete anche quando i loro widget escono dalla pagina visibile
+@memory.restoring(keys=memory.first_arg)
+def update_entry(list_key, index, attr, widget_key):
+    setattr(st.session_state[list_key][index], attr, st.session_state[widget_key])
+
+
+# Widget legato a un attributo di una voce: parte dal valore della voce e ogni
+# modifica vi viene riscritta, la chiave del widget non è un dato compilato
+def entry_widget(widget, label, list_key, index, attr, **kwargs):
+    widget_key = f"{schema.LISTS[list_key][0]}_{index}_{attr}"
+    return widget(label, key=widget_key,
+                  value=getattr(st.session_state[list_key][index], attr),
+                  on_change=update_entry, args=(list_key, index, attr, widget_key), **kwargs)
+
+
+@memory.restoring(keys=memory.first_arg)
+def ingest_entry_upload(list_key, index, attr, widget_key):
+    uploaded = st.session_state.get(widget_key)
+    if uploaded is None:
+        return
+    setattr(st.session_state[list_key][index], attr,
+            attachments.store.put(uploaded, uploaded.name, uploaded.type))
+    nonce_key = f"_{schema.LISTS[list_key][0]}_{index}_{attr}_nonce"
+    st.session_state[nonce_key] = st.session_state.get(nonce_key, 0) + 1
+
+
+@memory.restoring(keys=memory.first_arg)
+def remove_entry_attachment(list_key, index, attr):
+    setattr(st.session_state[list_key][index], attr, None)
+
+
+# Uploader di un singolo file salvato come Handle nell'attributo di una voce,
+# come attachment_uploader per gli slot; restituisce l'Handle o None
+def entry_uploader(label, list_key, index, attr, **kwargs):
+    prefix = schema.LISTS[list_key][0]
+    widget_key = f"{prefix}_{index}_{attr}__{st.session_state.get(f'_{prefix}_{index}_{attr}_nonce', 0)}"
+    st.file_uploader(label, key=widget_key, on_change=ingest_entry_upload,
+                     args=(list_key, index, attr, widget_key), **kwargs)
+    handle = getattr(st.session_state[list_key][index], attr)
+    if handle is not None:
+        col1, col2 = st.columns([5, 1])
+        with col1:
+            st.caption(f"📄 {handle.name} ({handle.size / 1024:,.0f} KB)")
+        with col2:
+            st.button("🗑️", key=f"{prefix}_{index}_{attr}_rimuovi",
+                      on_click=remove_entry_attachment, args=(list_key, index, attr))
+    return handle
+
+
+# Callback dell'importazione CSV/XLSX: le righe lette diventano voci della
+# lista in un solo rerun (la voce iniziale vuota viene sostituita)
+@memory.restoring(keys=memory.first_arg)
+def import_entries(list_key, widget_key):
+    uploaded = st.session_state.get(widget_key)
+    if uploaded is None:
+        return
+    try:
+        frame, truncated = importer.read_entries(uploaded, uploaded.name, list_key)
+    except ValueError as exc:
+        st.session_state[f"_{list_key}_importazione"] = ('error', str(exc))
+    else:
+        entries = [entry for entry in st.session_state[list_key] if not entry.is_empty()]
+        st.session_state[list_key] = entries + schema.entries(list_key, frame.to_dict('records'))
+        messaggio = f"Importate {len(frame)} voci da {uploaded.name}"
+        if truncated:
+            st.session_state[f"_{list_key}_importazione"] = (
+                'warning', f"{messaggio}: il file supera il limite di {importer.MAX_ROWS:,} "
+                           "righe e le successive sono state ignorate")
+        else:
+            st.session_state[f"_{list_key}_importazione"] = ('success', messaggio)
+        st.session_state[f"_{list_key}_vista"] = "Tabella"
+        _forget_entry_widgets(list_key)
+        _reset_grid(list_key)
+    st.session_state[f"_{list_key}_import_nonce"] = st.session_state.get(f"_{list_key}_import_nonce", 0) + 1
+
+
+# Callback della tabella: applica alle voci le righe modificate, eliminate
+# e aggiunte (gli indici si riferiscono ai dati mostrati prima della modifica)
+@memory.restoring(keys=memory.first_arg)
+def apply_grid_edits(list_key, widget_key):
+    attrs = schema.LISTS[list_key][1]
+    edits = st.session_state[widget_key]
+    entries = st.session_state[list_key]
+    for row, changes in edits.get('edited_rows', {}).items():
+        for attr in attrs:
+            if attr in changes:
+                setattr(entries[int(row)], attr, changes[attr] or '')
+    for row in sorted(edits.get('deleted_rows', []), reverse=True):
+        entries.pop(row)
+    entries.extend(schema.entries(list_key, edits.get('added_rows', [])))
+    _forget_entry_widgets(list_key)
+    _reset_grid(list_key)
+
+
+# Tutte le voci in un'unica tabella modificabile, con la colonna degli errori
+# calcolata in blocco
+def entries_grid(list_key):
+    attrs = schema.LISTS[list_key][1]
+    frame = pd.DataFrame([[getattr(entry, attr) for attr in attrs]
+                          for entry in st.session_state[list_key]], columns=list(attrs))
+    errors = importer.validate(frame, list_key)
+    frame['errori'] = errors
+    invalid = int(errors.ne('').sum())
+    if invalid:
+        st.warning(f"{invalid} voci da correggere")
+    widget_key = f"_{list_key}_griglia_{st.session_state.get(f'_{list_key}_griglia_nonce', 0)}"
+    st.data_editor(frame, key=widget_key, num_rows="dynamic", hide_index=True,
+                   use_container_width=True, disabled=['errori'],
+                   column_config={attr: st.column_config.TextColumn(attr.capitalize())
+                                  for attr in attrs},
+                   on_change=apply_grid_edits, args=(list_key, widget_key))
+
+
+# Scelta tra schede e tabella e importazione in blocco, per le liste che la
+# supportano; restituisce True se la lista è mostrata in tabella
+def list_controls(list_key):
+    if list_key not in importer.REQUIRED:
+        return False
+    with st.expander("📥 Importa da CSV/XLSX"):
+        widget_key = f"_{list_key}_import_{st.session_state.get(f'_{list_key}_import_nonce', 0)}"
+        st.file_uploader("File con una riga per voce e le colonne: "
+                         + ", ".join(schema.LISTS[list_key][1]),
+                         type=['csv', 'xlsx'], key=widget_key,
+                         on_change=import_entries, args=(list_key, widget_key))
+    esito = st.session_state.pop(f"_{list_key}_importazione", None)
+    if esito:
+        getattr(st, esito[0])(esito[1])
+    vista = st.radio("Visualizzazione", ["Schede", "Tabella"], horizontal=True,
+                     key=f"_{list_key}_vista", label_visibility="collapsed")
+    if vista == "Tabella":
+        entries_grid(list_key)
+        return True
+    return False
+
+
+# Ricerca e paginazione sulle voci in memoria di una lista dinamica: crea
+# widget solo per la pagina visibile e restituisce le coppie (indice, voce)
+# da mostrare, così il costo del rerun dipende da PAGE_SIZE e non dalla
+# lunghezza della lista. In vista tabella non ci sono voci da mostrare come
+# schede
+def visible_entries(list_key):
+    if list_controls(list_key):
+        return []
+    entries = st.session_state[list_key]
+    if len(entries) <= PAGE_SIZE:
+        return list(enumerate(entries))
+
+    query = st.text_input("🔍 Cerca", key=f"_{list_key}_cerca",
+                          placeholder="Filtra per nome o contenuto").strip().casefold()
+    attrs = schema.LISTS[list_key][1]
+    matches = [i for i, entry in enumerate(entries)
+               if not query or any(query in getattr(entry, attr).casefold()
+                                   for attr in attrs)]
+    if not matches:
+        st.caption("Nessuna voce corrisponde alla ricerca")
+        return []
+
+    page_key = f"_{list_key}_pagina"
+    pages = _pages(len(matches))
+    if st.session_state.get(page_key, 1) > pages:
+        st.session_state[page_key] = pages
+    page = 1
+    if pages > 1:
+        page = st.number_input(f"Pagina (di {pages})", key=page_key,
+                               min_value=1, max_value=pages, step=1)
+    start = (page - 1) * PAGE_SIZE
+    shown = matches[start:start + PAGE_SIZE]
+    st.caption(f"Voci {start + 1}–{start + len(shown)} di {len(matches)}"
+               + (f" (su {len(entries)} totali)" if query else ""))
+    return [(i, entries[i]) for i in shown]
+
+
+@tab_fragment("Informazioni Generali")
+def render_info_generali():
+    st.header("📋 Informazioni Generali dell'Azienda")
     
     # Nome azienda con validazione
     nome_azienda = st.text_input("Nome dell'Azienda *", key="nome_azienda",
@@ -270,27 +584,28 @@ with tab_info_generali:
     forma_giuridica = st.selectbox("Forma Giuridica *",
                                  ["Seleziona...", "Individuale", "Società di Persone",
                                   "Società di Capitali", "Altro"],
-                                 key="forma_giuridica")
+                                 key="forma_giuridica",
+                                 on_change=revalidate, args=("forma_giuridica",))
     
     if forma_giuridica == "Società di Capitali":
         st.subheader("Informazioni Specifiche per Società di Capitali")
         partita_iva = st.text_input("Partita IVA *", key="partita_iva",
+                                  on_change=revalidate, args=("partita_iva",),
                                   placeholder="Inserisci la partita IVA")
-        if partita_iva and (len(partita_iva) != 11 or not partita_iva.isdigit()):
-            st.error("La partita IVA deve essere composta da 11 cifre")
+        show_issue('partita_iva')
         
         capitale_sociale = st.number_input("Capitale Sociale (€) *",
                                         key="capitale_sociale",
+                                        on_change=revalidate, args=("capitale_sociale",),
                                         min_value=0.0,
                                         step=1000.0)
-        if capitale_sociale <= 0:
-            st.error("Il capitale sociale deve essere maggiore di 0")
+        show_issue('capitale_sociale')
     
     # Email validation
     email = st.text_input("Email Aziendale *", key="email_aziendale",
+                        on_change=revalidate, args=("email_aziendale",),
                         placeholder="esempio@azienda.com")
-    if email and "@" not in email:
-        st.error("Inserisci un indirizzo email valido")
+    show_issue('email_aziendale')
     
     # Stato azienda
     stato_azienda = st.radio("Stato Azienda",
@@ -323,107 +638,140 @@ with tab_info_generali:
                 placeholder="Descrivi gli obiettivi a breve e lungo termine dell'azienda...",
                 help="Fornisci informazioni sugli obiettivi aziendali")
 
-with tab_allegati_iniziali:
-    st.header("Allegati Iniziali")
+    finish_fragment()
+
+
+@tab_fragment("Allegati Iniziali",
+              keys=('visura', 'business_plan', 'sito_azienda', 'sito_concorrenti'))
+def render_allegati_iniziali():
+    st.header("📎 Allegati Iniziali")
     
     st.subheader("Documenti Ufficiali")
-    visura = st.file_uploader("Carica Visura Camerale",
-                            accept_multiple_files=False,
-                            type=['pdf'],
-                            help="Carica la visura camerale in formato PDF")
+    visura = attachment_uploader("Carica Visura Camerale", "visura",
+                                 accept_multiple_files=False,
+                                 type=['pdf'],
+                                 help="Carica la visura camerale in formato PDF")
     
     st.subheader("Business Plan Esistenti")
-    business_plan = st.file_uploader("Carica Business Plan Esistenti",
-                                   accept_multiple_files=True,
-                                   type=['pdf', 'doc', 'docx'],
-                                   help="Puoi caricare business plan esistenti in formato PDF o Word")
+    business_plan = attachment_uploader("Carica Business Plan Esistenti", "business_plan",
+                                        accept_multiple_files=True,
+                                        type=['pdf', 'doc', 'docx'],
+                                        help="Puoi caricare business plan esistenti in formato PDF o Word")
     
     st.subheader("Immagini Sito Web")
     col1, col2 = st.columns(2)
     with col1:
-        sito_azienda = st.file_uploader("Screenshot Sito Aziendale",
-                                      accept_multiple_files=True,
-                                      type=['png', 'jpg', 'jpeg'],
-                                      help="Carica screenshot del sito aziendale")
+        sito_azienda = attachment_uploader("Screenshot Sito Aziendale", "sito_azienda",
+                                           accept_multiple_files=True,
+                                           type=['png', 'jpg', 'jpeg'],
+                                           help="Carica screenshot del sito aziendale")
     with col2:
-        sito_concorrenti = st.file_uploader("Screenshot Siti Concorrenti",
-                                          accept_multiple_files=True,
-                                          type=['png', 'jpg', 'jpeg'],
-                                          help="Carica screenshot dei siti dei concorrenti")
+        sito_concorrenti = attachment_uploader("Screenshot Siti Concorrenti", "sito_concorrenti",
+                                               accept_multiple_files=True,
+                                               type=['png', 'jpg', 'jpeg'],
+                                               help="Carica screenshot dei siti dei concorrenti")
     
     # Mostra anteprima file caricati
     if visura or business_plan or sito_azienda or sito_concorrenti:
         st.subheader("Anteprima Allegati")
+        in_attesa = []
         if visura:
-            st.write(f"Visura caricata: {visura.name}")
+            st.write(f"Visura caricata: {visura[0].name}")
         if business_plan:
             for bp in business_plan:
                 st.write(f"Business Plan: {bp.name}")
         if sito_azienda:
             for img in sito_azienda:
-                st.image(img, caption=f"Screenshot sito aziendale: {img.name}")
+                if show_thumbnail(img, f"Screenshot sito aziendale: {img.name}"):
+                    in_attesa.append(img)
         if sito_concorrenti:
             for img in sito_concorrenti:
-                st.image(img, caption=f"Screenshot sito concorrente: {img.name}")
+                if show_thumbnail(img, f"Screenshot sito concorrente: {img.name}"):
+                    in_attesa.append(img)
+        if in_attesa:
+            await_thumbnails(in_attesa)
+    
+    # Valori suggeriti dal testo di visure e business plan, estratto in background
+    suggerimenti, in_corso = document_suggestions(('visura', 'business_plan'))
+    if in_corso:
+        st.info("Analisi dei documenti caricati in corso...")
+        st.button("🔄 Aggiorna suggerimenti")
+    if suggerimenti:
+        st.subheader("Valori Suggeriti dai Documenti")
+        for key, value in suggerimenti.items():
+            st.markdown(f"**{SUGGESTED_LABELS[key]}:** {value[:300]}")
+        st.button("Usa valori suggeriti", on_click=apply_values, args=(suggerimenti,))
 
-with tab_prodotto_servizio:
-    st.header("Prodotto o Servizio")
+    finish_fragment()
+
+
+@tab_fragment("Prodotto/Servizio", keys=('prodotti',))
+def render_prodotto_servizio():
+    st.header("🛠️ Prodotto o Servizio")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.text_input("Nome del Prodotto/Servizio *",
+                    key="nome_prodotto",
+                    placeholder="Es. Software di gestione progetti")
+    
+    with col2:
+        st.text_input("Prezzo Indicativo",
+                    key="prezzo_indicativo",
+                    placeholder="Es. €99/mese")
     
+    st.text_area("Descrizione Dettagliata *",
+               key="descrizione_prodotto",
+               placeholder="Descrivi le funzionalità principali...")
+
     if 'prodotti' not in st.session_state:
-        st.session_state.prodotti = [{
-            'nome': '',
-            'descrizione': '',
-            'immagine': None
-        }]
+        st.session_state.prodotti = [schema.Prodotto()]
     
-    for i, prodotto in enumerate(st.session_state.prodotti):
+    in_attesa = []
+    for i, prodotto in visible_entries('prodotti'):
         with st.expander(f"Prodotto/Servizio #{i+1}" if i > 0 else "Primo Prodotto/Servizio"):
             # Nome prodotto
-            st.text_input("Nome del Prodotto/Servizio *",
-                         key=f"prodotto_{i}_nome",
-                         value=prodotto['nome'],
+            entry_widget(st.text_input, "Nome del Prodotto/Servizio *", 'prodotti', i, 'nome',
                          placeholder="Es. Software di gestione progetti 'ProjectZen'")
             
             # Descrizione prodotto
-            st.text_area("Descrizione Dettagliata *",
-                       key=f"prodotto_{i}_descrizione",
-                       value=prodotto['descrizione'],
-                       placeholder="Descrivi le funzionalità principali, come funziona, i materiali utilizzati, ecc.",
-                       help="Fornisci una descrizione completa del tuo prodotto o servizio.")
+            entry_widget(st.text_area, "Descrizione Dettagliata *", 'prodotti', i, 'descrizione',
+                         placeholder="Descrivi le funzionalità principali, come funziona, i materiali utilizzati, ecc.",
+                         help="Fornisci una descrizione completa del tuo prodotto o servizio.")
             
             # Immagine prodotto
-            uploaded_file = st.file_uploader(f"Carica immagine del prodotto #{i+1}",
-                                           type=['png', 'jpg', 'jpeg'],
-                                           key=f"prodotto_{i}_immagine")
-            if uploaded_file:
-                st.image(uploaded_file, caption=f"Anteprima immagine prodotto #{i+1}")
-                st.session_state.prodotti[i]['immagine'] = uploaded_file
+            immagine = entry_uploader(f"Carica immagine del prodotto #{i+1}", 'prodotti', i, 'immagine',
+                                      type=['png', 'jpg', 'jpeg'])
+            if immagine is not None:
+                if show_thumbnail(immagine, f"Anteprima immagine prodotto #{i+1}"):
+                    in_attesa.append(immagine)
             
             st.markdown("---")
+    
+    if in_attesa:
+        await_thumbnails(in_attesa)
             
-        # Aggiungi nuovo prodotto
-        if i == len(st.session_state.prodotti) - 1:
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button("➕ Aggiungi Altro Prodotto/Servizio"):
-                    st.session_state.prodotti.append({
-                        'nome': '',
-                        'descrizione': '',
-                        'immagine': None
-                    })
-                    st.rerun()
-            with col2:
-                if len(st.session_state.prodotti) > 1:
-                    if st.button("❌ Rimuovi Ultimo Prodotto"):
-                        st.session_state.prodotti.pop()
-                        st.rerun()
+    # Aggiungi nuovo prodotto
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("➕ Aggiungi Altro Prodotto/Servizio",
+                  on_click=add_entry, args=('prodotti',))
+    with col2:
+        if len(st.session_state.prodotti) > 1:
+            st.button("❌ Rimuovi Ultimo Prodotto",
+                      on_click=remove_last_entry, args=('prodotti',))
 
-with tab_analisi_mercato:
-    st.header("Analisi di Mercato")
+    finish_fragment()
+
+
+@tab_fragment("Analisi di Mercato", keys=('concorrenti',))
+def render_analisi_mercato():
+    st.header("📊 Analisi di Mercato")
     
     # Analisi generale
     st.subheader("Analisi Generale")
     analisi_mercato = st.text_area("Descrizione del Mercato *",
+                                 key="mercato_target",
                                  placeholder="Descrivi il mercato di riferimento, dimensioni, tendenze, ecc.",
                                  help="Fornisci una panoramica completa del mercato")
     
@@ -431,64 +779,58 @@ with tab_analisi_mercato:
     st.subheader("Analisi della Concorrenza")
     
     if 'concorrenti' not in st.session_state:
-        st.session_state.concorrenti = [{
-            'nome': '',
-            'url': '',
-            'note': ''
-        }]
+        st.session_state.concorrenti = [schema.Concorrente()]
     
-    for i, concorrente in enumerate(st.session_state.concorrenti):
+    verifiche_in_corso = False
+    for i, concorrente in visible_entries('concorrenti'):
         with st.expander(f"Concorrente #{i+1}" if i > 0 else "Primo Concorrente"):
             cols = st.columns([3, 5, 4])
             with cols[0]:
-                st.text_input("Nome Concorrente *",
-                            key=f"concorrente_{i}_nome",
-                            value=concorrente['nome'],
-                            placeholder="Nome del concorrente")
+                entry_widget(st.text_input, "Nome Concorrente *", 'concorrenti', i, 'nome',
+                             placeholder="Nome del concorrente")
             with cols[1]:
-                st.text_input("URL Sito Web",
-                            key=f"concorrente_{i}_url",
-                            value=concorrente['url'],
-                            placeholder="Inserisci l'URL del sito")
+                entry_widget(st.text_input, "URL Sito Web", 'concorrenti', i, 'url',
+                             placeholder="Inserisci l'URL del sito")
+                if concorrente.url.strip():
+                    verifiche_in_corso |= link_status(concorrente.url)
             with cols[2]:
-                st.text_area("Note",
-                           key=f"concorrente_{i}_note",
-                           value=concorrente['note'],
-                           placeholder="Inserisci note aggiuntive")
-        
-        # Aggiungi/Rimuovi concorrenti
-        if i == len(st.session_state.concorrenti) - 1:
-            col1, col2 = st.columns(2)
-            with col1:
-                if st.button("➕ Aggiungi Altro Concorrente"):
-                    st.session_state.concorrenti.append({
-                        'nome': '',
-                        'url': '',
-                        'note': ''
-                    })
-                    st.rerun()
-            with col2:
-                if len(st.session_state.concorrenti) > 1:
-                    if st.button("❌ Rimuovi Ultimo Concorrente"):
-                        st.session_state.concorrenti.pop()
-                        st.rerun()
+                entry_widget(st.text_area, "Note", 'concorrenti', i, 'note',
+                             placeholder="Inserisci note aggiuntive")
+    
+    if verifiche_in_corso:
+        st.button("🔄 Aggiorna stato dei link", key="aggiorna_link_concorrenti")
+    
+    # Aggiungi/Rimuovi concorrenti
+    col1, col2 = st.columns(2)
+    with col1:
+        st.button("➕ Aggiungi Altro Concorrente",
+                  on_click=add_entry, args=('concorrenti',))
+    with col2:
+        if len(st.session_state.concorrenti) > 1:
+            st.button("❌ Rimuovi Ultimo Concorrente",
+                      on_click=remove_last_entry, args=('concorrenti',))
     
     # SWOT Analysis
     st.subheader("Analisi SWOT")
     col1, col2 = st.columns(2)
     with col1:
-        punti_di_forza = st.text_area("Punti di Forza",
+        punti_di_forza = st.text_area("Punti di Forza", key="punti_forza",
                                     placeholder="Inserisci i punti di forza della tua azienda")
-        opportunita = st.text_area("Opportunità",
+        opportunita = st.text_area("Opportunità", key="opportunita",
                                  placeholder="Inserisci le opportunità del mercato")
     with col2:
-        punti_di_debolezza = st.text_area("Punti di Debolezza",
+        punti_di_debolezza = st.text_area("Punti di Debolezza", key="punti_debolezza",
                                         placeholder="Inserisci i punti di debolezza della tua azienda")
-        minacce = st.text_area("Minacce",
+        minacce = st.text_area("Minacce", key="minacce",
                              placeholder="Inserisci le minacce del mercato")
 
-with tab_strategia:
-    st.header("Strategia e Implementazione")
+    finish_fragment()
+
+
+@tab_fragment("Strategia")
+def render_strategia():
+    st.header("🎯 Strategia e Implementazione")
+    
     st.text_area("Strategia di Marketing", key="strategia_marketing",
                 placeholder="Descrivi la tua strategia di marketing...")
     st.text_area("Piano Operativo", key="piano_operativo",
@@ -496,96 +838,109 @@ with tab_strategia:
     st.text_input("Canali di Distribuzione", key="canali_distribuzione",
                  placeholder="Es. E-commerce, negozi fisici...")
     st.number_input("Budget Marketing (€)", key="budget_marketing",
+                   on_change=revalidate, args=("budget_marketing",),
                    min_value=0, step=1000)
+    show_issue('budget_marketing')
+    show_issue('budget_vs_costi')
 
-with tab_team:
-    st.header("Team di Gestione")
+    finish_fragment()
+
+
+@tab_fragment("Team", keys=('team_members', 'cv_team'))
+def render_team():
+    st.header("👥 Team di Gestione")
+    
+    col1, col2 = st.columns(2)
+    with col1:
+        st.text_input("Nome Fondatore *",
+                    key="nome_fondatore",
+                    placeholder="Nome e cognome del fondatore")
+    with col2:
+        st.text_input("Ruolo *",
+                    key="ruolo_fondatore",
+                    placeholder="Es. CEO, CTO...")
     
+    st.text_area("Esperienza *",
+               key="esperienza_team",
+               placeholder="Descrivi l'esperienza del team...")
+
     if 'team_members' not in st.session_state:
-        st.session_state.team_members = [{
-            'nome': '',
-            'ruolo': '',
-            'esperienza': ''
-        }]
+        st.session_state.team_members = [schema.MembroTeam()]
     
-    for i, member in enumerate(st.session_state.team_members):
+    for i, member in visible_entries('team_members'):
         with st.expander(f"Membro del Team #{i+1}" if i > 0 else "Primo Membro del Team"):
             cols = st.columns([2, 2, 4])
             with cols[0]:
-                st.text_input("Nome e Cognome",
-                            key=f"team_member_{i}_nome",
-                            value=member['nome'],
-                            placeholder="Nome e cognome")
+                entry_widget(st.text_input, "Nome e Cognome", 'team_members', i, 'nome',
+                             placeholder="Nome e cognome")
             with cols[1]:
-                st.text_input("Ruolo",
-                            key=f"team_member_{i}_ruolo",
-                            value=member['ruolo'],
-                            placeholder="Es. CEO, CTO...")
+                entry_widget(st.text_input, "Ruolo", 'team_members', i, 'ruolo',
+                             placeholder="Es. CEO, CTO...")
             with cols[2]:
-                st.text_area("Esperienza",
-                           key=f"team_member_{i}_esperienza",
-                           value=member['esperienza'],
-                           placeholder="Descrivi l'esperienza...")
-        
-        if i == len(st.session_state.team_members) - 1:
-            if st.button("➕ Aggiungi Membro del Team"):
-                st.session_state.team_members.append({
-                    'nome': '',
-                    'ruolo': '',
-                    'esperienza': ''
-                })
-                st.rerun()
-    
-    st.file_uploader("Carica CV Team", accept_multiple_files=True,
-                   key="cv_team",
-                   help="Puoi caricare i CV di tutti i membri del team")
+                entry_widget(st.text_area, "Esperienza", 'team_members', i, 'esperienza',
+                             placeholder="Descrivi l'esperienza...")
+    
+    st.button("➕ Aggiungi Membro del Team",
+              on_click=add_entry, args=('team_members',))
+    
+    attachment_uploader("Carica CV Team", "cv_team",
+                        accept_multiple_files=True,
+                        help="Puoi caricare i CV di tutti i membri del team")
 
-with tab_piano_finanziario:
-    st.header("Piano Finanziario")
+    finish_fragment()
+
+
+@tab_fragment("Piano Finanziario", keys=('doc_finanziari',))
+def render_piano_finanziario():
+    st.header("💰 Piano Finanziario")
+    
     st.markdown("""
     **Istruzioni:**
     Fornisci una stima delle tue proiezioni finanziarie per i prossimi anni.
     Se non disponi di dati precisi, indica valori approssimativi.
     """)
     
-    # Durata business plan
-    anni_bp = st.number_input("Durata Business Plan (anni)",
-                            min_value=1, max_value=5, value=3,
-                            help="Indica per quanti anni vuoi pianificare")
+    # Durata business plan e investimento iniziale
+    col1, col2 = st.columns(2)
+    with col1:
+        anni_bp = st.number_input("Durata Business Plan (anni)",
+                                key="anni_bp",
+                                on_change=revalidate, args=("anni_bp",),
+                                min_value=1, max_value=projections.MAX_ANNI,
+                                help="Indica per quanti anni vuoi pianificare")
+    with col2:
+        st.number_input("Investimento Iniziale (€)",
+                     key="investimento_iniziale",
+                     min_value=0,
+                     step=5000)
     
     # Proiezioni annuali con calcoli automatici
     st.subheader("Proiezioni Annuali")
-    proiezioni = {}
+    proiezioni = schema.calculate_projections(st.session_state)
     totali = {'ricavi': 0, 'costi': 0, 'profitti': 0}
     
     for anno in range(1, anni_bp + 1):
         with st.expander(f"Anno {anno}"):
-            ricavi = st.number_input(f"Ricavi Previsti Anno {anno} (€) *",
-                                   key=f"ricavi_anno{anno}",
-                                   min_value=0, step=1000)
-            costi = st.number_input(f"Costi Totali Anno {anno} (€) *",
-                                  key=f"costi_anno{anno}",
-                                  min_value=0, step=1000)
+            st.number_input(f"Ricavi Previsti Anno {anno} (€) *",
+                          key=f"ricavi_anno{anno}",
+                          on_change=revalidate, args=(f"ricavi_anno{anno}",),
+                          min_value=0, step=1000)
+            st.number_input(f"Costi Totali Anno {anno} (€) *",
+                          key=f"costi_anno{anno}",
+                          on_change=revalidate, args=(f"costi_anno{anno}",),
+                          min_value=0, step=1000)
             
-            if ricavi and costi:
-                profitto = ricavi - costi
+            if anno in proiezioni:
+                profitto = proiezioni[anno]['profitto']
                 st.metric(f"Profitto Anno {anno}", f"€ {profitto:,.2f}")
                 
-                if profitto < 0:
-                    st.error("Attenzione: Proiezione di perdita per questo anno")
-                elif profitto == 0:
-                    st.warning("Proiezione di pareggio per questo anno")
+                show_issue(f"valori_anno{anno}")
+                show_issue(f"perdita_anno{anno}")
                 
                 # Aggiorna totali
-                totali['ricavi'] += ricavi
-                totali['costi'] += costi
+                totali['ricavi'] += proiezioni[anno]['ricavi']
+                totali['costi'] += proiezioni[anno]['costi']
                 totali['profitti'] += profitto
-                
-                proiezioni[anno] = {
-                    'ricavi': ricavi,
-                    'costi': costi,
-                    'profitto': profitto
-                }
     
     # Riepilogo finanziario
     st.subheader("Riepilogo Finanziario")
@@ -598,6 +953,54 @@ with tab_piano_finanziario:
         st.metric("Profitto Totale", f"€ {totali['profitti']:,.2f}",
                  delta_color="inverse" if totali['profitti'] < 0 else "normal")
     
+    st.text_area("Note sulle Proiezioni",
+               key="note_proiezioni",
+               placeholder="Descrivi le ipotesi alla base delle proiezioni finanziarie...")
+    
+    # Scenari e simulazione Monte Carlo sul piano annuale
+    st.subheader("Scenari e Simulazione")
+    col1, col2, col3, col4 = st.columns(4)
+    with col1:
+        st.number_input("Variazione Scenari (%)", key="variazione_scenari",
+                      on_change=revalidate, args=("variazione_scenari",),
+                      min_value=0, max_value=90, step=5,
+                      help="Scarto annuo degli scenari migliore e peggiore rispetto al piano")
+    with col2:
+        st.number_input("Volatilità Ricavi (%)", key="volatilita_ricavi",
+                      on_change=revalidate, args=("volatilita_ricavi",),
+                      min_value=0, max_value=100, step=5)
+    with col3:
+        st.number_input("Volatilità Costi (%)", key="volatilita_costi",
+                      on_change=revalidate, args=("volatilita_costi",),
+                      min_value=0, max_value=100, step=5)
+    with col4:
+        st.number_input("Simulazioni", key="simulazioni",
+                      on_change=revalidate, args=("simulazioni",),
+                      min_value=100, max_value=20000, step=500)
+    
+    ricavi, costi = schema.financial_plan(st.session_state)
+    if any(ricavi) or any(costi):
+        proiezione = projections.project(ricavi, costi,
+                                         st.session_state['variazione_scenari'] / 100,
+                                         st.session_state['volatilita_ricavi'] / 100,
+                                         st.session_state['volatilita_costi'] / 100,
+                                         int(st.session_state['simulazioni']))
+        cols = st.columns(3)
+        for col, nome in zip(cols, ('peggiore', 'base', 'migliore')):
+            with col:
+                st.metric(f"Profitto Scenario {nome.capitalize()}",
+                          f"€ {proiezione.scenari[nome][2].sum():,.2f}")
+                anno = proiezione.pareggio[nome]
+                st.caption(f"Pareggio nell'anno {anno}" if anno else "Pareggio non raggiunto")
+        
+        bande = pd.DataFrame({f"P{p}": valori for p, valori in proiezione.percentili.items()},
+                             index=pd.Index(proiezione.anni, name="Anno"))
+        st.line_chart(bande)
+        mediano = ("" if np.isnan(proiezione.pareggio_mediano)
+                   else f", anno mediano {proiezione.pareggio_mediano:.0f}")
+        st.caption("Profitto cumulato per percentile delle simulazioni. "
+                   f"Pareggio raggiunto nel {proiezione.prob_pareggio:.0%} dei casi{mediano}.")
+    
     # Caricamento documenti aggiuntivi
     st.subheader("Documenti Aggiuntivi")
     st.markdown("""
@@ -607,66 +1010,77 @@ with tab_piano_finanziario:
     - Report finanziari
     - Altri documenti rilevanti
     """)
-    doc_finanziari = st.file_uploader("Carica documenti finanziari",
-                                    accept_multiple_files=True,
-                                    key="doc_finanziari")
+    doc_finanziari = attachment_uploader("Carica documenti finanziari", "doc_finanziari",
+                                         accept_multiple_files=True)
     
     # Link utili
     st.subheader("Risorse Online")
-    st.text_input("Sito Web Aziendale", key="sito_web",
+    st.text_input("Sito Web Aziendale", key="sito_web", on_change=revalidate, args=("sito_web",),
                  placeholder="Inserisci l'URL del tuo sito web")
+    show_issue('sito_web')
     st.text_input("Siti Web Concorenti", key="siti_concorrenti",
+                 on_change=revalidate, args=("siti_concorrenti",),
                  placeholder="Inserisci URL separati da virgola")
+    show_issue('siti_concorrenti')
     st.text_input("Fonti di Ricerca di Mercato", key="fonti_mercato",
+                 on_change=revalidate, args=("fonti_mercato",),
                  placeholder="Inserisci URL di ricerche di mercato")
+    show_issue('fonti_mercato')
+    
+    # Verifica dei link inseriti, senza attendere le risposte
+    verifiche_in_corso = False
+    for url in websites.split_urls(" ".join(st.session_state.get(key) or ""
+                                            for key in ('sito_web', 'siti_concorrenti',
+                                                        'fonti_mercato'))):
+        verifiche_in_corso |= link_status(url)
+    if verifiche_in_corso:
+        st.button("🔄 Aggiorna stato dei link", key="aggiorna_link_risorse")
+
+    finish_fragment()
+
+
+# Ogni scheda è un frammento rieseguibile in modo indipendente
+with tab_info_generali:
+    render_info_generali()
+
+with tab_allegati_iniziali:
+    render_allegati_iniziali()
+
+with tab_prodotto_servizio:
+    render_prodotto_servizio()
+
+with tab_analisi_mercato:
+    render_analisi_mercato()
+
+with tab_strategia:
+    render_strategia()
+
+with tab_team:
+    render_team()
+
+with tab_piano_finanziario:
+    render_piano_finanziario()
+
+st.markdown("---")
 
 # Sidebar con bottone di invio
-with st.sidebar:
+with st.sidebar, profiler.section("Sidebar"):
     st.header("Invio Dati")
-    # Funzione per validare i dati prima dell'invio
-    def validate_data():
-        required_fields = [
-            'nome_azienda', 'motivazione_bp', 'descrizione_attivita', 'nome_prodotto',
-            'mercato_target', 'strategia_marketing', 'piano_operativo',
-            'canali_distribuzione', 'nome_fondatore', 'ruolo_fondatore',
-            'esperienza_team'
-        ]
-        
-        missing_fields = [f for f in required_fields if not st.session_state.get(f, "").strip()]
-        return missing_fields
-
-    # Funzione per generare JSON scaricabile
-    def generate_json():
-        data = {
-            'info_generali': {
-                'nome_azienda': st.session_state.get('nome_azienda'),
-                'motivazione_bp': st.session_state.get('motivazione_bp'),
-                'forma_giuridica': st.session_state.get('forma_giuridica'),
-                'partita_iva': st.session_state.get('partita_iva'),
-                'capitale_sociale': st.session_state.get('capitale_sociale'),
-                'email_aziendale': st.session_state.get('email_aziendale'),
-                'stato_azienda': st.session_state.get('stato_azienda'),
-                'descrizione_attivita': st.session_state.get('descrizione_attivita'),
-                'contesto_aziendale': st.session_state.get('contesto_aziendale'),
-                'storia_aziendale': st.session_state.get('storia_aziendale'),
-                'obiettivi_aziendali': st.session_state.get('obiettivi_aziendali')
-            },
-            'prodotto_servizio': {
-                'nome_prodotto': st.session_state.get('nome_prodotto'),
-                'descrizione': st.session_state.get('descrizione_prodotto')
-            },
-            'finanziario': {
-                'proiezioni': proiezioni,
-                'documenti': [f.name for f in doc_finanziari] if doc_finanziari else []
-            }
-        }
-        return data
-
+    issues = validation.session_issues(st.session_state)
+    if issues.errors:
+        with st.expander(f"⚠️ {len(issues.errors)} campi da correggere"):
+            for key, message in issues.errors.items():
+                st.caption(f"**{key}**: {message}")
     if st.button("Invia Informazioni", type="primary", use_container_width=True):
-        missing_fields = validate_data()
+        missing_fields = schema.validate_data(st.session_state)
         
-        if missing_fields:
-            st.error(f"Campi obbligatori mancanti: {', '.join(missing_fields)}")
+        # riepilogo, esportazione e archivio usano tutti i dati compilati
+        memory.load(st.session_state)
+        if missing_fields or issues.errors:
+            if missing_fields:
+                st.error(f"Campi obbligatori mancanti: {', '.join(missing_fields)}")
+            if issues.errors:
+                st.error(f"Campi non validi: {', '.join(issues.errors)}")
         else:
             st.subheader("Riepilogo Dati")
             col1, col2 = st.columns(2)
@@ -683,35 +1097,71 @@ with st.sidebar:
                 st.write(f"- Mercato Target: {st.session_state.get('mercato_target')}")
             
             # Genera e scarica JSON
-            json_data = generate_json()
+            with profiler.section("generate_json"):
+                json_data = schema.generate_json(st.session_state,
+                                                schema.calculate_projections(st.session_state))
             st.download_button(
                 label="Scarica Dati in JSON",
-                data=json.dumps(json_data, indent=2),
+                # serializzato solo quando si preme il pulsante
+                data=lambda: json.dumps(json_data, indent=2),
                 file_name=f"business_plan_{st.session_state.get('nome_azienda')}.json",
                 mime="application/json"
             )
             
-            st.success("Informazioni validate e pronte per l'invio!")
+            # Invii precedenti con un testo molto simile (lo stesso piano
+            # ripresentato, magari con un altro nome): segnalati, non bloccanti.
+            # Solo con i testi già estratti, altrimenti il controllo viene
+            # rimandato a un lavoro in background
+            with profiler.section("duplicati"):
+                simili = duplicates.index.similar_cached(st.session_state)
+            
+            # Registra l'invio nell'archivio lato server
+            receipt = submissions.sink.append(json_data,
+                                              dict(schema.persistent_items(st.session_state)))
+            if receipt.wait(timeout=5) and receipt.durable:
+                st.success(f"Informazioni validate e registrate (invio {receipt.id[:8]})")
+                # il nuovo invio entra nell'indice dei duplicati in background
+                duplicates.index.schedule()
+            else:
+                st.error("Non è stato possibile registrare l'invio, riprova più tardi")
+            if simili is None:
+                try:
+                    st.session_state['_duplicati'] = duplicates.index.check_later(
+                        st.session_state, memory.session_id(), exclude=receipt.id).id
+                except jobs.Busy:
+                    st.session_state['_duplicati'] = None
+            else:
+                st.session_state['_duplicati'] = None
+                show_duplicates(simili)
+
+    # Esito del controllo dei duplicati rimandato
+    job = jobs.scheduler.poll(st.session_state.get('_duplicati'))
+    if job is not None and not job.finished:
+        duplicates_progress(job.id)
+    elif job is not None and job.done:
+        show_duplicates(job.result)
     
+    st.markdown("---")
+    export_panel()
+
     # Aggiunta di elementi grafici alla sidebar
     st.markdown("---")
     st.markdown("### Progresso Compilazione")
-    progress_value = calculate_progress()
-    st.progress(progress_value)
+    st.progress(summary.progress)
     
     # Mostra indicatori per ogni tab
     st.markdown("**Completamento Sezioni:**")
-    tabs = {
-        "Informazioni Generali": ['nome_azienda', 'motivazione_bp'],
-        "Prodotto/Servizio": ['nome_prodotto'],
-        "Analisi di Mercato": ['mercato_target'],
-        "Strategia": ['strategia_marketing', 'piano_operativo', 'canali_distribuzione'],
-        "Team": ['nome_fondatore', 'ruolo_fondatore', 'esperiencia_team']
-    }
-    
-    for tab_name, fields in tabs.items():
-        completed = sum(1 for f in fields if st.session_state.get(f, "").strip())
-        total = len(fields)
+    for tab_name, (completed, total) in summary.sections.items():
         st.markdown(f"- {tab_name}: {'✅' if completed == total else '🟡'} ({completed}/{total})")
     
-    st.caption(f"Completamento totale: {int(progress_value*100)}%")
\ No newline at end of file
+    st.caption(f"Completamento totale: {int(summary.progress*100)}%")
+    
+    st.caption("Le informazioni vengono salvate automaticamente. Per riprendere "
+               f"la compilazione usa il link con `?bozza={st.session_state['_bozza']['token']}`")
+
+autosave()
+memory.end(st.session_state)
+
+if profiler.panel_requested():
+    profiler.render_panel()
+profiler.end(st.session_state)
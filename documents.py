@@ -0,0 +1,778 @@
+# Esportazione del business plan in DOCX, PDF e Markdown.
+#
+# Il documento viene descritto come una sequenza di blocchi (titoli, campi,
+# tabelle, immagini) ricavata dal JSON di schema.generate_json; ciascun
+# formato ha uno scrittore che riceve i blocchi uno alla volta e li scrive
+# direttamente su file. Le immagini dei prodotti non passano mai per intero
+# dalla memoria: vengono copiate a blocchi dall'archivio degli allegati
+# dentro il documento. La generazione è un lavoro in blocco del pianificatore
+# condiviso (jobs) e la pagina ne legge l'avanzamento con poll(), che non
+# blocca mai; il file finito resta su disco, indicizzato per impronta dei
+# dati, finché non viene scaricato.
+# Lo stesso worker produce il pacchetto zip con tutti gli allegati (bundles).
+import base64
+import hashlib
+import io
+import os
+import threading
+import time
+import unicodedata
+import zipfile
+import zlib
+from dataclasses import dataclass
+from pathlib import Path
+from xml.sax.saxutils import escape
+
+from PIL import Image, UnidentifiedImageError
+
+import bundles
+import jobs
+import settings
+from attachments import Handle, store
+from drafts import encode
+
+SECTION_TITLES = {
+    'info_generali': "Informazioni Generali",
+    'prodotto_servizio': "Prodotto/Servizio",
+    'analisi_mercato': "Analisi di Mercato",
+    'swot': "Analisi SWOT",
+    'strategia': "Strategia e Implementazione",
+    'team': "Team di Gestione",
+    'finanziario': "Piano Finanziario",
+}
+
+LABELS = {
+    'nome_azienda': "Nome dell'Azienda",
+    'motivazione_bp': "Motivazione del Business Plan",
+    'forma_giuridica': "Forma Giuridica",
+    'partita_iva': "Partita IVA",
+    'capitale_sociale': "Capitale Sociale (€)",
+    'email_aziendale': "Email Aziendale",
+    'stato_azienda': "Stato Azienda",
+    'descrizione_attivita': "Descrizione dell'Attività",
+    'contesto_aziendale': "Contesto Aziendale",
+    'storia_aziendale': "Storia Aziendale",
+    'obiettivi_aziendali': "Obiettivi Aziendali",
+    'sito_web': "Sito Web",
+    'nome_prodotto': "Prodotto/Servizio Principale",
+    'descrizione': "Descrizione",
+    'mercato_target': "Descrizione del Mercato",
+    'punti_forza': "Punti di Forza",
+    'punti_debolezza': "Punti di Debolezza",
+    'opportunita': "Opportunità",
+    'minacce': "Minacce",
+    'strategia_marketing': "Strategia di Marketing",
+    'piano_operativo': "Piano Operativo",
+    'canali_distribuzione': "Canali di Distribuzione",
+    'budget_marketing': "Budget Marketing (€)",
+    'nome_fondatore': "Fondatore",
+    'ruolo_fondatore': "Ruolo del Fondatore",
+    'esperienza_team': "Esperienza del Team",
+    'anni_bp': "Durata del Piano (anni)",
+    'prezzo_indicativo': "Prezzo Indicativo",
+    'investimento_iniziale': "Investimento Iniziale (€)",
+    'note_proiezioni': "Note sulle Proiezioni",
+}
+
+# Colonne delle liste esportate come tabelle
+TABLES = {
+    'concorrenti': ("Concorrenti", (('nome', "Nome"), ('url', "Sito"), ('note', "Note"))),
+    'membri': ("Membri del Team", (('nome', "Nome"), ('ruolo', "Ruolo"),
+                                   ('esperienza', "Esperienza"))),
+}
+
+MONEY = ('capitale_sociale', 'budget_marketing')
+
+
+def _money(value):
+    return f"€ {value or 0:,.2f}"
+
+
+def _text(value):
+    if value is None:
+        return ""
+    if isinstance(value, float) and value.is_integer():
+        value = int(value)
+    return str(value).strip()
+
+
+def _handle(value):
+    if isinstance(value, Handle):
+        return value
+    if isinstance(value, dict) and 'digest' in value:
+        return Handle.from_dict(value)
+    return None
+
+
+# Sequenza dei blocchi del documento: (metodo dello scrittore, argomenti).
+# Le immagini restano Handle, quindi la sequenza intera occupa pochi KB
+def outline(data):
+    info = data.get('info_generali', {})
+    yield 'title', f"Business Plan — {_text(info.get('nome_azienda')) or 'Senza nome'}"
+    for section, values in data.items():
+        yield 'heading', 1, SECTION_TITLES.get(section, section.replace("_", " ").title())
+        if section == 'finanziario':
+            yield from _financial(values)
+            continue
+        for name, value in values.items():
+            if name == 'prodotti':
+                yield from _products(value)
+            elif name in TABLES:
+                title, columns = TABLES[name]
+                if value:
+                    yield 'heading', 2, title
+                    yield 'table', tuple(label for _, label in columns), tuple(
+                        tuple(_text(entry.get(attr)) for attr, _ in columns) for entry in value)
+            elif name in MONEY:
+                yield 'field', LABELS.get(name, name), _money(value)
+            elif _text(value):
+                yield 'field', LABELS.get(name, name), _text(value)
+
+
+def _products(products):
+    for i, product in enumerate(products, 1):
+        yield 'heading', 2, _text(product.get('nome')) or f"Prodotto/Servizio #{i}"
+        if _text(product.get('descrizione')):
+            yield 'paragraph', _text(product['descrizione'])
+        handle = _handle(product.get('immagine'))
+        if handle is not None and store.exists(handle.digest):
+            yield 'image', handle, f"Immagine: {handle.name}"
+
+
+def _financial(values):
+    if values.get('anni_bp'):
+        yield 'field', LABELS['anni_bp'], _text(values['anni_bp'])
+    if values.get('investimento_iniziale'):
+        yield 'field', LABELS['investimento_iniziale'], _money(values['investimento_iniziale'])
+    proiezioni = values.get('proiezioni') or {}
+    if proiezioni:
+        yield 'heading', 2, "Proiezioni Annuali"
+        rows = tuple((f"Anno {anno}", _money(p['ricavi']), _money(p['costi']),
+                      _money(p['profitto']))
+                     for anno, p in sorted(proiezioni.items(), key=lambda item: int(item[0])))
+        totali = values.get('riepilogo') or {}
+        if totali:
+            rows += (("Totale", _money(totali['ricavi']), _money(totali['costi']),
+                      _money(totali['profitto'])),)
+        yield 'table', ("Anno", "Ricavi", "Costi", "Profitto"), rows
+    if _text(values.get('note_proiezioni')):
+        yield 'paragraph', _text(values['note_proiezioni'])
+    if values.get('documenti'):
+        yield 'heading', 2, "Documenti Allegati"
+        yield 'bullets', tuple(values['documenti'])
+
+
+def _image_size(handle):
+    try:
+        with Image.open(store.path(handle.digest)) as img:
+            return img.size, img.format, img.mode
+    except (UnidentifiedImageError, OSError):
+        return None
+
+
+def _mime(handle):
+    if handle.mime:
+        return handle.mime
+    return "image/png" if handle.name.lower().endswith(".png") else "image/jpeg"
+
+
+class MarkdownWriter:
+    extension = "md"
+    mime = "text/markdown"
+
+    def __init__(self, out):
+        self.out = out
+
+    def _write(self, text):
+        self.out.write(text.encode("utf-8"))
+
+    def title(self, text):
+        self._write(f"# {text}\n\n")
+
+    def heading(self, level, text):
+        self._write(f"{'#' * (level + 1)} {text}\n\n")
+
+    def field(self, label, text):
+        if "\n" in text:
+            self._write(f"**{label}**\n\n{text}\n\n")
+        else:
+            self._write(f"**{label}:** {text}\n\n")
+
+    def paragraph(self, text):
+        self._write(f"{text}\n\n")
+
+    def bullets(self, items):
+        self._write("".join(f"- {item}\n" for item in items) + "\n")
+
+    def table(self, headers, rows):
+        def cells(values):
+            return "| " + " | ".join(v.replace("|", "\\|").replace("\n", "<br>")
+                                     for v in values) + " |\n"
+        self._write(cells(headers) + "|" + "---|" * len(headers) + "\n")
+        for row in rows:
+            self._write(cells(row))
+        self._write("\n")
+
+    # Immagine incorporata come data URI, codificata a blocchi multipli di 3
+    # byte così il base64 si concatena senza riempimenti intermedi
+    def image(self, handle, caption):
+        self._write(f"![{caption}](data:{_mime(handle)};base64,")
+        for chunk in store.iter_chunks(handle, chunk_size=3 * 256 * 1024):
+            self.out.write(base64.b64encode(chunk))
+        self._write(")\n\n")
+
+    def close(self):
+        pass
+
+
+_DOCX_NS = ('xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main" '
+            'xmlns:r="http://schemas.openxmlformats.org/officeDocument/2006/relationships" '
+            'xmlns:wp="http://schemas.openxmlformats.org/drawingml/2006/wordprocessingDrawing" '
+            'xmlns:a="http://schemas.openxmlformats.org/drawingml/2006/main" '
+            'xmlns:pic="http://schemas.openxmlformats.org/drawingml/2006/picture"')
+
+_DOCX_STYLES = """<?xml version="1.0" encoding="UTF-8" standalone="yes"?>
+<w:styles xmlns:w="http://schemas.openxmlformats.org/wordprocessingml/2006/main">
+<w:docDefaults><w:rPrDefault><w:rPr><w:rFonts w:ascii="Calibri" w:hAnsi="Calibri"/>
+<w:sz w:val="22"/><w:lang w:val="it-IT"/></w:rPr></w:rPrDefault>
+<w:pPrDefault><w:pPr><w:spacing w:after="120"/></w:pPr></w:pPrDefault></w:docDefaults>
+<w:style w:type="paragraph" w:default="1" w:styleId="Normal"><w:name w:val="Normal"/></w:style>
+<w:style w:type="paragraph" w:styleId="Title"><w:name w:val="Title"/><w:basedOn w:val="Normal"/>
+<w:pPr><w:spacing w:after="240"/></w:pPr><w:rPr><w:b/><w:sz w:val="48"/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="Heading1"><w:name w:val="heading 1"/>
+<w:basedOn w:val="Normal"/><w:pPr><w:keepNext/><w:spacing w:before="360" w:after="120"/>
+<w:outlineLvl w:val="0"/></w:pPr><w:rPr><w:b/><w:color w:val="1F3864"/><w:sz w:val="32"/></w:rPr>
+</w:style>
+<w:style w:type="paragraph" w:styleId="Heading2"><w:name w:val="heading 2"/>
+<w:basedOn w:val="Normal"/><w:pPr><w:keepNext/><w:spacing w:before="240" w:after="80"/>
+<w:outlineLvl w:val="1"/></w:pPr><w:rPr><w:b/><w:sz w:val="26"/></w:rPr></w:style>
+<w:style w:type="paragraph" w:styleId="Caption"><w:name w:val="caption"/>
+<w:basedOn w:val="Normal"/><w:rPr><w:i/><w:sz w:val="18"/></w:rPr></w:style>
+<w:style w:type="table" w:styleId="TableGrid"><w:name w:val="Table Grid"/><w:tblPr><w:tblBorders>
+<w:top w:val="single" w:sz="4" w:color="999999"/><w:left w:val="single" w:sz="4" w:color="999999"/>
+<w:bottom w:val="single" w:sz="4" w:color="999999"/><w:right w:val="single" w:sz="4" w:color="999999"/>
+<w:insideH w:val="single" w:sz="4" w:color="999999"/><w:insideV w:val="single" w:sz="4" w:color="999999"/>
+</w:tblBorders><w:tblCellMar><w:left w:w="80" w:type="dxa"/><w:right w:w="80" w:type="dxa"/>
+</w:tblCellMar></w:tblPr></w:style>
+</w:styles>"""
+
+_EMU_PER_PX = 9525          # a 96 dpi
+_DOCX_MAX_WIDTH = 5760720   # 16 cm
+
+
+class DocxWriter:
+    extension = "docx"
+    mime = "application/vnd.openxmlformats-officedocument.wordprocessingml.document"
+
+    def __init__(self, out):
+        self.zip = zipfile.ZipFile(out, "w", zipfile.ZIP_DEFLATED)
+        # il corpo del documento viene scritto in streaming; le immagini si
+        # aggiungono all'archivio dopo averlo chiuso
+        self.doc = self.zip.open("word/document.xml", "w")
+        self.doc.write(f'<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                       f'<w:document {_DOCX_NS}><w:body>'.encode("utf-8"))
+        self.media = []     # (rId, percorso nell'archivio, Handle)
+
+    def _write(self, xml):
+        self.doc.write(xml.encode("utf-8"))
+
+    @staticmethod
+    def _runs(text, bold=False):
+        props = "<w:rPr><w:b/></w:rPr>" if bold else ""
+        lines = [f'<w:t xml:space="preserve">{escape(line)}</w:t>' for line in text.split("\n")]
+        return f"<w:r>{props}{'<w:br/>'.join(lines)}</w:r>"
+
+    def _paragraph(self, runs, style=None):
+        props = f'<w:pPr><w:pStyle w:val="{style}"/></w:pPr>' if style else ""
+        self._write(f"<w:p>{props}{runs}</w:p>")
+
+    def title(self, text):
+        self._paragraph(self._runs(text), "Title")
+
+    def heading(self, level, text):
+        self._paragraph(self._runs(text), f"Heading{level}")
+
+    def field(self, label, text):
+        if "\n" in text:
+            self._paragraph(self._runs(label, bold=True))
+            self.paragraph(text)
+        else:
+            self._paragraph(self._runs(f"{label}: ", bold=True) + self._runs(text))
+
+    def paragraph(self, text):
+        for block in text.split("\n\n"):
+            self._paragraph(self._runs(block))
+
+    def bullets(self, items):
+        for item in items:
+            self._paragraph(self._runs(f"• {item}"))
+
+    def table(self, headers, rows):
+        def row(values, bold=False):
+            return "<w:tr>" + "".join(f"<w:tc><w:p>{self._runs(v, bold)}</w:p></w:tc>"
+                                      for v in values) + "</w:tr>"
+        self._write('<w:tbl><w:tblPr><w:tblStyle w:val="TableGrid"/>'
+                    '<w:tblW w:w="5000" w:type="pct"/></w:tblPr>' + row(headers, bold=True))
+        for values in rows:
+            self._write(row(values))
+        self._write("</w:tbl><w:p/>")
+
+    def image(self, handle, caption):
+        info = _image_size(handle)
+        if info is None:
+            self._paragraph(self._runs(f"{caption} (non disponibile)"), "Caption")
+            return
+        (width, height), image_format, _ = info
+        number = len(self.media) + 1
+        rid = f"rIdImg{number}"
+        extension = "png" if image_format == "PNG" else "jpeg"
+        self.media.append((rid, f"media/image{number}.{extension}", handle))
+        cx = width * _EMU_PER_PX
+        cy = height * _EMU_PER_PX
+        if cx > _DOCX_MAX_WIDTH:
+            cx, cy = _DOCX_MAX_WIDTH, cy * _DOCX_MAX_WIDTH // cx
+        name = escape(handle.name, {'"': "&quot;"})
+        self._write(
+            f'<w:p><w:r><w:drawing><wp:inline><wp:extent cx="{cx}" cy="{cy}"/>'
+            f'<wp:docPr id="{number}" name="{name}"/>'
+            '<a:graphic><a:graphicData uri="http://schemas.openxmlformats.org/drawingml/2006/picture">'
+            f'<pic:pic><pic:nvPicPr><pic:cNvPr id="{number}" name="{name}"/><pic:cNvPicPr/>'
+            f'</pic:nvPicPr><pic:blipFill><a:blip r:embed="{rid}"/><a:stretch><a:fillRect/>'
+            '</a:stretch></pic:blipFill><pic:spPr><a:xfrm><a:off x="0" y="0"/>'
+            f'<a:ext cx="{cx}" cy="{cy}"/></a:xfrm><a:prstGeom prst="rect"><a:avLst/>'
+            '</a:prstGeom></pic:spPr></pic:pic></a:graphicData></a:graphic></wp:inline>'
+            '</w:drawing></w:r></w:p>')
+        self._paragraph(self._runs(caption), "Caption")
+
+    def close(self):
+        # A4 con margini di 2 cm
+        self._write('<w:sectPr><w:pgSz w:w="11906" w:h="16838"/><w:pgMar w:top="1134" '
+                    'w:right="1134" w:bottom="1134" w:left="1134" w:header="709" '
+                    'w:footer="709" w:gutter="0"/></w:sectPr></w:body></w:document>')
+        self.doc.close()
+        for _, target, handle in self.media:
+            # immagini già compresse: archiviate senza ricompressione
+            info = zipfile.ZipInfo(f"word/{target}", time.localtime()[:6])
+            info.compress_type = zipfile.ZIP_STORED
+            with self.zip.open(info, "w") as member:
+                for chunk in store.iter_chunks(handle):
+                    member.write(chunk)
+        relationships = "".join(
+            f'<Relationship Id="{rid}" Type="http://schemas.openxmlformats.org/officeDocument/'
+            f'2006/relationships/image" Target="{target}"/>' for rid, target, _ in self.media)
+        self.zip.writestr("word/_rels/document.xml.rels",
+                          '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                          '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+                          'relationships"><Relationship Id="rIdStyles" Type="http://schemas.'
+                          'openxmlformats.org/officeDocument/2006/relationships/styles" '
+                          f'Target="styles.xml"/>{relationships}</Relationships>')
+        self.zip.writestr("word/styles.xml", _DOCX_STYLES)
+        self.zip.writestr("_rels/.rels",
+                          '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                          '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/'
+                          'relationships"><Relationship Id="rId1" Type="http://schemas.'
+                          'openxmlformats.org/officeDocument/2006/relationships/officeDocument" '
+                          'Target="word/document.xml"/></Relationships>')
+        self.zip.writestr("[Content_Types].xml",
+                          '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>'
+                          '<Types xmlns="http://schemas.openxmlformats.org/package/2006/'
+                          'content-types"><Default Extension="rels" ContentType="application/'
+                          'vnd.openxmlformats-package.relationships+xml"/><Default '
+                          'Extension="xml" ContentType="application/xml"/><Default '
+                          'Extension="png" ContentType="image/png"/><Default Extension="jpeg" '
+                          'ContentType="image/jpeg"/><Override PartName="/word/document.xml" '
+                          'ContentType="application/vnd.openxmlformats-officedocument.'
+                          'wordprocessingml.document.main+xml"/><Override PartName="/word/'
+                          'styles.xml" ContentType="application/vnd.openxmlformats-'
+                          'officedocument.wordprocessingml.styles+xml"/></Types>')
+        self.zip.close()
+
+
+# Larghezze dei caratteri ASCII 32-126 di Helvetica e Helvetica-Bold, in
+# millesimi della dimensione del carattere (metriche AFM dei font standard PDF)
+_HELVETICA = (
+    "278 278 355 556 556 889 667 191 333 333 389 584 278 333 278 278 556 556 556 556 "
+    "556 556 556 556 556 556 278 278 584 584 584 556 1015 667 667 722 722 667 611 778 "
+    "722 278 500 667 556 833 722 778 667 778 722 667 611 722 667 944 667 667 611 278 "
+    "278 278 469 556 333 556 556 500 556 556 278 556 556 222 222 500 222 833 556 556 "
+    "556 556 333 500 278 556 500 722 500 500 500 334 260 334 584")
+_HELVETICA_BOLD = (
+    "278 333 474 556 556 889 722 238 333 333 389 584 278 333 278 278 556 556 556 556 "
+    "556 556 556 556 556 556 333 333 584 584 584 611 975 722 722 722 722 667 611 778 "
+    "722 278 556 722 611 833 722 778 667 778 722 667 611 722 667 944 667 667 611 333 "
+    "278 333 584 556 333 556 611 556 611 556 333 611 611 278 278 556 278 889 611 611 "
+    "611 611 389 556 333 611 556 778 556 556 500 389 280 389 584")
+_WIDTHS = {font: dict(zip(map(chr, range(32, 127)), map(int, table.split())))
+           for font, table in (('F1', _HELVETICA), ('F2', _HELVETICA_BOLD))}
+
+_PAGE_WIDTH, _PAGE_HEIGHT = 595.28, 841.89     # A4 in punti
+_MARGIN = 56.7                                  # 2 cm
+_BODY = 10
+_LEADING = 1.35
+
+
+def _char_width(font, char):
+    widths = _WIDTHS[font]
+    if char not in widths:
+        # lettere accentate: larghezza della lettera base
+        char = unicodedata.normalize("NFD", char)[0]
+    return widths.get(char, 556)
+
+
+def _text_width(text, font, size):
+    return sum(_char_width(font, c) for c in text) * size / 1000
+
+
+# Spezza il testo in righe che stanno nella larghezza data
+def _wrap(text, font, size, width):
+    lines = []
+    for paragraph in text.split("\n"):
+        line = ""
+        for word in paragraph.split(" "):
+            candidate = f"{line} {word}" if line else word
+            if _text_width(candidate, font, size) <= width:
+                line = candidate
+                continue
+            if line:
+                lines.append(line)
+            # parola più lunga della riga: spezzata carattere per carattere
+            while _text_width(word, font, size) > width:
+                cut = 1
+                while _text_width(word[:cut + 1], font, size) <= width:
+                    cut += 1
+                lines.append(word[:cut])
+                word = word[cut:]
+            line = word
+        lines.append(line)
+    return lines
+
+
+def _pdf_string(text):
+    raw = text.encode("cp1252", "replace")
+    return b"(" + raw.replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)") + b")"
+
+
+# Stringa per i metadati del documento, in UTF-16 come richiesto dal formato
+def _pdf_unicode(text):
+    return b"<FEFF" + text.encode("utf-16-be").hex().upper().encode("ascii") + b">"
+
+
+class PdfWriter:
+    extension = "pdf"
+    mime = "application/pdf"
+
+    # oggetti riservati: catalogo, albero delle pagine, due font
+    _CATALOG, _PAGES, _FONT, _FONT_BOLD = 1, 2, 3, 4
+
+    def __init__(self, out, title=""):
+        self.out = out
+        self.position = 0
+        self.offsets = {}
+        self.next_id = 5
+        self.pages = []
+        self.document_title = title
+        self.width = _PAGE_WIDTH - 2 * _MARGIN
+        self._emit(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+        self._new_page()
+
+    def _emit(self, data):
+        self.out.write(data)
+        self.position += len(data)
+
+    def _begin_object(self, obj_id=None):
+        if obj_id is None:
+            obj_id = self.next_id
+            self.next_id += 1
+        self.offsets[obj_id] = self.position
+        self._emit(f"{obj_id} 0 obj\n".encode("ascii"))
+        return obj_id
+
+    def _object(self, body, obj_id=None):
+        obj_id = self._begin_object(obj_id)
+        self._emit(body + b"\nendobj\n")
+        return obj_id
+
+    # Pagina corrente: solo il suo contenuto resta in memoria
+    def _new_page(self):
+        self.ops = []
+        self.images = {}
+        self.y = _PAGE_HEIGHT - _MARGIN
+
+    def _finish_page(self):
+        number = len(self.pages) + 1
+        self._text(f"Pagina {number}", 'F1', 8, _PAGE_WIDTH - _MARGIN - 40, _MARGIN / 2)
+        content = zlib.compress(b"\n".join(self.ops))
+        content_id = self._object(b"<< /Length %d /Filter /FlateDecode >>\nstream\n"
+                                  % len(content) + content + b"\nendstream")
+        xobjects = b" ".join(b"/%s %d 0 R" % (name.encode(), obj_id)
+                             for name, obj_id in self.images.items())
+        self.pages.append(self._object(
+            b"<< /Type /Page /Parent %d 0 R /MediaBox [0 0 %.2f %.2f] /Contents %d 0 R "
+            b"/Resources << /Font << /F1 %d 0 R /F2 %d 0 R >> /XObject << %s >> >> >>"
+            % (self._PAGES, _PAGE_WIDTH, _PAGE_HEIGHT, content_id, self._FONT,
+               self._FONT_BOLD, xobjects)))
+
+    def _ensure(self, height):
+        if self.y - height < _MARGIN:
+            self._finish_page()
+            self._new_page()
+
+    def _text(self, text, font, size, x, y):
+        self.ops.append(b"BT /%s %.1f Tf %.2f %.2f Td %s Tj ET"
+                        % (font.encode(), size, x, y, _pdf_string(text)))
+
+    def _lines(self, text, font=None, size=_BODY, indent=0.0, after=None):
+        font = font or 'F1'
+        leading = size * _LEADING
+        for line in _wrap(text, font, size, self.width - indent):
+            self._ensure(leading)
+            self.y -= leading
+            self._text(line, font, size, _MARGIN + indent, self.y)
+        self.y -= size * 0.6 if after is None else after
+
+    def title(self, text):
+        self._lines(text, 'F2', 20, after=12)
+
+    def heading(self, level, text):
+        size = 15 if level == 1 else 12
+        # un titolo non resta mai da solo in fondo alla pagina
+        self._ensure(size * _LEADING + 3 * _BODY * _LEADING)
+        self.y -= size * 0.6
+        self._lines(text, 'F2', size, after=4)
+
+    def field(self, label, text):
+        self._ensure(2 * _BODY * _LEADING)
+        self._lines(label, 'F2', after=1)
+        self.paragraph(text)
+
+    def paragraph(self, text):
+        self._lines(text)
+
+    def bullets(self, items):
+        for item in items:
+            self._lines(f"• {item}", indent=8, after=1)
+        self.y -= _BODY * 0.6
+
+    def table(self, headers, rows):
+        columns = len(headers)
+        # colonne proporzionali al testo più lungo, con un minimo
+        longest = [max([len(headers[i])] + [len(row[i]) for row in rows]) for i in range(columns)]
+        weights = [min(max(n, 6), 60) for n in longest]
+        widths = [self.width * w / sum(weights) for w in weights]
+        padding = 3
+        leading = _BODY * _LEADING
+        for index, row in enumerate((headers,) + tuple(rows)):
+            font = 'F2' if index == 0 else 'F1'
+            cells = [_wrap(value, font, _BODY, width - 2 * padding)
+                     for value, width in zip(row, widths)]
+            height = max(len(lines) for lines in cells) * leading + 2 * padding
+            self._ensure(height)
+            x = _MARGIN
+            for lines, width in zip(cells, widths):
+                self.ops.append(b"0.6 G %.2f %.2f %.2f %.2f re S"
+                                % (x, self.y - height, width, height))
+                for n, line in enumerate(lines, 1):
+                    self._text(line, font, _BODY, x + padding,
+                               self.y - padding - n * leading + _BODY * 0.3)
+                x += width
+            self.y -= height
+        self.y -= _BODY
+
+    # Le immagini JPEG passano nel PDF così come sono, a blocchi; gli altri
+    # formati vengono ricodificati in JPEG
+    def image(self, handle, caption):
+        info = _image_size(handle)
+        if info is None:
+            self._lines(f"{caption} (non disponibile)")
+            return
+        (width, height), image_format, mode = info
+        scale = min(1.0, self.width / width, (_PAGE_HEIGHT - 2 * _MARGIN) * 0.45 / height)
+        shown_width, shown_height = width * scale, height * scale
+        self._ensure(shown_height + _BODY * 2)
+        if image_format == "JPEG" and mode in ("RGB", "L"):
+            obj_id = self._jpeg(width, height, mode, handle.size, store.iter_chunks(handle))
+        else:
+            data = _as_jpeg(handle)
+            obj_id = self._jpeg(width, height, "RGB", len(data), (data,))
+        name = f"Im{obj_id}"
+        self.images[name] = obj_id
+        self.y -= shown_height
+        self.ops.append(b"q %.2f 0 0 %.2f %.2f %.2f cm /%s Do Q"
+                        % (shown_width, shown_height, _MARGIN, self.y, name.encode()))
+        self.y -= 4
+        self._lines(caption, size=8)
+
+    def _jpeg(self, width, height, mode, length, chunks):
+        obj_id = self._begin_object()
+        colorspace = b"/DeviceGray" if mode == "L" else b"/DeviceRGB"
+        self._emit(b"<< /Type /XObject /Subtype /Image /Width %d /Height %d /ColorSpace %s "
+                   b"/BitsPerComponent 8 /Filter /DCTDecode /Length %d >>\nstream\n"
+                   % (width, height, colorspace, length))
+        for chunk in chunks:
+            self._emit(chunk)
+        self._emit(b"\nendstream\nendobj\n")
+        return obj_id
+
+    def close(self):
+        self._finish_page()
+        for obj_id, font in ((self._FONT, b"Helvetica"), (self._FONT_BOLD, b"Helvetica-Bold")):
+            self._object(b"<< /Type /Font /Subtype /Type1 /BaseFont /%s "
+                         b"/Encoding /WinAnsiEncoding >>" % font, obj_id)
+        kids = b" ".join(b"%d 0 R" % page for page in self.pages)
+        self._object(b"<< /Type /Pages /Kids [%s] /Count %d >>" % (kids, len(self.pages)),
+                     self._PAGES)
+        self._object(b"<< /Type /Catalog /Pages %d 0 R >>" % self._PAGES, self._CATALOG)
+        info_id = self._object(b"<< /Title %s /Producer (raccolta-business-plan) >>"
+                               % _pdf_unicode(self.document_title))
+        xref = self.position
+        entries = [b"0000000000 65535 f \n"]
+        entries += [b"%010d 00000 n \n" % self.offsets[obj_id]
+                    for obj_id in range(1, self.next_id)]
+        self._emit(b"xref\n0 %d\n" % self.next_id + b"".join(entries))
+        self._emit(b"trailer\n<< /Size %d /Root %d 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n"
+                   % (self.next_id, self._CATALOG, info_id, xref))
+
+
+def _as_jpeg(handle):
+    with Image.open(store.path(handle.digest)) as img:
+        if img.mode in ("RGBA", "LA", "P"):
+            img = img.convert("RGBA")
+            background = Image.new("RGB", img.size, "white")
+            background.paste(img, mask=img.getchannel("A"))
+            img = background
+        out = io.BytesIO()
+        img.convert("RGB").save(out, format="JPEG", quality=90)
+    return out.getvalue()
+
+
+WRITERS = {writer.extension: writer for writer in (DocxWriter, PdfWriter, MarkdownWriter)}
+MIME = {**{extension: writer.mime for extension, writer in WRITERS.items()},
+        bundles.EXTENSION: bundles.MIME}
+
+
+# Peso di un blocco nell'avanzamento: le immagini contano per dimensione
+def _weight(block):
+    if block[0] == 'image':
+        return 1 + block[1].size // (256 * 1024)
+    return 1
+
+
+# Scrive il documento (o il pacchetto zip con gli allegati) nel file
+# indicato, riportando l'avanzamento (0-1)
+def render(data, fmt, path, progress=None):
+    if fmt == bundles.EXTENSION:
+        with open(path, "wb") as out:
+            bundles.write(out, data, progress)
+        return
+    blocks = list(outline(data))
+    total = sum(map(_weight, blocks)) or 1
+    done = 0
+    with open(path, "wb") as out:
+        if fmt == "pdf":
+            writer = PdfWriter(out, title=blocks[0][1])
+        else:
+            writer = WRITERS[fmt](out)
+        for block in blocks:
+            getattr(writer, block[0])(*block[1:])
+            done += _weight(block)
+            if progress is not None:
+                progress(done / total)
+        writer.close()
+
+
+@dataclass
+class Job:
+    id: str
+    format: str
+    path: Path
+    progress: float = 0.0
+    done: bool = False
+    error: str = ""
+    task: jobs.Job = None       # lavoro del pianificatore
+
+    @property
+    def mime(self):
+        return MIME[self.format]
+
+
+class Exporter:
+    def __init__(self, root, ttl=settings.EXPORT_TTL, scheduler=None):
+        self.root = Path(root)
+        self.ttl = ttl
+        self.scheduler = scheduler if scheduler is not None else jobs.scheduler
+        self._jobs = {}
+        self._lock = threading.Lock()
+
+    # Elimina i documenti generati da più di ttl secondi; chiamata con il
+    # lock acquisito
+    def prune(self, now=None):
+        now = time.time() if now is None else now
+        removed = 0
+        for path in self.root.glob("*.*"):
+            try:
+                if now - path.stat().st_mtime > self.ttl:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                pass
+        # i lavori conclusi il cui file non c'è più vengono dimenticati
+        self._jobs = {job_id: job for job_id, job in self._jobs.items()
+                      if not (job.done or job.error) or job.path.exists()}
+        return removed
+
+    # Avvia l'esportazione per la sessione indicata, o riusa il lavoro con gli
+    # stessi dati e formato; non blocca mai. Solleva jobs.Busy se il
+    # pianificatore non accetta altri lavori
+    def start(self, data, fmt, session=None):
+        digest = hashlib.blake2b(f"{fmt}\n{encode(data)}".encode("utf-8"),
+                                 digest_size=16).hexdigest()
+        path = self.root / f"{digest}.{fmt}"
+        with self._lock:
+            job = self._jobs.get(digest)
+            if job is not None and not _failed(job) and (not job.done or path.exists()):
+                return job
+            self.root.mkdir(parents=True, exist_ok=True)
+            self.prune()
+            job = Job(digest, fmt, path)
+            if path.exists():
+                job.progress, job.done = 1.0, True
+            else:
+                job.task = self.scheduler.submit(self._run, job, data, priority=jobs.BULK,
+                                                 session=session)
+            self._jobs[digest] = job
+            return job
+
+    def poll(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            _failed(job)
+        return job
+
+    def _run(self, task, job, data):
+        tmp = job.path.with_suffix(".tmp")
+
+        def progress(value):
+            job.progress = value
+            task.report(value)
+
+        try:
+            render(data, job.format, tmp, progress=progress)
+            os.replace(tmp, job.path)
+            job.done = True
+        except jobs.Cancelled:
+            tmp.unlink(missing_ok=True)
+            raise
+        except Exception as exc:
+            tmp.unlink(missing_ok=True)
+            job.error = str(exc) or type(exc).__name__
+
+
+# Vero se l'esportazione è fallita o è stata annullata (anche prima di partire)
+def _failed(job):
+    if not job.error and job.task is not None and job.task.status == jobs.CANCELLED:
+        job.error = "Esportazione annullata"
+    return bool(job.error)
+
+
+exporter = Exporter(settings.EXPORT_DIR)
@@ -0,0 +1,311 @@
+# Salvataggio automatico delle bozze su SQLite in modalità WAL o su Redis.
+#
+# A ogni rerun vengono confrontati i dati compilati con quelli dell'ultimo
+# salvataggio e in coda finiscono solo le chiavi cambiate. Un unico thread di
+# scrittura per processo raccoglie le modifiche di tutte le sessioni per una
+# breve finestra (debounce) e le scrive in una sola transazione, quindi il
+# rerun non aspetta mai il disco. Ogni bozza è identificata da un token che,
+# messo nell'URL, permette di riprenderla dopo una disconnessione, anche da
+# un altro processo: con un backend condiviso (BP_SESSION_STORE) i worker non
+# hanno stato proprio e il bilanciatore non deve tenere le sessioni legate.
+import atexit
+import hashlib
+import json
+import queue
+import secrets
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+import schema
+import settings
+from attachments import Handle
+
+MAX_BATCH = 1000
+RETRY_AFTER = 1.0
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS draft_values (
+    token TEXT NOT NULL,
+    key TEXT NOT NULL,
+    value TEXT NOT NULL,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (token, key)
+) WITHOUT ROWID
+"""
+
+_UPSERT = """
+INSERT INTO draft_values (token, key, value, updated_at) VALUES (?, ?, ?, ?)
+ON CONFLICT (token, key) DO UPDATE
+SET value = excluded.value, updated_at = excluded.updated_at
+"""
+
+
+def _default(value):
+    if isinstance(value, Handle):
+        return {'__handle__': value.to_dict()}
+    if isinstance(value, schema.Entry):
+        return value.to_dict()
+    raise TypeError(f"valore non serializzabile: {type(value).__name__}")
+
+
+def _object_hook(data):
+    if '__handle__' in data:
+        return Handle.from_dict(data['__handle__'])
+    return data
+
+
+def encode(value):
+    return json.dumps(value, default=_default, ensure_ascii=False, separators=(',', ':'))
+
+
+def decode(text):
+    return json.loads(text, object_hook=_object_hook)
+
+
+def new_token():
+    return secrets.token_urlsafe(16)
+
+
+# Coda di scrittura comune ai backend: le modifiche di tutte le sessioni del
+# processo vengono raccolte per una breve finestra e applicate in blocco da un
+# unico thread. I backend implementano _open, _apply e load
+class DraftStore:
+    def __init__(self, debounce=settings.AUTOSAVE_DEBOUNCE):
+        self.debounce = debounce
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._lock = threading.Lock()
+        # modifiche non ancora scritte e flush() in attesa, usati solo dal
+        # thread di scrittura: dopo un errore del backend restano qui e si
+        # fondono con i batch successivi
+        self._pending = {}          # (token, chiave) -> (valore, ts)
+        self._waiters = []
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self._writer = threading.Thread(target=self._run, name="draft-writer",
+                                                daemon=True)
+                self._writer.start()
+                # allo spegnimento del worker le modifiche in coda vengono
+                # scritte prima di uscire
+                atexit.register(self.flush, settings.SESSION_STORE_DRAIN)
+
+    # Accoda le modifiche di una bozza; removed elenca le chiavi da eliminare
+    def save(self, token, changes, removed=()):
+        self._ensure_writer()
+        now = time.time()
+        for key, value in changes.items():
+            self._queue.put((token, key, value, now))
+        for key in removed:
+            self._queue.put((token, key, None, now))
+
+    # Attende che tutto ciò che è in coda sia stato scritto
+    def flush(self, timeout=None):
+        self._ensure_writer()
+        done = threading.Event()
+        self._queue.put(done)
+        return done.wait(timeout)
+
+    def _run(self):
+        conn = self._open()
+        while True:
+            try:
+                # con modifiche da ritentare la coda vuota non blocca il writer
+                batch = [self._queue.get(timeout=self.debounce if self._pending else None)]
+            except queue.Empty:
+                batch = []
+            deadline = time.monotonic() + self.debounce
+            while batch and len(batch) < MAX_BATCH:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._write(conn, batch)
+
+    # Per ogni (token, chiave) conta la modifica più recente per ts, non per
+    # ordine di arrivo: un batch ritentato non sovrascrive modifiche successive
+    def _write(self, conn, batch):
+        latest = self._pending
+        for item in batch:
+            if isinstance(item, threading.Event):
+                self._waiters.append(item)
+            else:
+                token, key, value, ts = item
+                current = latest.get((token, key))
+                if current is None or ts >= current[1]:
+                    latest[(token, key)] = (value, ts)
+
+        upserts = [(t, k, v, ts) for (t, k), (v, ts) in latest.items() if v is not None]
+        deletes = [(t, k) for (t, k), (v, ts) in latest.items() if v is None]
+        if upserts or deletes:
+            try:
+                self._apply(conn, upserts, deletes)
+            except Exception:
+                # backend momentaneamente non raggiungibile: le modifiche
+                # restano in sospeso e vengono ritentate insieme alle
+                # successive; chi attende flush() continua ad attendere
+                time.sleep(RETRY_AFTER)
+                return
+        latest.clear()
+        for done in self._waiters:
+            done.set()
+        self._waiters.clear()
+
+
+# Backend locale: un file SQLite in modalità WAL, condiviso dai processi
+# dello stesso host
+class SqliteDraftStore(DraftStore):
+    def __init__(self, path, debounce=settings.AUTOSAVE_DEBOUNCE):
+        super().__init__(debounce)
+        self.path = Path(path)
+        self._local = threading.local()
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(_SCHEMA)
+        return conn
+
+    # Connessione di sola lettura per thread: in WAL i lettori non bloccano
+    # lo scrittore
+    def _reader(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    def load(self, token):
+        rows = self._reader().execute(
+            "SELECT key, value FROM draft_values WHERE token = ?", (token,))
+        return {key: decode(value) for key, value in rows}
+
+    def _open(self):
+        return self._connect()
+
+    def _apply(self, conn, upserts, deletes):
+        with conn:
+            conn.executemany(_UPSERT, upserts)
+            conn.executemany(
+                "DELETE FROM draft_values WHERE token = ? AND key = ?", deletes)
+
+
+# Backend condiviso tra host: un hash Redis per bozza (campo = chiave dello
+# stato, valore = JSON). Basta un client con l'interfaccia di redis-py
+# (hset, hdel, hgetall, expire): nei test si può passare un
+# sostituto locale come fakeredis
+class RedisDraftStore(DraftStore):
+    def __init__(self, client, prefix="bp:bozza:", ttl=settings.SESSION_STORE_TTL,
+                 debounce=settings.AUTOSAVE_DEBOUNCE):
+        super().__init__(debounce)
+        self.client = client
+        self.prefix = prefix
+        self.ttl = ttl
+
+    @classmethod
+    def from_url(cls, url, **kwargs):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("Per BP_SESSION_STORE=redis:// è necessario il pacchetto redis")
+        return cls(redis.Redis.from_url(url), **kwargs)
+
+    def _name(self, token):
+        return f"{self.prefix}{token}"
+
+    def load(self, token):
+        values = self.client.hgetall(self._name(token))
+        return {_text(key): decode(_text(value)) for key, value in values.items()}
+
+    def _open(self):
+        return self.client
+
+    def _apply(self, client, upserts, deletes):
+        by_token = {}
+        for token, key, value, _ in upserts:
+            by_token.setdefault(token, ({}, []))[0][key] = value
+        for token, key in deletes:
+            by_token.setdefault(token, ({}, []))[1].append(key)
+        for token, (values, removed) in by_token.items():
+            name = self._name(token)
+            if values:
+                client.hset(name, mapping=values)
+            if removed:
+                client.hdel(name, *removed)
+            if self.ttl:
+                client.expire(name, int(self.ttl))
+
+
+def _text(value):
+    return value.decode("utf-8") if isinstance(value, bytes) else value
+
+
+# Backend scelto da BP_SESSION_STORE: vuoto o sqlite:///percorso per il file
+# locale, redis://... per Redis
+def open_store(url):
+    if url.startswith(("redis://", "rediss://", "unix://")):
+        return RedisDraftStore.from_url(url)
+    if url.startswith("sqlite:///"):
+        return SqliteDraftStore(url[len("sqlite:///"):])
+    if url:
+        raise ValueError(f"BP_SESSION_STORE non supportato: {url}")
+    return SqliteDraftStore(settings.DRAFTS_DB)
+
+
+# Impronta del JSON di un valore: la sessione ricorda l'ultimo salvataggio
+# senza tenerne una seconda copia
+def fingerprint(text):
+    return hashlib.blake2b(text.encode("utf-8"), digest_size=16).digest()
+
+
+# Confronta i dati compilati con l'ultimo salvataggio (saved: chiave ->
+# impronta) e accoda solo le differenze; restituisce il numero di chiavi
+# modificate. Con shapes (chiave -> impronta strutturale) le liste dinamiche
+# ancora uguali all'ultimo confronto non vengono nemmeno serializzate; le
+# chiavi in keep mancano dallo stato ma non sono state rimosse (sono
+# scaricate su disco, vedi memory)
+def autosave(store, state, token, saved, shapes=None, keep=()):
+    current = {}
+    for key, value in schema.persistent_items(state):
+        shape = None
+        if shapes is not None and key in schema.RECORDS:
+            try:
+                shape = schema.entries_shape(schema.entries(key, value))
+            except TypeError:
+                shape = None
+            if shape is not None and key in saved and shapes.get(key) == shape:
+                current[key] = None
+                continue
+        try:
+            current[key] = encode(value)
+        except (TypeError, ValueError):
+            continue
+        if shape is not None:
+            shapes[key] = shape
+
+    changes = {}
+    for key, value in current.items():
+        if value is None:
+            continue
+        digest = fingerprint(value)
+        if saved.get(key) != digest:
+            changes[key] = value
+            saved[key] = digest
+    removed = [key for key in saved if key not in current and key not in keep]
+    if changes or removed:
+        store.save(token, changes, removed)
+        for key in removed:
+            del saved[key]
+            if shapes is not None:
+                shapes.pop(key, None)
+    return len(changes) + len(removed)
+
+
+store = open_store(settings.SESSION_STORE)
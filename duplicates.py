@@ -0,0 +1,302 @@
+# Indice dei business plan quasi duplicati.
+#
+# Per ogni invio si calcola una firma MinHash dell'insieme delle sequenze di
+# SHINGLE parole del testo: i business plan caricati (testo estratto) e i
+# campi descrittivi lunghi del modulo. Due firme coincidono in una posizione
+# con probabilità pari alla somiglianza di Jaccard dei due insiemi, quindi la
+# quota di posizioni uguali la stima senza confrontare i testi. Le firme sono
+# divise in BANDS bande di ROWS valori (LSH): i candidati di un piano sono
+# solo quelli che condividono con lui almeno una banda intera, trovati con
+# una ricerca indicizzata per banda, senza scorrere l'archivio. Con 32 bande
+# da 4 un piano simile al 50% viene trovato nell'87% dei casi, al 60% nel 99%.
+#
+# Firme e bande sono salvate in SQLite e aggiornate in modo incrementale
+# dall'archivio invii, come l'indice di ricerca. L'aggiornamento estrae il
+# testo dei business plan non ancora in cache, quindi le pagine non lo
+# eseguono mai: lo accodano al pianificatore (schedule); la riga di comando
+# lo esegue direttamente. Il controllo di un nuovo invio usa solo testi già estratti e,
+# se non sono pronti, viene rimandato a un lavoro in background.
+#
+#   python duplicates.py            aggiorna l'indice
+#   python duplicates.py --rebuild  lo ricostruisce da zero
+import argparse
+import hashlib
+import re
+import sqlite3
+import sys
+import threading
+import time
+import zlib
+from dataclasses import dataclass
+
+import numpy as np
+
+import jobs
+import schema
+import settings
+import submissions
+from attachments import store
+from extraction import extractor
+
+# Campi di testo libero che entrano nella firma, oltre ai business plan caricati
+TEXT_FIELDS = ('descrizione_attivita', 'storia_aziendale', 'descrizione_prodotto')
+PLAN_SLOTS = ('business_plan',)
+
+SHINGLE = 3
+MIN_WORDS = 30          # sotto questa soglia il testo è troppo corto per un confronto
+NUM_PERM = 128
+BANDS = 32
+ROWS = NUM_PERM // BANDS
+MAX_CANDIDATES = 500
+SEED = 20240611
+
+_PRIME = np.uint64((1 << 31) - 1)
+_rng = np.random.default_rng(SEED)
+_A = _rng.integers(1, int(_PRIME), NUM_PERM, dtype=np.uint64)[:, None]
+_B = _rng.integers(0, int(_PRIME), NUM_PERM, dtype=np.uint64)[:, None]
+_BLOCK = 4096
+_WORD = re.compile(r"\w+")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS signatures (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    submitted_at TEXT NOT NULL,
+    nome_azienda TEXT NOT NULL,
+    signature BLOB NOT NULL
+);
+CREATE TABLE IF NOT EXISTS bands (
+    band INTEGER NOT NULL,
+    bucket INTEGER NOT NULL,
+    plan INTEGER NOT NULL,
+    PRIMARY KEY (band, bucket, plan)
+) WITHOUT ROWID;
+"""
+
+REFRESH_INTERVAL = 2.0
+BATCH = 200
+
+
+@dataclass(frozen=True)
+class Match:
+    id: str
+    nome_azienda: str
+    submitted_at: str
+    similarity: float       # somiglianza di Jaccard stimata, 0-1
+
+
+# Testo confrontato per un piano; text_of(handle) restituisce il testo di un
+# allegato o None se non è disponibile
+def plan_text(state, text_of):
+    parts = [state.get(key) or "" for key in TEXT_FIELDS]
+    for slot in PLAN_SLOTS:
+        for handle in state.get(slot) or ():
+            parts.append(text_of(handle) or "")
+    return "\n".join(part for part in parts if isinstance(part, str))
+
+
+# Firma MinHash del testo (NUM_PERM valori uint32), None se è troppo corto
+def signature(text):
+    words = _WORD.findall(text.casefold())
+    if len(words) < MIN_WORDS:
+        return None
+    shingles = {" ".join(words[i:i + SHINGLE]) for i in range(len(words) - SHINGLE + 1)}
+    hashes = np.unique(np.fromiter((zlib.crc32(s.encode("utf-8")) for s in shingles),
+                                   dtype=np.uint64, count=len(shingles)))
+    result = np.full(NUM_PERM, _PRIME, dtype=np.uint64)
+    # a blocchi, per non creare una matrice NUM_PERM x shingle intera
+    for start in range(0, len(hashes), _BLOCK):
+        block = hashes[start:start + _BLOCK][None, :]
+        np.minimum(result, ((_A * block + _B) % _PRIME).min(axis=1), out=result)
+    return result.astype(np.uint32)
+
+
+def _buckets(sig):
+    return [(band, int.from_bytes(hashlib.blake2b(sig[band * ROWS:(band + 1) * ROWS].tobytes(),
+                                                  digest_size=8).digest(), "big", signed=True))
+            for band in range(BANDS)]
+
+
+def similarity(a, b):
+    return float(np.count_nonzero(a == b)) / NUM_PERM
+
+
+# Testo di un allegato archiviato, estratto subito se non è ancora in cache;
+# solo fuori dallo script della pagina (lavori in background, riga di comando)
+def _archived_text(handle):
+    return extractor.text(store, handle) if store.exists(handle.digest) else ""
+
+
+# Testo di un allegato archiviato se già estratto; altrimenti avvia
+# l'estrazione e restituisce None. Non blocca mai
+def _cached_text(handle):
+    return extractor.poll(store, handle) if store.exists(handle.digest) else ""
+
+
+# Lavoro del controllo rimandato: attende i testi e cerca i piani simili
+def _check(job, index, state, exclude):
+    text = plan_text(state, _archived_text)
+    job.report(0.5)
+    return index.similar(signature(text), exclude=exclude)
+
+
+class DuplicateIndex:
+    def __init__(self, path, sink=None):
+        self.path = path
+        self.sink = sink if sink is not None else submissions.sink
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_refresh = 0.0
+        self._job = None
+        self._job_lock = threading.Lock()
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA + submissions.PROGRESS_SCHEMA)
+        return conn
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # Aggiunge le firme degli invii arrivati dall'ultimo aggiornamento; al più
+    # una volta ogni REFRESH_INTERVAL secondi per processo, salvo force
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < REFRESH_INTERVAL:
+                return 0
+            self._last_refresh = time.monotonic()
+            conn = self._conn()
+            tail = submissions.Tail.from_db(self.sink, conn)
+            added = sum(self._insert(conn, batch) for batch in tail.batches(BATCH))
+            tail.seal(conn)
+            return added
+
+    # Accoda l'aggiornamento al pianificatore come lavoro in blocco, se non ce
+    # n'è già uno in corso; la pagina non aspetta. None se la coda è piena
+    def schedule(self):
+        with self._job_lock:
+            if self._job is None or self._job.finished:
+                try:
+                    self._job = jobs.scheduler.submit(lambda job: self.refresh(),
+                                                      priority=jobs.BULK)
+                except jobs.Busy:
+                    return None
+            return self._job
+
+    def _insert(self, conn, batch):
+        added = 0
+        with conn:
+            for segment, index, record in batch:
+                state = schema.normalize(record.get('state') or {})
+                sig = signature(plan_text(state, _archived_text))
+                if sig is None:
+                    continue
+                cursor = conn.execute(
+                    "INSERT INTO signatures (id, submitted_at, nome_azienda, signature) "
+                    "VALUES (?, ?, ?, ?) ON CONFLICT (id) DO NOTHING",
+                    (record['id'], record['submitted_at'], state.get('nome_azienda') or "",
+                     sig.tobytes()))
+                if cursor.rowcount:
+                    conn.executemany("INSERT OR IGNORE INTO bands (band, bucket, plan) "
+                                     "VALUES (?, ?, ?)",
+                                     [(band, bucket, cursor.lastrowid)
+                                      for band, bucket in _buckets(sig)])
+                    added += 1
+            submissions.Tail.save(conn, batch)
+        return added
+
+    def rebuild(self):
+        with self._lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM signatures")
+                conn.execute("DELETE FROM bands")
+                conn.execute("DELETE FROM progress")
+        return self.refresh(force=True)
+
+    # Piani dell'archivio simili alla firma, dal più simile; exclude è l'id
+    # dell'invio stesso quando la firma viene dall'indice. I candidati sono
+    # ordinati per numero di bande in comune prima del limite: in media un
+    # piano simile al livello s ne condivide BANDS * s^ROWS, quindi si
+    # confrontano per primi i più promettenti. Il limite tiene basso il costo
+    # per i testi molto comuni (modelli, formule di rito); in cambio, se più
+    # di MAX_CANDIDATES piani condividono più bande, un piano sopra soglia
+    # che ne condivide poche può non essere trovato
+    def similar(self, sig, threshold=settings.DUPLICATE_THRESHOLD, exclude=None, limit=10):
+        if sig is None:
+            return []
+        buckets = _buckets(sig)
+        conn = self._conn()
+        candidates = conn.execute(
+            "SELECT s.id, s.nome_azienda, s.submitted_at, s.signature FROM "
+            "(SELECT plan, count(*) AS shared FROM bands WHERE (band, bucket) IN "
+            f"(VALUES {', '.join('(?, ?)' for _ in buckets)}) "
+            "GROUP BY plan ORDER BY shared DESC LIMIT ?) c "
+            "JOIN signatures s ON s.rowid = c.plan",
+            [value for bucket in buckets for value in bucket]
+            + [MAX_CANDIDATES + (exclude is not None)]).fetchall()
+        matches = []
+        for plan_id, nome_azienda, submitted_at, blob in candidates:
+            if plan_id == exclude:
+                continue
+            score = similarity(sig, np.frombuffer(blob, dtype=np.uint32))
+            if score >= threshold:
+                matches.append(Match(plan_id, nome_azienda, submitted_at, score))
+        matches.sort(key=lambda m: m.similarity, reverse=True)
+        return matches[:limit]
+
+    # Piani simili allo stato di un modulo, calcolati con i soli testi già
+    # estratti; None se un business plan non è ancora pronto (la sua
+    # estrazione intanto parte): il controllo va rimandato con check_later
+    def similar_cached(self, state, **kwargs):
+        ready = True
+
+        def text_of(handle):
+            nonlocal ready
+            text = _cached_text(handle)
+            ready = ready and text is not None
+            return text
+        text = plan_text(state, text_of)
+        return self.similar(signature(text), **kwargs) if ready else None
+
+    # Controllo rimandato a un lavoro in background; exclude è l'id
+    # dell'invio stesso, che nel frattempo può entrare nell'indice
+    def check_later(self, state, session=None, exclude=None):
+        state = {key: state.get(key) for key in TEXT_FIELDS + PLAN_SLOTS}
+        return jobs.scheduler.submit(_check, self, state, exclude, session=session)
+
+    # Piani simili a un invio già indicizzato
+    def similar_to(self, submission_id, **kwargs):
+        row = self._conn().execute("SELECT signature FROM signatures WHERE id = ?",
+                                   (submission_id,)).fetchone()
+        if row is None:
+            return []
+        return self.similar(np.frombuffer(row[0], dtype=np.uint32), exclude=submission_id,
+                            **kwargs)
+
+    def __len__(self):
+        return self._conn().execute("SELECT count(*) FROM signatures").fetchone()[0]
+
+
+index = DuplicateIndex(settings.DUPLICATES_DB)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggiorna l'indice dei piani quasi duplicati")
+    parser.add_argument("--rebuild", action="store_true", help="ricostruisce l'indice da zero")
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    added = index.rebuild() if args.rebuild else index.refresh(force=True)
+    print(f"{added} firme aggiunte in {time.perf_counter() - started:.1f} s "
+          f"({len(index)} in totale)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
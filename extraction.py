@@ -0,0 +1,229 @@
+# Estrazione del testo da visure e business plan caricati.
+#
+# L'estrazione gira in processi separati, così un PDF scansionato di grandi
+# dimensioni non rallenta mai un rerun: la pagina chiede il testo con
+# poll(), che avvia il lavoro se serve e restituisce None finché non è
+# pronto. Ogni estrazione esegue questo file come script (python
+# extraction.py percorso nome) da uno dei thread del pool: i processi non
+# ereditano né rieseguono lo script di Streamlit, e un processo che va in
+# crash fallisce solo il proprio file. Il risultato riuscito è memorizzato
+# per hash del contenuto, in memoria e su disco, quindi ricaricare lo stesso
+# file non costa nulla; un'estrazione fallita (documento danneggiato,
+# pacchetto mancante, processo terminato) non viene salvata e si ritenta
+# dopo EXTRACTION_RETRY secondi. Dal testo vengono poi ricavati valori
+# suggeriti per alcuni campi del modulo.
+import logging
+import re
+import subprocess
+import sys
+import threading
+import time
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from pathlib import Path
+from xml.etree import ElementTree
+
+import settings
+
+MAX_CHARS = 200_000
+MEMORY_ITEMS = 64
+
+_W = "{http://schemas.openxmlformats.org/wordprocessingml/2006/main}"
+
+log = logging.getLogger(__name__)
+
+
+class ExtractionError(Exception):
+    pass
+
+
+def _pdf_text(path):
+    try:
+        from pypdf import PdfReader
+    except ImportError:
+        raise ExtractionError("pacchetto pypdf non installato: il testo dei PDF non viene estratto")
+    parts = []
+    size = 0
+    for page in PdfReader(path).pages:
+        text = page.extract_text() or ""
+        parts.append(text)
+        size += len(text)
+        if size >= MAX_CHARS:
+            break
+    return "\n".join(parts)
+
+
+def _docx_text(path):
+    with zipfile.ZipFile(path) as docx:
+        with docx.open("word/document.xml") as xml:
+            paragraphs = []
+            for _, element in ElementTree.iterparse(xml):
+                if element.tag == _W + "p":
+                    paragraphs.append("".join(t.text or "" for t in element.iter(_W + "t")))
+                    element.clear()
+    return "\n".join(paragraphs)
+
+
+# Testo di un file dell'archivio degli allegati; solleva un'eccezione se il
+# documento non si può leggere. Eseguita nel processo di estrazione
+def extract_file(path, name):
+    suffix = name.rsplit(".", 1)[-1].lower()
+    if suffix == "pdf":
+        text = _pdf_text(path)
+    elif suffix == "docx":
+        text = _docx_text(path)
+    else:
+        text = ""
+    return text[:MAX_CHARS]
+
+
+# Estrazione in un processo separato; solleva ExtractionError se il processo
+# fallisce, va in crash o supera il tempo massimo
+def run_worker(path, name, timeout=settings.EXTRACTION_TIMEOUT):
+    try:
+        done = subprocess.run([sys.executable, str(Path(__file__).resolve()), path, name],
+                              capture_output=True, timeout=timeout)
+    except (OSError, subprocess.TimeoutExpired) as exc:
+        raise ExtractionError(str(exc)) from exc
+    if done.returncode != 0:
+        error = done.stderr.decode("utf-8", errors="replace").strip().splitlines()
+        raise ExtractionError(error[-1] if error else f"codice di uscita {done.returncode}")
+    return done.stdout.decode("utf-8")
+
+
+class Extractor:
+    def __init__(self, cache_dir, workers=settings.EXTRACTION_WORKERS,
+                 retry_after=settings.EXTRACTION_RETRY):
+        self.cache_dir = cache_dir
+        self.workers = workers
+        self.retry_after = retry_after
+        self._pool = None
+        self._pending = {}              # digest -> Future
+        self._texts = OrderedDict()     # digest -> testo
+        self._failed = {}               # digest -> istante del prossimo tentativo
+        self._lock = threading.Lock()
+
+    def _executor(self):
+        if self._pool is None:
+            self._pool = ThreadPoolExecutor(max_workers=self.workers,
+                                            thread_name_prefix="extraction")
+        return self._pool
+
+    def _remember(self, digest, text):
+        self._texts[digest] = text
+        self._texts.move_to_end(digest)
+        while len(self._texts) > MEMORY_ITEMS:
+            self._texts.popitem(last=False)
+
+    def _cached(self, digest):
+        text = self._texts.get(digest)
+        if text is None:
+            path = self.cache_dir / f"{digest}.txt"
+            if path.exists():
+                text = path.read_text(encoding="utf-8")
+                self._remember(digest, text)
+        return text
+
+    def _store(self, digest, text):
+        self.cache_dir.mkdir(parents=True, exist_ok=True)
+        tmp = self.cache_dir / f"{digest}.tmp"
+        tmp.write_text(text, encoding="utf-8")
+        tmp.replace(self.cache_dir / f"{digest}.txt")
+
+    # Esito di un'estrazione: il testo riuscito va in cache, il fallimento
+    # viene ricordato solo fino al prossimo tentativo. Con il lock acquisito
+    def _settle(self, handle, text, error):
+        if error is None:
+            self._failed.pop(handle.digest, None)
+            self._store(handle.digest, text)
+            self._remember(handle.digest, text)
+            return text
+        log.warning("Estrazione del testo di %s non riuscita: %s", handle.name, error)
+        self._failed[handle.digest] = time.monotonic() + self.retry_after
+        return ""
+
+    # Testo dell'allegato se già estratto, altrimenti avvia l'estrazione e
+    # restituisce None; "" se l'estrazione è fallita e non è ancora il
+    # momento di ritentarla. Non blocca mai
+    def poll(self, store, handle):
+        with self._lock:
+            text = self._cached(handle.digest)
+            if text is not None:
+                return text
+            if self._failed.get(handle.digest, 0) > time.monotonic():
+                return ""
+
+            future = self._pending.get(handle.digest)
+            if future is None:
+                self._pending[handle.digest] = self._executor().submit(
+                    run_worker, str(store.path(handle.digest)), handle.name)
+                return None
+            if not future.done():
+                return None
+
+            del self._pending[handle.digest]
+            error = future.exception()
+            return self._settle(handle, None if error else future.result(), error)
+
+    # Testo dell'allegato, estratto subito se non è in cache; per i lavori
+    # fuori dalla pagina (indici, script). "" se l'estrazione fallisce
+    def text(self, store, handle):
+        with self._lock:
+            text = self._cached(handle.digest)
+        if text is not None:
+            return text
+        try:
+            text, error = run_worker(str(store.path(handle.digest)), handle.name), None
+        except ExtractionError as exc:
+            text, error = None, exc
+        with self._lock:
+            return self._settle(handle, text, error)
+
+
+_PARTITA_IVA = re.compile(r"(?:partita\s+iva|p\.\s*iva|codice\s+fiscale)\D{0,30}(\d{11})\b", re.I)
+_NOME = re.compile(r"(?:denominazione|ragione\s+sociale)\s*[:\-]?\s*(.+)", re.I)
+_OGGETTO = re.compile(r"(?:oggetto\s+sociale|attivit[àa]\s+(?:esercitata|prevalente))\s*[:\-]?\s*"
+                      r"(.+?)(?:\n\s*\n|\Z)", re.I | re.S)
+_STORIA = re.compile(r"(?:storia(?:\s+aziendale)?|chi\s+siamo)\s*[:\-]?\s*\n(.+?)(?:\n\s*\n|\Z)",
+                     re.I | re.S)
+_MAX_SUGGESTION = 1500
+
+
+def _clean(value):
+    return re.sub(r"\s+", " ", value).strip()[:_MAX_SUGGESTION]
+
+
+# Valori suggeriti per i campi del modulo ricavati dal testo di un documento;
+# il testo arriva dalla cache dell'estrattore, quindi lo stesso oggetto
+# stringa torna a ogni rerun e il suo hash è già calcolato
+@lru_cache(maxsize=128)
+def suggest_fields(text):
+    suggestions = {}
+    for key, pattern in (('nome_azienda', _NOME), ('partita_iva', _PARTITA_IVA),
+                         ('descrizione_attivita', _OGGETTO), ('storia_aziendale', _STORIA)):
+        match = pattern.search(text)
+        if match and _clean(match.group(1)):
+            suggestions[key] = _clean(match.group(1))
+    return suggestions
+
+
+extractor = Extractor(settings.EXTRACTION_DIR)
+
+
+# Processo di estrazione: python extraction.py percorso nome. Il testo va su
+# stdout; un documento illeggibile termina con codice 1 e il motivo su stderr
+def main(argv=None):
+    path, name = argv if argv is not None else sys.argv[1:]
+    try:
+        text = extract_file(path, name)
+    except Exception as exc:
+        print(f"{type(exc).__name__}: {exc}", file=sys.stderr)
+        return 1
+    sys.stdout.buffer.write(text.encode("utf-8"))
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,143 @@
+# Importazione in blocco di concorrenti e membri del team da CSV o XLSX.
+#
+# Il file viene letto a blocchi (CSV) o riga per riga in sola lettura (XLSX,
+# richiede openpyxl) e le intestazioni vengono ricondotte agli attributi
+# delle liste dinamiche definite in schema.LISTS. La validazione lavora su
+# colonne intere di pandas, quindi centinaia di righe costano come una.
+# Oltre MAX_ROWS righe il file viene troncato e read_entries lo segnala.
+import csv
+import re
+
+import pandas as pd
+
+import schema
+from validation import URL
+
+MAX_ROWS = 5000
+CSV_CHUNK = 1000
+
+# Intestazioni accettate per ciascun attributo (confronto senza maiuscole,
+# spazi e punteggiatura)
+HEADER_ALIASES = {
+    'nome': ('nome', 'name', 'nomeconcorrente', 'concorrente', 'azienda',
+             'nomecognome', 'nomeecognome', 'membro'),
+    'url': ('url', 'sito', 'sitoweb', 'website', 'link'),
+    'note': ('note', 'notes', 'commenti', 'descrizione'),
+    'ruolo': ('ruolo', 'role', 'posizione', 'titolo'),
+    'esperienza': ('esperienza', 'experience', 'bio', 'curriculum'),
+}
+
+REQUIRED = {
+    'concorrenti': ('nome',),
+    'team_members': ('nome',),
+}
+
+
+def _normalize_header(header):
+    return re.sub(r"[^a-z]", "", str(header or "").lower())
+
+
+# Associa le colonne del file agli attributi della lista; solleva ValueError
+# se manca una colonna obbligatoria
+def _column_map(headers, list_key):
+    attrs = schema.LISTS[list_key][1]
+    mapping = {}
+    for column in headers:
+        normalized = _normalize_header(column)
+        for attr in attrs:
+            if attr not in mapping.values() and normalized in HEADER_ALIASES.get(attr, (attr,)):
+                mapping[column] = attr
+                break
+    missing = [attr for attr in REQUIRED[list_key] if attr not in mapping.values()]
+    if missing:
+        raise ValueError(f"Colonna obbligatoria mancante: {', '.join(missing)}")
+    return mapping
+
+
+def _finish(frame, mapping, list_key):
+    attrs = schema.LISTS[list_key][1]
+    frame = frame.rename(columns=mapping).reindex(columns=list(attrs), fill_value="")
+    frame = frame.fillna("").astype(str).apply(lambda column: column.str.strip())
+    # le righe completamente vuote non sono voci
+    return frame[frame.ne("").any(axis=1)].reset_index(drop=True)
+
+
+def _read_csv(fileobj, list_key):
+    chunks = []
+    rows = 0
+    mapping = None
+    try:
+        reader = pd.read_csv(fileobj, dtype=str, keep_default_na=False, sep=None,
+                             engine="python", chunksize=CSV_CHUNK, encoding="utf-8-sig")
+        for chunk in reader:
+            if mapping is None:
+                mapping = _column_map(chunk.columns, list_key)
+            chunks.append(chunk[list(mapping)])
+            rows += len(chunk)
+            if rows > MAX_ROWS:
+                break
+    except csv.Error as exc:
+        raise ValueError(f"File CSV non valido: {exc}") from exc
+    if mapping is None:
+        raise ValueError("Il file è vuoto")
+    return pd.concat(chunks, ignore_index=True).head(MAX_ROWS), mapping, rows > MAX_ROWS
+
+
+def _read_xlsx(fileobj, list_key):
+    try:
+        from openpyxl import load_workbook
+    except ImportError:
+        raise ValueError("Per importare file XLSX è necessario il pacchetto openpyxl")
+    try:
+        workbook = load_workbook(fileobj, read_only=True, data_only=True)
+        try:
+            rows = workbook.active.iter_rows(values_only=True)
+            headers = next(rows, None)
+            if headers is None:
+                raise ValueError("Il foglio è vuoto")
+            mapping = _column_map(headers, list_key)
+            positions = [i for i, header in enumerate(headers) if header in mapping]
+            records = []
+            for row in rows:
+                records.append([row[i] if i < len(row) else None for i in positions])
+                if len(records) > MAX_ROWS:
+                    break
+        finally:
+            workbook.close()
+    except ValueError:
+        raise
+    except Exception as exc:
+        # archivio zip o XML danneggiato: openpyxl e zipfile sollevano
+        # eccezioni di tipi diversi
+        raise ValueError(f"File XLSX non valido: {exc}") from exc
+    frame = pd.DataFrame(records[:MAX_ROWS], columns=[headers[i] for i in positions], dtype=object)
+    return frame, mapping, len(records) > MAX_ROWS
+
+
+# DataFrame con una colonna per attributo della lista, righe vuote escluse, e
+# True se il file superava MAX_ROWS righe ed è stato troncato
+def read_entries(fileobj, name, list_key):
+    suffix = name.rsplit(".", 1)[-1].lower()
+    if suffix in ("xlsx", "xlsm"):
+        frame, mapping, truncated = _read_xlsx(fileobj, list_key)
+    elif suffix in ("csv", "txt"):
+        frame, mapping, truncated = _read_csv(fileobj, list_key)
+    else:
+        raise ValueError(f"Formato non supportato: .{suffix}")
+    return _finish(frame, mapping, list_key), truncated
+
+
+# Messaggi di errore per riga ("" se la riga è valida), calcolati per colonne
+def validate(frame, list_key):
+    checks = []
+    for attr in REQUIRED[list_key]:
+        values = frame[attr].fillna("").astype(str).str.strip()
+        checks.append((values.eq(""), f"{attr} obbligatorio"))
+    if 'url' in frame:
+        urls = frame['url'].fillna("").astype(str).str.strip()
+        checks.append((urls.ne("") & ~urls.str.match(URL), "URL non valido"))
+
+    errors = pd.Series("", index=frame.index, dtype=object)
+    for mask, message in checks:
+        errors = errors.mask(mask, (errors + "; " + message).str.lstrip("; "))
+    return errors
@@ -0,0 +1,200 @@
+# Pianificatore condiviso dei lavori pesanti delle sessioni.
+#
+# Un unico pool di thread per processo esegue i lavori in ordine di classe di
+# priorità (anteprime interattive prima delle esportazioni in blocco) e di
+# arrivo. I limiti proteggono le altre sessioni: ogni sessione ha un numero
+# massimo di lavori in esecuzione e in coda, i lavori in blocco non possono
+# occupare più di JOB_BULK_WORKERS thread, così un'esportazione grande non
+# blocca le anteprime degli altri, e oltre JOB_QUEUE lavori in coda submit
+# rifiuta il lavoro (Busy). Le pagine non aspettano mai: interrogano il
+# lavoro con poll() a ogni rerun. Il lavoro riceve il proprio Job e chiama
+# report() per l'avanzamento, che solleva Cancelled se il lavoro è stato
+# annullato; i lavori delle sessioni chiuse vengono annullati.
+import heapq
+import itertools
+import threading
+import time
+import uuid
+from collections import Counter
+from dataclasses import dataclass, field
+
+import memory
+import settings
+
+INTERACTIVE, NORMAL, BULK = 0, 1, 2
+
+QUEUED, RUNNING, DONE, FAILED, CANCELLED = "queued", "running", "done", "failed", "cancelled"
+
+
+class Busy(Exception):
+    pass
+
+
+class Cancelled(Exception):
+    pass
+
+
+@dataclass(eq=False)
+class Job:
+    id: str
+    priority: int
+    session: str = None
+    status: str = QUEUED
+    progress: float = 0.0
+    result: object = None
+    error: str = ""
+    finished_at: float = 0.0
+    _cancel: threading.Event = field(default_factory=threading.Event, repr=False)
+
+    @property
+    def done(self):
+        return self.status == DONE
+
+    @property
+    def finished(self):
+        return self.status in (DONE, FAILED, CANCELLED)
+
+    @property
+    def cancelled(self):
+        return self._cancel.is_set()
+
+    # Avanzamento (0-1) riportato dal lavoro; interrompe il lavoro annullato
+    def report(self, progress):
+        self.progress = progress
+        if self._cancel.is_set():
+            raise Cancelled()
+
+
+class Scheduler:
+    def __init__(self, workers=settings.JOB_WORKERS, bulk_workers=settings.JOB_BULK_WORKERS,
+                 session_running=settings.JOB_SESSION_RUNNING,
+                 session_queued=settings.JOB_SESSION_QUEUED, max_queued=settings.JOB_QUEUE,
+                 ttl=settings.JOB_RESULT_TTL):
+        self.workers = workers
+        self.bulk_workers = max(1, min(bulk_workers, workers))
+        self.session_running = session_running
+        self.session_queued = session_queued
+        self.max_queued = max_queued
+        self.ttl = ttl
+        self._heap = []                 # (priorità, ordine di arrivo, job, func, args)
+        self._order = itertools.count()
+        self._jobs = {}
+        self._running = Counter()       # sessione -> lavori in esecuzione
+        self._queued = Counter()        # sessione -> lavori in coda
+        self._running_bulk = 0
+        self._cond = threading.Condition()
+        self._threads = []
+
+    def _ensure_workers(self):
+        while len(self._threads) < self.workers:
+            thread = threading.Thread(target=self._run, name=f"job-worker-{len(self._threads)}",
+                                      daemon=True)
+            thread.start()
+            self._threads.append(thread)
+
+    # Accoda func(job, *args); key identifica il lavoro, così la stessa
+    # richiesta ripetuta a ogni rerun restituisce il lavoro già esistente
+    def submit(self, func, *args, priority=NORMAL, session=None, key=None):
+        with self._cond:
+            self._prune()
+            job = self._jobs.get(key) if key is not None else None
+            if job is not None and job.status not in (FAILED, CANCELLED):
+                return job
+            if len(self._heap) >= self.max_queued:
+                raise Busy("Troppi lavori in coda, riprova tra poco")
+            if session is not None and self._queued[session] >= self.session_queued:
+                raise Busy("Troppi lavori in corso per questa sessione")
+            job = Job(key if key is not None else uuid.uuid4().hex, priority, session)
+            self._jobs[job.id] = job
+            self._queued[session] += 1
+            heapq.heappush(self._heap, (priority, next(self._order), job, func, args))
+            self._ensure_workers()
+            self._cond.notify()
+            return job
+
+    def poll(self, job_id):
+        with self._cond:
+            return self._jobs.get(job_id)
+
+    # Annulla i lavori di una sessione chiusa: quelli in coda non partono,
+    # quelli in esecuzione si fermano alla prossima chiamata di report()
+    def cancel_session(self, session):
+        with self._cond:
+            for job in self._jobs.values():
+                if job.session == session and not job.finished:
+                    job._cancel.set()
+            self._cond.notify_all()
+
+    # Dimentica i lavori conclusi da più di ttl secondi; con il lock acquisito
+    def _prune(self):
+        limit = time.monotonic() - self.ttl
+        self._jobs = {job_id: job for job_id, job in self._jobs.items()
+                      if not job.finished or job.finished_at > limit}
+
+    # Primo lavoro eseguibile nel rispetto dei limiti; i lavori annullati in
+    # coda vengono chiusi qui. Con il lock acquisito
+    def _next(self):
+        skipped = []
+        chosen = None
+        while self._heap:
+            item = heapq.heappop(self._heap)
+            job = item[2]
+            if job.cancelled or (job.session is not None and not memory.alive(job.session)):
+                self._decrement(self._queued, job.session)
+                self._finish(job, CANCELLED)
+                continue
+            if ((job.session is not None and self._running[job.session] >= self.session_running)
+                    or (job.priority == BULK and self._running_bulk >= self.bulk_workers)):
+                skipped.append(item)
+                continue
+            chosen = item
+            break
+        for item in skipped:
+            heapq.heappush(self._heap, item)
+        return chosen
+
+    # I contatori per sessione tengono solo le sessioni con lavori in coda o
+    # in esecuzione; con il lock acquisito
+    @staticmethod
+    def _decrement(counter, session):
+        counter[session] -= 1
+        if counter[session] <= 0:
+            del counter[session]
+
+    def _finish(self, job, status, error=""):
+        job.status = status
+        job.error = error
+        job.finished_at = time.monotonic()
+
+    def _run(self):
+        while True:
+            with self._cond:
+                item = self._next()
+                while item is None:
+                    self._cond.wait()
+                    item = self._next()
+                _, _, job, func, args = item
+                self._decrement(self._queued, job.session)
+                self._running[job.session] += 1
+                self._running_bulk += job.priority == BULK
+                job.status = RUNNING
+            try:
+                result = func(job, *args)
+            except Cancelled:
+                status, error, result = CANCELLED, "", None
+            except Exception as exc:
+                status, error, result = FAILED, str(exc) or type(exc).__name__, None
+            else:
+                status, error = DONE, ""
+            with self._cond:
+                job.result = result
+                job.progress = 1.0 if status == DONE else job.progress
+                self._finish(job, status, error)
+                self._decrement(self._running, job.session)
+                self._running_bulk -= job.priority == BULK
+                # un posto liberato può sbloccare lavori rimasti in attesa
+                self._cond.notify_all()
+
+
+scheduler = Scheduler()
+memory.registry.closed_hooks.append(scheduler.cancel_session)
@@ -0,0 +1,347 @@
+# Contabilità della memoria per sessione e scarico su disco.
+#
+# A fine rerun si misura quanto occupa lo stato della sessione; oltre il
+# budget (BP_SESSION_BUDGET_MB) i dati più voluminosi che non appartengono a
+# widget (liste dinamiche, elenchi di allegati) vengono scritti su disco, un
+# file per chiave, e tolti dalla memoria. Restano su disco finché non li
+# chiede una scheda o una callback che li usa (load, resident, restoring).
+# Lo stesso scarico avviene per le sessioni inattive da più di
+# BP_SESSION_IDLE secondi, a opera di un thread di processo. La dimensione
+# delle liste dinamiche viene ricalcolata solo quando cambia la loro impronta
+# strutturale, aggiornata dal salvataggio automatico (shapes). La memoria
+# residente per sessione resta così limitata e il numero massimo di sessioni
+# per worker diventa prevedibile.
+import functools
+import os
+import shutil
+import sys
+import threading
+import time
+from dataclasses import dataclass
+
+import schema
+import settings
+from attachments import iter_handles
+from drafts import decode, encode
+
+_KEY = '_memoria'
+_SPILLED = '_memoria_scaricati'     # chiavi scritte su disco
+_SIZES = '_memoria_dimensioni'      # chiave -> (impronta strutturale, byte)
+_SHAPES = '_memoria_forme'          # chiave -> impronta strutturale corrente
+
+
+def _st():
+    import streamlit as st
+    return st
+
+
+def _ctx():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    return get_script_run_ctx()
+
+
+def fragment_run():
+    return bool(getattr(_ctx(), "fragment_ids_this_run", None))
+
+
+def _keys(state):
+    # SafeSessionState, usato dal thread di scarico, espone solo filtered_state
+    return list(state.keys() if hasattr(state, "keys") else state.filtered_state)
+
+
+def value_bytes(value):
+    if hasattr(value, "read") and hasattr(value, "size"):
+        return value.size                   # file caricato ancora nel widget
+    if isinstance(value, list) and value and hasattr(value[0], "read"):
+        return sum(getattr(v, "size", 0) for v in value)
+    try:
+        return len(encode(value))
+    except (TypeError, ValueError):
+        return sys.getsizeof(value)
+
+
+def _get(state, key, default=None):
+    return state[key] if key in state else default
+
+
+# Impronte strutturali delle liste dinamiche, calcolate da drafts.autosave a
+# ogni rerun e riusate qui per non riserializzare le liste invariate
+def shapes(state):
+    if _SHAPES not in state:
+        state[_SHAPES] = {}
+    return state[_SHAPES]
+
+
+# Chiavi della sessione che si trovano su disco
+def spilled(state):
+    return frozenset(_get(state, _SPILLED, ()))
+
+
+# Dimensione di un valore dello stato; per le liste dinamiche resta valida
+# finché non cambia l'impronta strutturale
+def _key_bytes(state, key):
+    shape = _get(state, _SHAPES, {}).get(key) if key in schema.RECORDS else None
+    if shape is None:
+        return value_bytes(state[key])
+    sizes = _get(state, _SIZES)
+    if sizes is None:
+        sizes = state[_SIZES] = {}
+    cached = sizes.get(key)
+    if cached is None or cached[0] != shape:
+        cached = sizes[key] = (shape, value_bytes(state[key]))
+    return cached[1]
+
+
+# Dimensione approssimativa dello stato: JSON per i valori serializzabili,
+# sys.getsizeof per il resto (oggetti interni)
+def state_bytes(state):
+    return sum(_key_bytes(state, key) for key in _keys(state)
+               if not key.startswith(('_profilo', _KEY)))
+
+
+# Byte su disco degli allegati richiamati dalla sessione (ogni file una volta)
+def attachment_bytes(state):
+    sizes = {}
+    for key in _keys(state):
+        if _spillable(key):
+            for handle in iter_handles(state[key]):
+                sizes[handle.digest] = handle.size
+    return sum(sizes.values())
+
+
+# Dati che non appartengono a widget e possono lasciare la memoria tra un
+# rerun e l'altro
+def _spillable(key):
+    return key in schema.LISTS or key in schema.ATTACHMENT_SLOTS
+
+
+@dataclass(frozen=True)
+class Usage:
+    state_bytes: int
+    attachment_bytes: int
+    spilled: tuple
+
+
+def _spill_dir(session_id):
+    return settings.SPILL_DIR / session_id
+
+
+def spill(state, session_id, keys):
+    keys = [key for key in keys if key in state]
+    if not keys:
+        return []
+    directory = _spill_dir(session_id)
+    directory.mkdir(parents=True, exist_ok=True)
+    for key in keys:
+        path = directory / f"{key}.json"
+        tmp = path.with_suffix(".tmp")
+        tmp.write_text(encode(state[key]), encoding="utf-8")
+        os.replace(tmp, path)
+    state[_SPILLED] = spilled(state) | set(keys)
+    for key in keys:
+        del state[key]
+    return keys
+
+
+# Ricarica le chiavi indicate (tutte se keys è None) tra quelle su disco;
+# le altre restano scaricate
+def restore(state, session_id, keys=None):
+    on_disk = spilled(state)
+    wanted = on_disk if keys is None else on_disk & set(keys)
+    if not wanted:
+        return 0
+    directory = _spill_dir(session_id)
+    for key in wanted:
+        path = directory / f"{key}.json"
+        if key not in state and path.exists():
+            # le voci delle liste tornano record
+            state[key] = schema.load_entries({key: decode(path.read_text(encoding="utf-8"))})[key]
+        path.unlink(missing_ok=True)
+    state[_SPILLED] = on_disk - wanted
+    return len(wanted)
+
+
+# Scarica i dati più voluminosi finché lo stato rientra nel budget
+def enforce_budget(state, session_id, budget):
+    total = state_bytes(state)
+    if total <= budget:
+        return Usage(total, attachment_bytes(state), ())
+    attachments_total = attachment_bytes(state)
+    # lo storico del profiler non è un dato compilato: si scarta
+    state.pop('_profilo_storia', None)
+    sizes = sorted(((_key_bytes(state, key), key) for key in _keys(state) if _spillable(key)),
+                   reverse=True)
+    chosen = []
+    for size, key in sizes:
+        if total <= budget:
+            break
+        chosen.append(key)
+        total -= size
+    spill(state, session_id, chosen)
+    return Usage(total, attachments_total, tuple(chosen))
+
+
+def alive(session_id):
+    from streamlit.runtime import Runtime
+    return not Runtime.exists() or Runtime.instance().is_active_session(session_id)
+
+
+class _Entry:
+    def __init__(self, state):
+        self.state = state
+        self.lock = threading.Lock()
+        self.running = False
+        self.last_seen = time.monotonic()
+        self.idle_spilled = False
+
+
+# Sessioni attive nel processo; un thread scarica quelle inattive
+class SessionRegistry:
+    def __init__(self, idle_timeout):
+        self.idle_timeout = idle_timeout
+        self._sessions = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+        self.closed_hooks = []      # chiamate con l'id di ogni sessione chiusa
+
+    def _ensure_reaper(self):
+        with self._lock:
+            if self._reaper is None and self.idle_timeout > 0:
+                self._reaper = threading.Thread(target=self._run, name="session-reaper",
+                                                daemon=True)
+                self._reaper.start()
+
+    def enter(self, session_id, state):
+        self._ensure_reaper()
+        with self._lock:
+            entry = self._sessions.get(session_id)
+            if entry is None:
+                entry = self._sessions[session_id] = _Entry(state)
+        # attende un eventuale scarico in corso
+        with entry.lock:
+            entry.state = state     # il wrapper dello stato cambia a ogni esecuzione
+            entry.running = True
+            entry.idle_spilled = False
+
+    def leave(self, session_id):
+        entry = self._sessions.get(session_id)
+        if entry is not None:
+            with entry.lock:
+                entry.running = False
+                entry.last_seen = time.monotonic()
+
+    def __len__(self):
+        return len(self._sessions)
+
+    def spill_idle(self, now=None):
+        now = time.monotonic() if now is None else now
+        spilled = 0
+        for session_id, entry in list(self._sessions.items()):
+            state = entry.state
+            if not alive(session_id):
+                # sessione chiusa: il suo file di scarico non serve più
+                with self._lock:
+                    self._sessions.pop(session_id, None)
+                shutil.rmtree(_spill_dir(session_id), ignore_errors=True)
+                for hook in self.closed_hooks:
+                    hook(session_id)
+                continue
+            with entry.lock:
+                if entry.running or entry.idle_spilled or now - entry.last_seen < self.idle_timeout:
+                    continue
+                spill(state, session_id, [key for key in _keys(state) if _spillable(key)])
+                entry.idle_spilled = True
+                spilled += 1
+        return spilled
+
+    def _run(self):
+        interval = max(1.0, min(60.0, self.idle_timeout / 4))
+        while True:
+            time.sleep(interval)
+            try:
+                self.spill_idle()
+            except Exception:
+                pass        # il prossimo giro riprova; il rerun non ne risente
+
+
+registry = SessionRegistry(settings.SESSION_IDLE)
+
+
+def _session():
+    ctx = _ctx()
+    return ctx.session_id, ctx.session_state
+
+
+def session_id():
+    return _ctx().session_id
+
+
+# Inizio di un rerun: segna la sessione come attiva; i dati scaricati restano
+# su disco finché qualcuno non li chiede con load
+def begin(state):
+    session_id, safe_state = _session()
+    registry.enter(session_id, safe_state)
+
+
+# Ricarica le chiavi scaricate indicate, tutte se keys è None
+def load(state, keys=None):
+    return restore(state, session_id(), keys)
+
+
+# Fine di un rerun: applica il budget e avvisa quando dei dati vengono
+# scaricati per la prima volta (non a ogni nuovo scarico delle stesse liste)
+def end(state):
+    session_id, _ = _session()
+    previous = _get(state, _KEY)
+    try:
+        usage = enforce_budget(state, session_id, settings.SESSION_BUDGET)
+        state[_KEY] = usage
+    finally:
+        registry.leave(session_id)
+    if set(usage.spilled) - set(previous.spilled if previous else ()):
+        _st().warning(f"Sessione oltre il limite di memoria ({settings.SESSION_BUDGET / 2**20:.1f} MB): "
+                      f"{len(usage.spilled)} elenchi sono stati spostati su disco e verranno "
+                      "ricaricati quando servono", icon="⚠️")
+    return usage
+
+
+# Chiavi da ricaricare per le callback che lavorano su una sola lista o su un
+# solo slot, passati come primo argomento
+def first_arg(key, *args, **kwargs):
+    return (key,)
+
+
+# Per le callback dei widget, eseguite prima dello script: ricaricano i dati
+# scaricati prima di leggerli. keys limita le chiavi ricaricate: una tupla o
+# una funzione degli argomenti della callback; None le ricarica tutte
+def restoring(func=None, *, keys=None):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            state = _st().session_state
+            begin(state)
+            load(state, keys(*args, **kwargs) if callable(keys) else keys)
+            return func(*args, **kwargs)
+        return wrapper
+    return decorator(func) if func is not None else decorator
+
+
+# Per i frammenti: ricaricano le chiavi che usano; nei rerun parziali il
+# codice di inizio e fine dello script non viene eseguito, quindi il
+# frammento apre e chiude il rerun da sé
+def resident(keys=()):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            state = _st().session_state
+            if not fragment_run():
+                load(state, keys)
+                return func(*args, **kwargs)
+            begin(state)
+            load(state, keys)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                end(state)
+        return wrapper
+    return decorator
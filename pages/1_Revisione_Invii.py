@@ -0,0 +1,96 @@
+import streamlit as st
+
+import duplicates
+import jobs
+import reviewers
+import search
+from drafts import decode
+
+PAGE_SIZE = 25
+
+st.title("Console di Revisione")
+reviewers.require()
+
+# Gli invii arrivati dall'ultimo aggiornamento vengono indicizzati in
+# background, come l'indice dei duplicati: la pagina mostra subito l'indice
+# com'è e viene rieseguita se il lavoro aggiunge nuovi invii
+aggiornamento = search.index.schedule()
+duplicates.index.schedule()
+
+
+@st.fragment(run_every=1.0)
+def index_progress(job_id):
+    job = jobs.scheduler.poll(job_id)
+    if job is None or job.finished:
+        if job is None or job.result:
+            st.rerun()
+        return
+    st.caption("⏳ Indicizzazione dei nuovi invii...")
+
+
+with st.sidebar:
+    st.header("Filtri")
+    st.text_input("Cerca", key="rev_cerca",
+                  placeholder="Es. energia rinnovabile, mercato:export",
+                  help="Parole cercate nei testi del piano; con sezione:parola la ricerca è "
+                       f"limitata a una sezione ({', '.join(search.TEXT_SECTIONS)})")
+    st.selectbox("Forma Giuridica", ["Tutte", "Individuale", "Società di Persone",
+                                     "Società di Capitali", "Altro"], key="rev_forma")
+    st.number_input("Budget marketing minimo (€)", key="rev_budget", min_value=0, step=1000)
+    st.number_input("Ricavi totali minimi (€)", key="rev_ricavi", min_value=0, step=10000)
+    st.slider("Completamento minimo (%)", 0, 100, 0, step=10, key="rev_completamento")
+    st.selectbox("Ordina per", list(search.ORDERS), key="rev_ordine")
+    st.caption(f"{len(search.index):,} invii indicizzati")
+    if aggiornamento is not None and not aggiornamento.finished:
+        index_progress(aggiornamento.id)
+
+filtri = {
+    'text': st.session_state.rev_cerca,
+    'forma_giuridica': None if st.session_state.rev_forma == "Tutte" else st.session_state.rev_forma,
+    'min_budget': st.session_state.rev_budget,
+    'min_ricavi': st.session_state.rev_ricavi,
+    'min_completamento': st.session_state.rev_completamento / 100,
+    'order': st.session_state.rev_ordine,
+}
+
+# Una nuova ricerca riparte dalla prima pagina
+if st.session_state.get('_rev_filtri') != filtri:
+    st.session_state['_rev_filtri'] = filtri
+    st.session_state['rev_pagina'] = 1
+
+pagina = st.session_state.get('rev_pagina', 1)
+risultati, totale = search.index.search(**filtri, limit=PAGE_SIZE, offset=(pagina - 1) * PAGE_SIZE)
+pagine = max(1, -(-totale // PAGE_SIZE))
+
+col1, col2 = st.columns([3, 1])
+with col1:
+    st.caption(f"{totale:,} piani trovati")
+with col2:
+    st.number_input("Pagina", key="rev_pagina", min_value=1, max_value=pagine, step=1)
+
+if risultati:
+    st.dataframe([{
+        'ID': r['id'][:8],
+        'Inviato': r['submitted_at'][:16].replace("T", " "),
+        'Azienda': r['nome_azienda'],
+        'Forma Giuridica': r['forma_giuridica'],
+        'Budget Marketing (€)': r['budget_marketing'],
+        'Ricavi Totali (€)': r['ricavi_totali'],
+        'Completamento': f"{r['completamento']:.0%}",
+        'Estratto': r['estratto'],
+    } for r in risultati], hide_index=True, use_container_width=True)
+
+    scelta = st.selectbox("Dettaglio del piano", risultati,
+                          format_func=lambda r: f"{r['nome_azienda'] or 'Senza nome'} "
+                                                f"({r['id'][:8]})")
+    simili = duplicates.index.similar_to(scelta['id'])
+    if simili:
+        st.warning("Possibili duplicati: " + ", ".join(
+            f"{match.nome_azienda or 'Senza nome'} ({match.id[:8]}, {match.similarity:.0%})"
+            for match in simili))
+    piano = search.index.get(scelta['id'])
+    if piano is not None:
+        with st.expander("Dati esportati", expanded=True):
+            st.json(decode(piano['payload']))
+else:
+    st.info("Nessun piano corrisponde ai filtri")
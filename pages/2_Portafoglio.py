@@ -0,0 +1,41 @@
+import numpy as np
+import pandas as pd
+import streamlit as st
+
+import reviewers
+from portfolio import GROUPS, portfolio
+
+st.title("Analisi di Portafoglio")
+reviewers.require()
+
+# I piani inviati dall'ultimo aggiornamento vengono aggiunti alle colonne
+portfolio.refresh()
+
+by = st.selectbox("Coorti", list(GROUPS), format_func=GROUPS.get, key="port_coorti")
+st.caption(f"{len(portfolio):,} piani finanziari inviati")
+
+kpis = portfolio.kpis(by)
+st.dataframe(kpis, use_container_width=True, column_config={
+    'piani': st.column_config.NumberColumn("Piani"),
+    'ricavi_totali': st.column_config.NumberColumn("Ricavi Totali (€)", format="%.0f"),
+    'cagr_mediano': st.column_config.NumberColumn("CAGR Ricavi (mediana)", format="percent"),
+    'margine_p10': st.column_config.NumberColumn("Margine P10", format="percent"),
+    'margine_mediano': st.column_config.NumberColumn("Margine (mediana)", format="percent"),
+    'margine_p90': st.column_config.NumberColumn("Margine P90", format="percent"),
+    'quota_pareggio': st.column_config.NumberColumn("Piani in Pareggio", format="percent"),
+    'pareggio_mediano': st.column_config.NumberColumn("Anno di Pareggio (mediana)", format="%.1f"),
+    'fabbisogno_mediano': st.column_config.NumberColumn("Fabbisogno (mediana, €)", format="%.0f"),
+    'investimento_mediano': st.column_config.NumberColumn("Investimento (mediana, €)",
+                                                          format="%.0f"),
+    'quota_coperti': st.column_config.NumberColumn("Fabbisogno Coperto", format="percent"),
+    'budget_su_costi': st.column_config.NumberColumn("Budget Marketing / Costi", format="percent"),
+})
+
+# Distribuzione dei margini di tutti i piani
+margine = portfolio.table()['margine']
+margine = margine[~np.isnan(margine)]
+if len(margine):
+    st.subheader("Distribuzione dei Margini")
+    conteggi, bordi = np.histogram(np.clip(margine, -1, 1), bins=20, range=(-1, 1))
+    st.bar_chart(pd.DataFrame({"Piani": conteggi},
+                              index=pd.Index([f"{b:.0%}" for b in bordi[:-1]], name="Margine")))
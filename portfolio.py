@@ -0,0 +1,225 @@
+# Analisi di portafoglio sui piani finanziari di tutti gli invii.
+#
+# I piani dell'archivio vengono caricati in colonne NumPy: ricavi e costi in
+# matrici piano x anno (MAX_ANNI colonne, zeri oltre la durata del piano) e
+# una colonna per ogni indicatore del singolo piano (CAGR dei ricavi,
+# margine, anno di pareggio, fabbisogno finanziario), calcolati in blocco per
+# ogni gruppo di invii letti. Gli indicatori di coorte (per anno o trimestre
+# di invio, o per forma giuridica) sono memorizzati per coorte: quando
+# arrivano nuovi invii si ricalcolano solo le coorti che li contengono.
+#
+#   python portfolio.py --by forma_giuridica
+import argparse
+import sys
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+import schema
+import submissions
+from projections import MAX_ANNI, break_even_years
+
+GROUPS = {
+    'anno': "Anno di invio",
+    'trimestre': "Trimestre di invio",
+    'forma_giuridica': "Forma giuridica",
+}
+TOTAL = "Tutti"
+
+REFRESH_INTERVAL = 2.0
+BATCH = 5000
+
+
+# Colonne di un gruppo di record dell'archivio, con gli indicatori per piano;
+# i piani senza ricavi né costi sono esclusi
+def _columns(records):
+    ids, dates, forme, anni, budget, investimento = [], [], [], [], [], []
+    ricavi = np.zeros((len(records), MAX_ANNI))
+    costi = np.zeros((len(records), MAX_ANNI))
+    n = 0
+    for record in records:
+        state = schema.normalize(record.get('state') or {})
+        plan_ricavi, plan_costi = schema.financial_plan(state)
+        if not any(plan_ricavi) and not any(plan_costi):
+            continue
+        durata = min(len(plan_ricavi), MAX_ANNI)
+        ricavi[n, :durata] = [schema.number(v) for v in plan_ricavi[:durata]]
+        costi[n, :durata] = [schema.number(v) for v in plan_costi[:durata]]
+        ids.append(record['id'])
+        dates.append(record['submitted_at'][:10])
+        forme.append(state.get('forma_giuridica') or "Non indicata")
+        anni.append(durata)
+        budget.append(schema.number(state.get('budget_marketing')))
+        investimento.append(schema.number(state.get('investimento_iniziale')))
+        n += 1
+    ricavi, costi = ricavi[:n], costi[:n]
+    anni = np.array(anni, dtype=np.int64)
+    dates = np.array(dates, dtype="datetime64[D]")
+    years = dates.astype("datetime64[Y]").astype(np.int64) + 1970
+    months = dates.astype("datetime64[M]").astype(np.int64) % 12
+    profitto = ricavi - costi
+    rows = np.arange(n)
+
+    ricavi_totali = ricavi.sum(axis=1)
+    costi_totali = costi.sum(axis=1)
+    primo = ricavi[:, 0]
+    ultimo = ricavi[rows, anni - 1]
+    with np.errstate(divide="ignore", invalid="ignore"):
+        # CAGR dei ricavi tra il primo e l'ultimo anno del piano
+        cagr = np.where((primo > 0) & (anni > 1),
+                        (ultimo / primo) ** (1 / np.maximum(anni - 1, 1)) - 1, np.nan)
+        margine = np.where(ricavi_totali > 0, (ricavi_totali - costi_totali) / ricavi_totali,
+                           np.nan)
+        budget = np.array(budget)
+        budget_su_costi = np.where(costi_totali > 0, budget / costi_totali, np.nan)
+    # fabbisogno: la perdita cumulata massima da coprire prima del pareggio
+    fabbisogno = np.maximum(-np.cumsum(profitto, axis=1).min(axis=1), 0)
+    investimento = np.array(investimento)
+    return {
+        'id': np.array(ids, dtype=object),
+        'anno': years.astype(str).astype(object),
+        'trimestre': np.char.add(np.char.add(years.astype(str), "-T"),
+                                 (months // 3 + 1).astype(str)).astype(object),
+        'forma_giuridica': np.array(forme, dtype=object),
+        'anni': anni,
+        'ricavi': ricavi,
+        'costi': costi,
+        'budget_marketing': budget,
+        'investimento_iniziale': investimento,
+        'ricavi_totali': ricavi_totali,
+        'costi_totali': costi_totali,
+        'profitto_totale': ricavi_totali - costi_totali,
+        'cagr': cagr,
+        'margine': margine,
+        'pareggio': break_even_years(profitto),
+        'fabbisogno': fabbisogno,
+        'copertura': np.where(fabbisogno > 0, investimento >= fabbisogno, np.nan),
+        'budget_su_costi': budget_su_costi,
+    }
+
+
+def _median(values):
+    values = values[~np.isnan(values)]
+    return float(np.median(values)) if len(values) else np.nan
+
+
+# Indicatori di una coorte (le righe selezionate da mask)
+def _kpis(table, mask):
+    margine = table['margine'][mask]
+    margine = margine[~np.isnan(margine)]
+    p10, p50, p90 = (np.percentile(margine, (10, 50, 90)) if len(margine)
+                     else (np.nan, np.nan, np.nan))
+    pareggio = table['pareggio'][mask]
+    raggiunto = pareggio[pareggio > 0]
+    copertura = table['copertura'][mask]
+    copertura = copertura[~np.isnan(copertura)]
+    return {
+        'piani': int(mask.sum()),
+        'ricavi_totali': float(table['ricavi_totali'][mask].sum()),
+        'cagr_mediano': _median(table['cagr'][mask]),
+        'margine_p10': float(p10),
+        'margine_mediano': float(p50),
+        'margine_p90': float(p90),
+        'quota_pareggio': float((pareggio > 0).mean()) if len(pareggio) else np.nan,
+        'pareggio_mediano': float(np.median(raggiunto)) if len(raggiunto) else np.nan,
+        'fabbisogno_mediano': _median(table['fabbisogno'][mask]),
+        'investimento_mediano': _median(table['investimento_iniziale'][mask]),
+        'quota_coperti': float(copertura.mean()) if len(copertura) else np.nan,
+        'budget_su_costi': _median(table['budget_su_costi'][mask]),
+    }
+
+
+class Portfolio:
+    def __init__(self, sink=None):
+        self.sink = sink if sink is not None else submissions.sink
+        self._lock = threading.Lock()
+        self._progress = {}
+        self._complete = set()
+        self._chunks = []
+        self._table = None
+        self._cache = {group: {} for group in GROUPS}   # gruppo -> coorte -> indicatori
+        self._last_refresh = 0.0
+
+    # Carica gli invii arrivati dall'ultimo aggiornamento e invalida solo le
+    # coorti che li contengono; restituisce il numero di piani aggiunti
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < REFRESH_INTERVAL:
+                return 0
+            self._last_refresh = time.monotonic()
+            tail = submissions.Tail(self.sink, self._progress, self._complete)
+            added = 0
+            for batch in tail.batches(BATCH):
+                added += self._append([record for _, _, record in batch])
+                self._progress.update(submissions.positions(batch))
+            self._complete |= tail.sealed
+            return added
+
+    def _append(self, records):
+        if not records:
+            return 0
+        chunk = _columns(records)
+        if not len(chunk['id']):
+            return 0
+        self._chunks.append(chunk)
+        self._table = None
+        for group, cohorts in self._cache.items():
+            for cohort in set(chunk[group]) | {TOTAL}:
+                cohorts.pop(cohort, None)
+        return len(chunk['id'])
+
+    def _full_table(self):
+        if self._table is None:
+            if not self._chunks:
+                self._table = _columns([])
+            else:
+                self._table = {name: np.concatenate([chunk[name] for chunk in self._chunks])
+                               for name in self._chunks[0]}
+                self._chunks = [self._table]
+        return self._table
+
+    # Tabella colonnare di tutti i piani caricati
+    def table(self):
+        with self._lock:
+            return self._full_table()
+
+    def __len__(self):
+        return len(self.table()['id'])
+
+    # Indicatori per coorte (una riga per coorte più il totale), ricalcolati
+    # solo per le coorti invalidate dall'ultimo aggiornamento
+    def kpis(self, by='anno'):
+        with self._lock:
+            table = self._full_table()
+            cohorts = self._cache[by]
+            keys = list(np.unique(table[by])) if len(table[by]) else []
+            for cohort in keys:
+                if cohort not in cohorts:
+                    cohorts[cohort] = _kpis(table, table[by] == cohort)
+            if TOTAL not in cohorts:
+                cohorts[TOTAL] = _kpis(table, np.ones(len(table['id']), dtype=bool))
+            rows = {cohort: cohorts[cohort] for cohort in [*keys, TOTAL]}
+        frame = pd.DataFrame.from_dict(rows, orient="index")
+        frame.index.name = GROUPS[by]
+        return frame
+
+
+portfolio = Portfolio()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Indicatori di portafoglio dei piani inviati")
+    parser.add_argument("--by", choices=list(GROUPS), default='anno', help="coorti")
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    portfolio.refresh(force=True)
+    frame = portfolio.kpis(args.by)
+    print(frame.to_string(float_format=lambda value: f"{value:,.3f}"))
+    print(f"{len(portfolio)} piani in {time.perf_counter() - started:.1f} s", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,265 @@
+# Profilazione opzionale dei rerun dell'app.
+#
+# Attiva con BP_PROFILE=1 (tutte le sessioni) o con ?debug=1 nell'URL (solo
+# quella sessione). Ogni sezione di primo livello (schede, sidebar,
+# generate_json) viene cronometrata insieme al numero di widget emessi; a fine
+# rerun si misura la dimensione dello stato della sessione. I dati finiscono
+# in istogrammi di processo esportabili in formato OpenMetrics e in un log
+# JSONL a rotazione, da cui si ricavano i percentili anche fuori dall'app:
+#
+#   python profiler.py .bp_data/profilo/reruns.jsonl > metrics.txt
+#
+# Da disattivato il costo è un controllo di flag per sezione.
+import functools
+import json
+import sys
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from pathlib import Path
+
+import settings
+from drafts import encode
+from memory import fragment_run, state_bytes
+
+SECONDS_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+BYTES_BUCKETS = tuple(2 ** n for n in range(10, 27, 2))     # 1 KiB .. 64 MiB
+HISTORY = 100
+
+_RUN_KEY = '_profilo_run'
+_HISTORY_KEY = '_profilo_storia'
+
+
+def _st():
+    import streamlit as st
+    return st
+
+
+def enabled():
+    return settings.PROFILE or _st().query_params.get("debug") == "1"
+
+
+def panel_requested():
+    return _st().query_params.get("debug") == "1"
+
+
+# Identificativi dei widget registrati finora nel rerun; None se la versione
+# di Streamlit non li espone
+def _widget_count():
+    from streamlit.runtime.scriptrunner import get_script_run_ctx
+    ctx = get_script_run_ctx()
+    ids = getattr(getattr(ctx, "shared", ctx), "widget_ids_this_run", None)
+    if ids is None:
+        return None
+    return len(ids.snapshot() if hasattr(ids, "snapshot") else ids)
+
+
+class Histogram:
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.count = 0
+        self.sum = 0.0
+
+    def observe(self, value):
+        self.count += 1
+        self.sum += value
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+
+    def lines(self, name, labels):
+        label = ",".join(f'{k}="{v}"' for k, v in labels)
+        sep = "," if label else ""
+        cumulative = 0
+        for bound, count in zip(self.buckets, self.counts):
+            cumulative += count
+            yield f'{name}_bucket{{{label}{sep}le="{bound:g}"}} {cumulative}'
+        yield f'{name}_bucket{{{label}{sep}le="+Inf"}} {self.count}'
+        yield f"{name}_count{{{label}}} {self.count}"
+        yield f"{name}_sum{{{label}}} {self.sum:.6f}"
+
+
+# Istogrammi di processo, condivisi da tutte le sessioni
+class Metrics:
+    FAMILIES = {
+        'bp_rerun_seconds': ("Durata dei rerun", SECONDS_BUCKETS, "seconds"),
+        'bp_section_seconds': ("Durata delle sezioni per rerun", SECONDS_BUCKETS, "seconds"),
+        'bp_session_state_bytes': ("Dimensione dello stato di sessione", BYTES_BUCKETS, "bytes"),
+    }
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._series = {name: {} for name in self.FAMILIES}
+        self.widgets = {}           # sezione -> widget nell'ultimo rerun
+
+    def observe(self, family, value, **labels):
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._series[family]
+            if key not in series:
+                series[key] = Histogram(self.FAMILIES[family][1])
+            series[key].observe(value)
+
+    def record(self, run):
+        self.observe('bp_rerun_seconds', run['ms'] / 1000, tipo=run['tipo'])
+        for section in run['sezioni']:
+            self.observe('bp_section_seconds', section['ms'] / 1000, sezione=section['nome'])
+            if section['widget'] is not None:
+                with self._lock:
+                    self.widgets[section['nome']] = section['widget']
+        if run.get('stato_bytes') is not None:
+            self.observe('bp_session_state_bytes', run['stato_bytes'])
+
+    def openmetrics(self):
+        lines = []
+        with self._lock:
+            for family, (help_text, _, unit) in self.FAMILIES.items():
+                lines += [f"# TYPE {family} histogram", f"# UNIT {family} {unit}",
+                          f"# HELP {family} {help_text}."]
+                for labels, histogram in sorted(self._series[family].items()):
+                    lines += histogram.lines(family, labels)
+            lines += ["# TYPE bp_section_widgets gauge",
+                      "# HELP bp_section_widgets Widget emessi dalla sezione nell'ultimo rerun."]
+            lines += [f'bp_section_widgets{{sezione="{name}"}} {count}'
+                      for name, count in sorted(self.widgets.items())]
+        lines.append("# EOF")
+        return "\n".join(lines) + "\n"
+
+
+# Log JSONL dei rerun, ruotato in `.1` oltre max_bytes
+class RerunLog:
+    def __init__(self, path, max_bytes):
+        self.path = Path(path)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+
+    def write(self, run):
+        line = encode(run) + "\n"
+        with self._lock:
+            try:
+                self.path.parent.mkdir(parents=True, exist_ok=True)
+                if self.path.exists() and self.path.stat().st_size + len(line) > self.max_bytes:
+                    self.path.replace(self.path.with_name(self.path.name + ".1"))
+                with open(self.path, "a", encoding="utf-8") as f:
+                    f.write(line)
+            except OSError:
+                pass        # la profilazione non deve mai far fallire un rerun
+
+
+metrics = Metrics()
+log = RerunLog(settings.PROFILE_LOG, settings.PROFILE_LOG_BYTES)
+
+
+def _new_run(tipo):
+    return {'tipo': tipo, 'inizio': time.time(), '_t0': time.perf_counter(), 'sezioni': []}
+
+
+# Inizio di un rerun completo
+def begin(state):
+    if enabled():
+        state[_RUN_KEY] = _new_run('completo')
+    else:
+        state.pop(_RUN_KEY, None)
+
+
+# Chiude il rerun: registra metriche, log e storico della sessione
+def end(state):
+    run = state.pop(_RUN_KEY, None)
+    if run is None:
+        return
+    run['ms'] = round((time.perf_counter() - run.pop('_t0')) * 1000, 3)
+    run['widget'] = _widget_count()
+    run['stato_bytes'] = state_bytes(state)
+    metrics.record(run)
+    log.write(run)
+    history = state.setdefault(_HISTORY_KEY, deque(maxlen=HISTORY))
+    history.append(run)
+
+
+# Cronometra una sezione. In un rerun parziale di un frammento il rerun
+# completo non è stato aperto: la sezione ne apre e chiude uno proprio
+@contextmanager
+def section(name):
+    if not enabled():
+        yield
+        return
+    state = _st().session_state
+    own_run = _RUN_KEY not in state or fragment_run()
+    if own_run:
+        state[_RUN_KEY] = _new_run('frammento')
+    run = state[_RUN_KEY]
+    widgets_before = _widget_count()
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        # anche quando la sezione termina con st.rerun()
+        widgets_after = _widget_count()
+        run['sezioni'].append({
+            'nome': name,
+            'ms': round((time.perf_counter() - start) * 1000, 3),
+            'widget': (None if widgets_before is None
+                       else widgets_after - widgets_before),
+        })
+        if own_run:
+            end(state)
+
+
+def timed(name):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with section(name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, round(pct / 100 * (len(ordered) - 1)))] if ordered else 0.0
+
+
+# Pannello nascosto nella sidebar (?debug=1) con gli ultimi rerun della sessione
+def render_panel():
+    st = _st()
+    history = list(st.session_state.get(_HISTORY_KEY, ()))
+    with st.sidebar.expander("🛠️ Profilazione rerun", expanded=False):
+        if not history:
+            st.caption("Nessun rerun registrato")
+            return
+        durate = [run['ms'] for run in history]
+        ultimo = history[-1]
+        st.caption(f"{len(history)} rerun · p50 {_percentile(durate, 50):.0f} ms · "
+                   f"p95 {_percentile(durate, 95):.0f} ms · "
+                   f"stato {ultimo['stato_bytes'] / 1024:,.0f} KB")
+        st.dataframe([{'Sezione': s['nome'], 'ms': s['ms'], 'Widget': s['widget']}
+                      for s in ultimo['sezioni']], hide_index=True)
+        st.download_button("Metriche OpenMetrics", metrics.openmetrics(),
+                           file_name="metrics.txt", mime="application/openmetrics-text")
+        st.download_button("Storico JSONL", "".join(encode(run) + "\n" for run in history),
+                           file_name="reruns.jsonl", mime="application/jsonl")
+
+
+# Ricostruisce le metriche da uno o più log (anche ruotati) e le stampa in
+# formato OpenMetrics
+def main(argv=None):
+    paths = (argv if argv is not None else sys.argv[1:]) or [settings.PROFILE_LOG]
+    aggregated = Metrics()
+    for path in map(Path, paths):
+        for candidate in (path.with_name(path.name + ".1"), path):
+            if not candidate.exists():
+                continue
+            with open(candidate, encoding="utf-8") as f:
+                for line in f:
+                    if line.strip():
+                        aggregated.record(json.loads(line))
+    sys.stdout.write(aggregated.openmetrics())
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
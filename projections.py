@@ -0,0 +1,92 @@
+# Motore delle proiezioni finanziarie su NumPy.
+#
+# Dal piano annuale (ricavi e costi per anno) calcola gli scenari migliore,
+# base e peggiore e una simulazione Monte Carlo in cui ricavi e costi seguono
+# una passeggiata casuale moltiplicativa attorno al piano. Tutti i calcoli
+# sono vettoriali sulle simulazioni e sugli anni, e i risultati sono
+# memorizzati per combinazione di parametri: lo stesso piano non viene
+# ricalcolato a ogni rerun.
+from dataclasses import dataclass
+from functools import lru_cache
+
+import numpy as np
+
+MAX_ANNI = 10
+PERCENTILI = (10, 50, 90)
+
+
+@dataclass(frozen=True)
+class Projection:
+    anni: np.ndarray
+    scenari: dict               # nome -> (ricavi, costi, profitto) per anno
+    percentili: dict            # percentile -> profitto cumulato per anno
+    pareggio: dict              # nome scenario -> anno di pareggio o None
+    prob_pareggio: float        # quota di simulazioni che raggiungono il pareggio
+    pareggio_mediano: float     # anno mediano di pareggio (NaN se non raggiunto)
+
+
+# Primo anno (1-based) in cui il profitto cumulato diventa >= 0, lungo
+# l'ultimo asse; 0 se non succede mai
+def break_even_years(profitto):
+    cumulato = np.cumsum(profitto, axis=-1)
+    raggiunto = cumulato >= 0
+    return np.where(raggiunto.any(axis=-1), raggiunto.argmax(axis=-1) + 1, 0)
+
+
+# Anno entro cui almeno metà delle simulazioni è in pari: mediana inferiore
+# degli anni di pareggio, con le simulazioni che non lo raggiungono contate
+# come mai. NaN se va in pari meno di metà delle simulazioni; con un numero
+# pari di simulazioni e metà esatta resta finita (la mediana ordinaria
+# farebbe la media con "mai" e darebbe inf)
+def median_break_even(anni_pareggio):
+    anni = np.sort(np.where(anni_pareggio > 0, anni_pareggio, np.inf))
+    if not len(anni):
+        return float("nan")
+    mediano = anni[(len(anni) - 1) // 2]
+    return float(mediano) if np.isfinite(mediano) else float("nan")
+
+
+def _readonly(array):
+    array.setflags(write=False)
+    return array
+
+
+@lru_cache(maxsize=256)
+def project(ricavi, costi, variazione=0.15, volatilita_ricavi=0.2,
+            volatilita_costi=0.1, simulazioni=2000, seed=0):
+    ricavi = np.asarray(ricavi, dtype=float)
+    costi = np.asarray(costi, dtype=float)
+    anni = np.arange(1, len(ricavi) + 1)
+
+    # Scenari deterministici: lo scarto cresce con l'orizzonte
+    crescita = (1 + variazione) ** anni
+    calo = (1 - variazione) ** anni
+    scenari = {
+        'migliore': (ricavi * crescita, costi * calo ** 0.5),
+        'base': (ricavi, costi),
+        'peggiore': (ricavi * calo, costi * crescita ** 0.5),
+    }
+    scenari = {nome: tuple(_readonly(a) for a in (r, c, r - c))
+               for nome, (r, c) in scenari.items()}
+    pareggio = {nome: int(break_even_years(valori[2])) or None
+                for nome, valori in scenari.items()}
+
+    # Monte Carlo: shock annuali indipendenti, cumulati sugli anni
+    rng = np.random.default_rng(seed)
+    shock_ricavi = rng.normal(0.0, volatilita_ricavi, (simulazioni, len(anni)))
+    shock_costi = rng.normal(0.0, volatilita_costi, (simulazioni, len(anni)))
+    ricavi_sim = ricavi * np.cumprod(np.clip(1 + shock_ricavi, 0, None), axis=1)
+    costi_sim = costi * np.cumprod(np.clip(1 + shock_costi, 0, None), axis=1)
+    profitto_sim = ricavi_sim - costi_sim
+
+    cumulato = np.cumsum(profitto_sim, axis=1)
+    bande = np.percentile(cumulato, PERCENTILI, axis=0)
+    percentili = {p: _readonly(bande[i]) for i, p in enumerate(PERCENTILI)}
+
+    anni_pareggio = break_even_years(profitto_sim)
+    raggiunto = anni_pareggio > 0
+    prob_pareggio = float(raggiunto.mean()) if simulazioni else 0.0
+    pareggio_mediano = median_break_even(anni_pareggio)
+
+    return Projection(_readonly(anni), scenari, percentili, pareggio,
+                      prob_pareggio, pareggio_mediano)
@@ -0,0 +1,57 @@
+# Accesso alle pagine dei revisori, che mostrano i dati di tutti gli invii
+# (contatti, dati finanziari, allegati). Ogni pagina chiama require() prima
+# di leggere qualunque dato: senza il token dei revisori lo script si ferma.
+# I tentativi errati sono contati per sessione: superato il limite la
+# sessione resta bloccata per un po', senza mai fermare il rerun con attese.
+import hashlib
+import hmac
+import time
+
+import streamlit as st
+
+import settings
+
+_KEY = '_revisore'
+_ATTEMPTS = '_revisore_tentativi'     # (errori consecutivi, bloccato fino a)
+
+
+def configured_token():
+    if settings.REVIEWER_TOKEN:
+        return settings.REVIEWER_TOKEN
+    try:
+        return st.secrets.get("reviewer_token", "")
+    except Exception:
+        return ""       # nessun secrets.toml
+
+
+def _digest(token):
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+# Ferma lo script finché la sessione non ha inserito il token corretto; la
+# sessione resta autorizzata finché il token configurato non cambia
+def require():
+    token = configured_token()
+    if not token:
+        st.error("Pagina riservata ai revisori: accesso non configurato (BP_REVIEWER_TOKEN).")
+        st.stop()
+    if hmac.compare_digest(st.session_state.get(_KEY, ""), _digest(token)):
+        return
+    with st.form("accesso_revisori"):
+        st.markdown("### Accesso revisori")
+        attempt = st.text_input("Token di accesso", type="password")
+        sent = st.form_submit_button("Entra")
+    failures, locked_until = st.session_state.get(_ATTEMPTS, (0, 0.0))
+    if sent and time.time() < locked_until:
+        st.error(f"Troppi tentativi errati: riprova tra {int(locked_until - time.time()) + 1} s")
+    elif sent and hmac.compare_digest(attempt.encode("utf-8"), token.encode("utf-8")):
+        st.session_state.pop(_ATTEMPTS, None)
+        st.session_state[_KEY] = _digest(token)
+        st.rerun()
+    elif sent:
+        failures += 1
+        if failures >= settings.REVIEWER_ATTEMPTS:
+            failures, locked_until = 0, time.time() + settings.REVIEWER_LOCKOUT
+        st.session_state[_ATTEMPTS] = (failures, locked_until)
+        st.error("Token non valido")
+    st.stop()
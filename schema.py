@@ -0,0 +1,411 @@
+# Registro unico dei campi del business plan.
+#
+# Ogni campo dichiara una sola volta la sezione di appartenenza, se è
+# obbligatorio e il percorso di esportazione nel JSON. Gli indici derivati
+# (campi obbligatori per sezione, piano di esportazione, valori di default)
+# vengono calcolati una sola volta all'import del modulo, quindi una volta per
+# processo, e progresso, campi mancanti ed esportazione diventano un'unica
+# scansione indicizzata dello stato della sessione. I controlli di formato
+# sono in validation.py. Le chiavi tab*_ dei widget duplicati delle vecchie
+# versioni dell'app vengono ricondotte ai campi canonici da migrate_legacy.
+# Le voci delle liste dinamiche sono record tipizzati con __slots__.
+import math
+import re
+from dataclasses import dataclass, fields, replace
+
+SECTIONS = ("Informazioni Generali", "Allegati Iniziali", "Prodotto/Servizio",
+            "Analisi di Mercato", "Strategia e Implementazione",
+            "Team di Gestione", "Piano Finanziario")
+
+STATI_AZIENDA = ("Esistente", "Da Creare")
+
+# Sentinella per i campi che non vanno inizializzati nello stato
+NO_DEFAULT = object()
+
+
+@dataclass(frozen=True)
+class Field:
+    key: str
+    section: str
+    kind: str = "text"              # text, number, choice, files
+    required: bool = False
+    default: object = NO_DEFAULT
+    choices: tuple = ()
+    export: tuple = ()              # percorso nel JSON esportato
+    aliases: tuple = ()             # chiavi legacy (tab*_), vedi migrate_legacy
+
+
+def _file_names(files):
+    return [f.name for f in files] if files else []
+
+
+# Gli allegati (Handle) finiscono nel JSON come dizionari, così l'esportazione
+# dei documenti ritrova il file nell'archivio
+def _export_value(value):
+    return value.to_dict() if hasattr(value, "to_dict") else value
+
+
+_INFO, _ALLEGATI, _PRODOTTO, _MERCATO, _STRATEGIA, _TEAM, _FINANZA = SECTIONS
+
+FIELDS = (
+    # Informazioni generali
+    Field('nome_azienda', _INFO, required=True, default="",
+          export=('info_generali', 'nome_azienda'), aliases=('tab1_nome_azienda',)),
+    Field('motivazione_bp', _INFO, required=True, default="",
+          export=('info_generali', 'motivazione_bp'), aliases=('tab1_motivazione_bp',)),
+    Field('forma_giuridica', _INFO, kind="choice",
+          export=('info_generali', 'forma_giuridica'), aliases=('tab1_forma_giuridica',)),
+    Field('partita_iva', _INFO, export=('info_generali', 'partita_iva')),
+    Field('capitale_sociale', _INFO, kind="number", export=('info_generali', 'capitale_sociale')),
+    Field('email_aziendale', _INFO, export=('info_generali', 'email_aziendale'),
+          aliases=('tab1_email',)),
+    Field('stato_azienda', _INFO, kind="choice", default="Esistente", choices=STATI_AZIENDA,
+          export=('info_generali', 'stato_azienda'), aliases=('tab1_stato_azienda',)),
+    Field('descrizione_attivita', _INFO, required=True, default="",
+          export=('info_generali', 'descrizione_attivita')),
+    Field('contesto_aziendale', _INFO, default="",
+          export=('info_generali', 'contesto_aziendale')),
+    Field('storia_aziendale', _INFO, default="",
+          export=('info_generali', 'storia_aziendale')),
+    Field('obiettivi_aziendali', _INFO, default="",
+          export=('info_generali', 'obiettivi_aziendali')),
+
+    # Prodotto/Servizio
+    Field('nome_prodotto', _PRODOTTO, required=True, default="",
+          export=('prodotto_servizio', 'nome_prodotto'), aliases=('tab3_nome_prodotto',)),
+    Field('descrizione_prodotto', _PRODOTTO,
+          export=('prodotto_servizio', 'descrizione'), aliases=('tab3_descrizione',)),
+    Field('prezzo_indicativo', _PRODOTTO, default="",
+          export=('prodotto_servizio', 'prezzo_indicativo'), aliases=('tab3_prezzo',)),
+
+    # Analisi di mercato
+    Field('mercato_target', _MERCATO, required=True, default="",
+          export=('analisi_mercato', 'mercato_target'), aliases=('tab4_mercato',)),
+    Field('punti_forza', _MERCATO, default="",
+          export=('swot', 'punti_forza'), aliases=('tab4_forza',)),
+    Field('punti_debolezza', _MERCATO, default="",
+          export=('swot', 'punti_debolezza'), aliases=('tab4_debolezza',)),
+    Field('opportunita', _MERCATO, default="", export=('swot', 'opportunita')),
+    Field('minacce', _MERCATO, default="", export=('swot', 'minacce')),
+
+    # Strategia
+    Field('strategia_marketing', _STRATEGIA, required=True, default="",
+          export=('strategia', 'strategia_marketing'), aliases=('tab5_marketing',)),
+    Field('piano_operativo', _STRATEGIA, required=True, default="",
+          export=('strategia', 'piano_operativo'), aliases=('tab5_operativo',)),
+    Field('canali_distribuzione', _STRATEGIA, required=True, default="",
+          export=('strategia', 'canali_distribuzione'), aliases=('tab5_canali',)),
+    Field('budget_marketing', _STRATEGIA, kind="number", default=0,
+          export=('strategia', 'budget_marketing'), aliases=('tab7_budget',)),
+
+    # Team
+    Field('nome_fondatore', _TEAM, required=True, default="",
+          export=('team', 'nome_fondatore'), aliases=('tab6_nome',)),
+    Field('ruolo_fondatore', _TEAM, required=True, default="",
+          export=('team', 'ruolo_fondatore'), aliases=('tab6_ruolo',)),
+    Field('esperienza_team', _TEAM, required=True,
+          export=('team', 'esperienza_team'), aliases=('tab6_esperienza',)),
+
+    # Piano finanziario
+    Field('anni_bp', _FINANZA, kind="number", default=3, export=('finanziario', 'anni_bp')),
+    Field('investimento_iniziale', _FINANZA, kind="number", default=0,
+          export=('finanziario', 'investimento_iniziale'), aliases=('tab7_investimento',)),
+    Field('note_proiezioni', _FINANZA, default="",
+          export=('finanziario', 'note_proiezioni'), aliases=('tab7_proiezioni',)),
+    Field('variazione_scenari', _FINANZA, kind="number", default=15),
+    Field('volatilita_ricavi', _FINANZA, kind="number", default=20),
+    Field('volatilita_costi', _FINANZA, kind="number", default=10),
+    Field('simulazioni', _FINANZA, kind="number", default=2000),
+    Field('doc_finanziari', _FINANZA, kind="files",
+          export=('finanziario', 'documenti')),
+    Field('sito_web', _FINANZA, default="", export=('info_generali', 'sito_web')),
+)
+
+# Indici precalcolati una volta per processo
+BY_KEY = {f.key: f for f in FIELDS}
+REQUIRED = tuple(f for f in FIELDS if f.required)
+REQUIRED_BY_SECTION = {
+    section: tuple(f for f in REQUIRED if f.section == section)
+    for section in SECTIONS
+    if any(f.section == section for f in REQUIRED)
+}
+EXPORT_PLAN = tuple(f for f in FIELDS if f.export)
+EXPORT_SECTIONS = tuple(dict.fromkeys(f.export[0] for f in EXPORT_PLAN))
+INITIAL = tuple(f for f in FIELDS if f.default is not NO_DEFAULT)
+
+# Voce di una lista dinamica: unica copia dei valori, i widget delle schede vi
+# riscrivono le modifiche. Nelle bozze e nell'archivio le voci restano
+# dizionari, riconvertiti in record al caricamento
+class Entry:
+    __slots__ = ()
+
+    def to_dict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    # I campi di testo accettano anche le celle dei file importati: vuote
+    # (None, NaN di pandas) o non testuali
+    @classmethod
+    def from_dict(cls, data):
+        values = {}
+        for f in fields(cls):
+            value = data.get(f.name)
+            if f.type is str:
+                value = "" if value is None or (isinstance(value, float) and math.isnan(value)) \
+                    else str(value)
+            values[f.name] = value
+        return cls(**values)
+
+    # Valori della voce in ordine: confrontabili e hashabili, per capire
+    # senza serializzare se una lista è cambiata
+    def astuple(self):
+        return tuple(getattr(self, name) for name in self.__slots__)
+
+    def is_empty(self):
+        return all(value in (None, "") for value in self.astuple())
+
+
+@dataclass(slots=True)
+class Prodotto(Entry):
+    nome: str = ""
+    descrizione: str = ""
+    immagine: object = None     # Handle dell'immagine caricata
+
+
+@dataclass(slots=True)
+class Concorrente(Entry):
+    nome: str = ""
+    url: str = ""
+    note: str = ""
+
+
+@dataclass(slots=True)
+class MembroTeam(Entry):
+    nome: str = ""
+    ruolo: str = ""
+    esperienza: str = ""
+
+
+# Liste dinamiche: chiave nello stato -> (prefisso dei widget, attributi
+# legati ai widget `{prefisso}_{i}_{attributo}`)
+LISTS = {
+    'prodotti': ('prodotto', ('nome', 'descrizione')),
+    'concorrenti': ('concorrente', ('nome', 'url', 'note')),
+    'team_members': ('team_member', ('nome', 'ruolo', 'esperienza')),
+}
+
+RECORDS = {'prodotti': Prodotto, 'concorrenti': Concorrente, 'team_members': MembroTeam}
+
+# Liste dinamiche nel JSON esportato: chiave nello stato -> percorso
+EXPORT_LISTS = {
+    'prodotti': ('prodotto_servizio', 'prodotti'),
+    'concorrenti': ('analisi_mercato', 'concorrenti'),
+    'team_members': ('team', 'membri'),
+}
+
+ATTACHMENT_SLOTS = ('visura', 'business_plan', 'sito_azienda', 'sito_concorrenti', 'cv_team',
+                    'doc_finanziari')
+
+# Chiavi dello stato che fanno parte dei dati compilati (bozze, sessioni)
+EXTRA_KEYS = ('siti_concorrenti', 'fonti_mercato')
+PERSISTENT_KEYS = frozenset(
+    [f.key for f in FIELDS] + list(EXTRA_KEYS) + list(ATTACHMENT_SLOTS)
+)
+
+# Chiavi legacy -> chiave canonica, per la migrazione di bozze e invii
+# salvati quando ogni scheda aveva un secondo gruppo di widget tab*_
+LEGACY_KEYS = {alias: f.key for f in FIELDS for alias in f.aliases}
+LEGACY_SLOTS = {'tab2_visura': 'visura', 'tab2_business_plan': 'business_plan'}
+# immagini dei prodotti salvate in slot separati prima dei record
+LEGACY_IMAGE = re.compile(r"prodotto_(\d+)_immagine")
+DYNAMIC_KEY = re.compile(r"(ricavi|costi)_anno\d+")
+
+
+# Valore corrente di un campo nello stato
+def get_value(state, field):
+    return state.get(field.key)
+
+
+def is_filled(field, value):
+    if field.kind == "text":
+        return bool(value and value.strip())
+    if field.kind == "files":
+        return bool(value)
+    return value not in (None, "")
+
+
+def initialize_state(state):
+    for f in INITIAL:
+        value = state.get(f.key, NO_DEFAULT)
+        if value is NO_DEFAULT:
+            state[f.key] = f.default
+        elif f.kind == "number" and not isinstance(value, (int, float)):
+            state[f.key] = f.default
+        elif f.choices and value not in f.choices:
+            state[f.key] = f.default
+
+
+# Riporta sotto le chiavi canoniche i valori delle chiavi legacy e le
+# rimuove; il valore legacy prevale solo se il campo canonico è vuoto o
+# ancora al valore di default. Le liste dinamiche diventano record e le
+# immagini dei prodotti salvate a parte tornano nella voce. Lavora sul posto
+# e restituisce lo stato
+def migrate_legacy(state):
+    load_entries(state)
+    for alias in [key for key in state.keys() if key in LEGACY_KEYS or key in LEGACY_SLOTS]:
+        value = state.pop(alias)
+        if alias in LEGACY_SLOTS:
+            slot = LEGACY_SLOTS[alias]
+            handles = list(state.get(slot) or [])
+            digests = {getattr(h, 'digest', None) for h in handles}
+            state[slot] = handles + [h for h in value or [] if getattr(h, 'digest', None) not in digests]
+            state.pop(f"_{alias}_nonce", None)
+            continue
+        f = BY_KEY[LEGACY_KEYS[alias]]
+        current = state.get(f.key)
+        if value in (None, "") or not (current in (None, "") or current == f.default):
+            continue
+        state[f.key] = value
+    for key in [key for key in state.keys() if LEGACY_IMAGE.fullmatch(key)]:
+        handles = state.pop(key)
+        state.pop(f"_{key}_nonce", None)
+        index = int(LEGACY_IMAGE.fullmatch(key).group(1))
+        prodotti = list(state.get('prodotti') or ())
+        if handles and index < len(prodotti) and prodotti[index].immagine is None:
+            # copia: le voci possono essere condivise con lo stato originale
+            prodotti[index] = replace(prodotti[index], immagine=handles[0])
+            state['prodotti'] = prodotti
+    return state
+
+
+def is_persistent(key):
+    return key in PERSISTENT_KEYS or DYNAMIC_KEY.fullmatch(key) is not None
+
+
+# Voci di una lista dinamica come record, dai record stessi o dai dizionari
+# di bozze e invii
+def entries(name, values):
+    cls = RECORDS[name]
+    return [value if isinstance(value, cls) else cls.from_dict(value) for value in values or ()]
+
+
+def list_entries(state, name):
+    return entries(name, state.get(name))
+
+
+# Converte in record le liste dinamiche lette da bozze, invii o file di
+# scarico; sul posto
+def load_entries(state):
+    for name in RECORDS:
+        if state.get(name) is not None:
+            state[name] = list_entries(state, name)
+    return state
+
+
+# Coppie (chiave, valore) dei dati compilati
+def persistent_items(state):
+    for key in list(state.keys()):
+        if key in LISTS or is_persistent(key):
+            yield key, state[key]
+
+
+# Impronta strutturale di una lista di voci: cambia se cambia una voce
+def entries_shape(values):
+    return hash(tuple(entry.astuple() for entry in values))
+
+
+@dataclass(frozen=True)
+class Summary:
+    progress: float
+    sections: dict      # sezione -> (completati, totali)
+    missing: tuple
+
+
+# Unica scansione dei campi obbligatori per progresso, sezioni e mancanti
+def summarize(state):
+    sections = {}
+    missing = []
+    for section, fields in REQUIRED_BY_SECTION.items():
+        completed = 0
+        for f in fields:
+            if is_filled(f, get_value(state, f)):
+                completed += 1
+            else:
+                missing.append(f.key)
+        sections[section] = (completed, len(fields))
+    progress = (len(REQUIRED) - len(missing)) / len(REQUIRED)
+    return Summary(progress, sections, tuple(missing))
+
+
+def validate_data(state):
+    return [f.key for f in REQUIRED if not is_filled(f, get_value(state, f))]
+
+
+# Valore di un campo numerico come float (vuoto -> 0); default se non è un
+# numero
+def number(value, default=0.0):
+    try:
+        return float(value or 0)
+    except (TypeError, ValueError):
+        return default
+
+
+# Stato normalizzato: valori sotto le chiavi canoniche, testo senza spazi
+# superflui, numeri inseriti come testo convertiti
+def normalize(state):
+    normalized = migrate_legacy(dict(state))
+    for f in FIELDS:
+        value = normalized.get(f.key)
+        if f.kind == "text" and isinstance(value, str):
+            value = value.strip()
+        elif f.kind == "number" and isinstance(value, str):
+            try:
+                value = float(value.replace(",", "."))
+            except ValueError:
+                value = None
+        if value is not None:
+            normalized[f.key] = value
+    return normalized
+
+
+def generate_json(state, proiezioni):
+    data = {section: {} for section in EXPORT_SECTIONS}
+    data['finanziario']['proiezioni'] = proiezioni
+    for f in EXPORT_PLAN:
+        value = get_value(state, f)
+        if f.kind == "files":
+            value = _file_names(value)
+        section, name = f.export
+        data[section][name] = value
+    # le voci lasciate vuote non vengono esportate
+    for list_key, (section, name) in EXPORT_LISTS.items():
+        data[section][name] = [
+            {attr: _export_value(value) for attr, value in entry.to_dict().items()}
+            for entry in list_entries(state, list_key)
+            if not entry.is_empty()
+        ]
+    data['finanziario']['riepilogo'] = {
+        kind: sum(anno[kind] for anno in proiezioni.values())
+        for kind in ('ricavi', 'costi', 'profitto')
+    }
+    return data
+
+
+# Ricavi e costi per ogni anno del piano, come tuple
+def financial_plan(state):
+    anni = range(1, int(state.get('anni_bp') or BY_KEY['anni_bp'].default) + 1)
+    ricavi = tuple(state.get(f"ricavi_anno{anno}") or 0 for anno in anni)
+    costi = tuple(state.get(f"costi_anno{anno}") or 0 for anno in anni)
+    return ricavi, costi
+
+
+# Proiezioni annuali del piano finanziario: gli anni con almeno un valore
+def calculate_projections(state):
+    proiezioni = {}
+    for anno, (ricavi, costi) in enumerate(zip(*financial_plan(state)), 1):
+        if ricavi or costi:
+            proiezioni[anno] = {
+                'ricavi': ricavi,
+                'costi': costi,
+                'profitto': ricavi - costi
+            }
+    return proiezioni
@@ -0,0 +1,259 @@
+# Indice di ricerca degli invii per la console di revisione.
+#
+# Gli invii dell'archivio (submissions) vengono copiati in un database SQLite
+# con una tabella per i valori numerici, indicizzati con B-tree per filtri e
+# ordinamenti, e una tabella FTS5 per il testo, con una colonna per sezione
+# del modulo ricavata dallo stesso registro dei campi (schema.FIELDS).
+# L'aggiornamento è incrementale: per ogni segmento si ricorda quanti record
+# sono già stati indicizzati e i segmenti sigillati letti per intero non
+# vengono più aperti. La console di revisione non aggiorna l'indice durante il
+# rerun: accoda l'aggiornamento al pianificatore (schedule), come l'indice dei
+# duplicati. Le ricerche paginate leggono solo la pagina richiesta.
+#
+#   python search.py            aggiorna l'indice
+#   python search.py --rebuild  lo ricostruisce da zero
+import argparse
+import re
+import sqlite3
+import sys
+import threading
+import time
+
+import jobs
+import schema
+import settings
+import submissions
+from drafts import encode
+
+# Colonne di testo: una per sezione, con i campi testuali del registro
+TEXT_SECTIONS = {
+    'generali': schema.SECTIONS[0],
+    'prodotto': schema.SECTIONS[2],
+    'mercato': schema.SECTIONS[3],
+    'strategia': schema.SECTIONS[4],
+    'team': schema.SECTIONS[5],
+}
+TEXT_FIELDS = {
+    column: tuple(f for f in schema.FIELDS if f.section == section and f.kind == "text")
+    for column, section in TEXT_SECTIONS.items()
+}
+# Liste dinamiche indicizzate insieme alla sezione di appartenenza
+LIST_COLUMNS = {'prodotti': 'prodotto', 'concorrenti': 'mercato', 'team_members': 'team'}
+
+# Valori numerici del modulo (esclusi i parametri della simulazione)
+NUMERIC_FIELDS = tuple(f.key for f in schema.FIELDS
+                       if f.kind == "number" and f.section != schema.SECTIONS[6])
+
+ORDERS = {
+    'recenti': "p.submitted_at DESC",
+    'ricavi': "p.ricavi_totali DESC",
+    'budget': "p.budget_marketing DESC",
+    'completamento': "p.completamento DESC",
+    'pertinenza': "rank",
+}
+
+_SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS plans (
+    rowid INTEGER PRIMARY KEY,
+    id TEXT NOT NULL UNIQUE,
+    submitted_at TEXT NOT NULL,
+    nome_azienda TEXT NOT NULL,
+    forma_giuridica TEXT,
+    {", ".join(f"{key} REAL" for key in NUMERIC_FIELDS)},
+    ricavi_totali REAL NOT NULL,
+    costi_totali REAL NOT NULL,
+    completamento REAL NOT NULL,
+    payload TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS plans_submitted_at ON plans (submitted_at);
+CREATE INDEX IF NOT EXISTS plans_ricavi ON plans (ricavi_totali);
+CREATE INDEX IF NOT EXISTS plans_completamento ON plans (completamento);
+CREATE INDEX IF NOT EXISTS plans_forma ON plans (forma_giuridica);
+{"".join(f"CREATE INDEX IF NOT EXISTS plans_{key} ON plans ({key});" for key in NUMERIC_FIELDS)}
+CREATE VIRTUAL TABLE IF NOT EXISTS plans_fts USING fts5 (
+    {", ".join(TEXT_SECTIONS)},
+    tokenize = 'unicode61 remove_diacritics 2'
+);
+"""
+
+REFRESH_INTERVAL = 2.0
+BATCH = 500
+
+
+# Riga dell'indice ricavata da un record dell'archivio invii
+def document(record):
+    state = schema.normalize(record.get('state') or {})
+    texts = {column: [schema.get_value(state, f) or "" for f in fields]
+             for column, fields in TEXT_FIELDS.items()}
+    for list_key, column in LIST_COLUMNS.items():
+        for entry in schema.list_entries(state, list_key):
+            texts[column] += [value for value in entry.astuple() if isinstance(value, str)]
+    proiezioni = schema.calculate_projections(state)
+    row = {
+        'id': record['id'],
+        'submitted_at': record['submitted_at'],
+        'nome_azienda': schema.get_value(state, schema.BY_KEY['nome_azienda']) or "",
+        'forma_giuridica': schema.get_value(state, schema.BY_KEY['forma_giuridica']),
+        **{key: schema.number(state.get(key)) for key in NUMERIC_FIELDS},
+        'ricavi_totali': sum(schema.number(p['ricavi']) for p in proiezioni.values()),
+        'costi_totali': sum(schema.number(p['costi']) for p in proiezioni.values()),
+        'completamento': schema.summarize(state).progress,
+        'payload': encode(record.get('payload') or {}),
+    }
+    return row, {column: "\n".join(t for t in values if t) for column, values in texts.items()}
+
+
+# Testo libero -> query FTS5: ogni parola diventa un prefisso tra virgolette,
+# quindi la sintassi FTS non può essere iniettata; "colonna:parola" limita la
+# ricerca a una sezione
+def fts_query(text):
+    terms = []
+    for match in re.finditer(r"(?:(\w+):)?([\w'’]+)", text or ""):
+        column, word = match.groups()
+        word = word.replace('"', "")
+        term = f'"{word}"*'
+        if column in TEXT_SECTIONS:
+            term = f"{column} : {term}"
+        terms.append(term)
+    return " AND ".join(terms)
+
+
+class SubmissionIndex:
+    def __init__(self, path, sink=None):
+        self.path = path
+        self.sink = sink if sink is not None else submissions.sink
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._last_refresh = 0.0
+        self._job = None
+        self._job_lock = threading.Lock()
+
+    def _connect(self):
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        conn = sqlite3.connect(self.path, timeout=30, check_same_thread=False)
+        conn.row_factory = sqlite3.Row
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.executescript(_SCHEMA + submissions.PROGRESS_SCHEMA)
+        return conn
+
+    # Una connessione per thread: in WAL le ricerche non bloccano l'aggiornamento
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self._connect()
+        return conn
+
+    # Indicizza gli invii arrivati dall'ultimo aggiornamento; al più una volta
+    # ogni REFRESH_INTERVAL secondi per processo, salvo force
+    def refresh(self, force=False):
+        with self._lock:
+            if not force and time.monotonic() - self._last_refresh < REFRESH_INTERVAL:
+                return 0
+            self._last_refresh = time.monotonic()
+            conn = self._conn()
+            tail = submissions.Tail.from_db(self.sink, conn)
+            added = sum(self._insert(conn, batch) for batch in tail.batches(BATCH))
+            tail.seal(conn)
+            return added
+
+    # Accoda l'aggiornamento al pianificatore come lavoro in blocco, se non ce
+    # n'è già uno in corso e l'ultimo risale a più di REFRESH_INTERVAL
+    # secondi; restituisce l'ultimo lavoro, None se la coda è piena
+    def schedule(self):
+        with self._job_lock:
+            if ((self._job is None or self._job.finished)
+                    and time.monotonic() - self._last_refresh >= REFRESH_INTERVAL):
+                try:
+                    self._job = jobs.scheduler.submit(lambda job: self.refresh(),
+                                                      priority=jobs.BULK)
+                except jobs.Busy:
+                    return None
+            return self._job
+
+    def _insert(self, conn, batch):
+        added = 0
+        with conn:
+            for segment, index, record in batch:
+                row, texts = document(record)
+                columns = ", ".join(row)
+                cursor = conn.execute(
+                    f"INSERT INTO plans ({columns}) VALUES ({', '.join('?' * len(row))}) "
+                    "ON CONFLICT (id) DO NOTHING", tuple(row.values()))
+                if cursor.rowcount:
+                    conn.execute(
+                        f"INSERT INTO plans_fts (rowid, {', '.join(texts)}) "
+                        f"VALUES (?, {', '.join('?' * len(texts))})",
+                        (cursor.lastrowid, *texts.values()))
+                    added += 1
+            submissions.Tail.save(conn, batch)
+        return added
+
+    def rebuild(self):
+        with self._lock:
+            conn = self._conn()
+            with conn:
+                conn.execute("DELETE FROM plans")
+                conn.execute("DELETE FROM plans_fts")
+                conn.execute("DELETE FROM progress")
+        return self.refresh(force=True)
+
+    # Pagina di risultati e numero totale; i filtri numerici sono soglie minime
+    def search(self, text="", forma_giuridica=None, min_budget=None, min_ricavi=None,
+               min_completamento=None, order='recenti', limit=20, offset=0):
+        where = []
+        params = []
+        query = fts_query(text)
+        source = "plans p"
+        if query:
+            source = "plans_fts JOIN plans p ON p.rowid = plans_fts.rowid"
+            where.append("plans_fts MATCH ?")
+            params.append(query)
+        elif order == 'pertinenza':
+            order = 'recenti'
+        for column, value in (('p.budget_marketing', min_budget),
+                              ('p.ricavi_totali', min_ricavi),
+                              ('p.completamento', min_completamento)):
+            if value:
+                where.append(f"{column} >= ?")
+                params.append(value)
+        if forma_giuridica:
+            where.append("p.forma_giuridica = ?")
+            params.append(forma_giuridica)
+        clause = f" WHERE {' AND '.join(where)}" if where else ""
+        conn = self._conn()
+        total = conn.execute(f"SELECT count(*) FROM {source}{clause}", params).fetchone()[0]
+        snippet = ("snippet(plans_fts, -1, '**', '**', '…', 12)" if query else "''")
+        rows = conn.execute(
+            f"SELECT p.id, p.submitted_at, p.nome_azienda, p.forma_giuridica, "
+            f"p.budget_marketing, p.ricavi_totali, p.costi_totali, p.completamento, "
+            f"{snippet} AS estratto FROM {source}{clause} "
+            f"ORDER BY {ORDERS[order]} LIMIT ? OFFSET ?",
+            params + [limit, offset]).fetchall()
+        return [dict(row) for row in rows], total
+
+    def get(self, submission_id):
+        row = self._conn().execute("SELECT * FROM plans WHERE id = ?",
+                                   (submission_id,)).fetchone()
+        return dict(row) if row else None
+
+    def __len__(self):
+        return self._conn().execute("SELECT count(*) FROM plans").fetchone()[0]
+
+
+index = SubmissionIndex(settings.SEARCH_DB)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Aggiorna l'indice di ricerca degli invii")
+    parser.add_argument("--rebuild", action="store_true", help="ricostruisce l'indice da zero")
+    args = parser.parse_args(argv)
+    started = time.perf_counter()
+    added = index.rebuild() if args.rebuild else index.refresh(force=True)
+    print(f"{added} invii indicizzati in {time.perf_counter() - started:.1f} s "
+          f"({len(index)} in totale)", file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
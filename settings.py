@@ -0,0 +1,73 @@
+# Percorsi e limiti configurabili tramite variabili d'ambiente, condivisi dai
+# moduli di supporto dell'app
+import os
+from pathlib import Path
+
+DATA_DIR = Path(os.environ.get("BP_DATA_DIR",
+                               Path(__file__).resolve().parent / ".bp_data"))
+
+ATTACHMENTS_DIR = DATA_DIR / "allegati"
+
+DRAFTS_DB = DATA_DIR / "bozze.sqlite3"
+AUTOSAVE_DEBOUNCE = float(os.environ.get("BP_AUTOSAVE_DEBOUNCE", "0.5"))
+
+# Backend delle bozze: vuoto per il file SQLite locale, sqlite:///percorso o
+# redis://host:porta/db per condividerle tra worker e host
+SESSION_STORE = os.environ.get("BP_SESSION_STORE", "")
+SESSION_STORE_TTL = float(os.environ.get("BP_SESSION_STORE_TTL", str(30 * 24 * 3600)))
+SESSION_STORE_DRAIN = float(os.environ.get("BP_SESSION_STORE_DRAIN", "5"))
+
+SUBMISSIONS_DIR = DATA_DIR / "invii"
+SEGMENT_BYTES = int(os.environ.get("BP_SEGMENT_MB", "64")) * 1024 * 1024
+COMMIT_WINDOW = float(os.environ.get("BP_COMMIT_WINDOW", "0.02"))
+SEARCH_DB = DATA_DIR / "indice_invii.sqlite3"
+
+# Indice dei piani quasi duplicati: somiglianza stimata (0-1) oltre la quale
+# un invio viene segnalato
+DUPLICATES_DB = DATA_DIR / "duplicati.sqlite3"
+DUPLICATE_THRESHOLD = float(os.environ.get("BP_DUPLICATE_THRESHOLD", "0.5"))
+
+EXTRACTION_DIR = DATA_DIR / "testi"
+EXTRACTION_WORKERS = int(os.environ.get("BP_EXTRACTION_WORKERS", "2"))
+# Tempo massimo di un'estrazione e attesa prima di ritentarne una fallita
+EXTRACTION_TIMEOUT = float(os.environ.get("BP_EXTRACTION_TIMEOUT", "120"))
+EXTRACTION_RETRY = float(os.environ.get("BP_EXTRACTION_RETRY", "600"))
+
+PROFILE = os.environ.get("BP_PROFILE", "") == "1"
+PROFILE_LOG = DATA_DIR / "profilo" / "reruns.jsonl"
+PROFILE_LOG_BYTES = int(os.environ.get("BP_PROFILE_LOG_MB", "16")) * 1024 * 1024
+
+# Memoria per sessione: oltre il budget le liste vengono scaricate su disco
+# tra un rerun e l'altro; le sessioni inattive vengono scaricate per intero
+SESSION_BUDGET = int(float(os.environ.get("BP_SESSION_BUDGET_MB", "32")) * 1024 * 1024)
+SESSION_IDLE = float(os.environ.get("BP_SESSION_IDLE", "900"))
+SPILL_DIR = DATA_DIR / "sessioni"
+
+FETCH_TTL = float(os.environ.get("BP_FETCH_TTL", str(24 * 3600)))
+FETCH_RETRY_AFTER = float(os.environ.get("BP_FETCH_RETRY_AFTER", "300"))
+FETCH_PER_HOST = int(os.environ.get("BP_FETCH_PER_HOST", "2"))
+FETCH_CONNECTIONS = int(os.environ.get("BP_FETCH_CONNECTIONS", "16"))
+FETCH_TIMEOUT = float(os.environ.get("BP_FETCH_TIMEOUT", "10"))
+
+# Documenti esportati (DOCX, PDF, Markdown), conservati per il download
+EXPORT_DIR = DATA_DIR / "documenti"
+EXPORT_TTL = float(os.environ.get("BP_EXPORT_TTL", str(24 * 3600)))
+
+# Pianificatore dei lavori pesanti (anteprime, esportazioni): thread del
+# processo, di cui al più JOB_BULK_WORKERS per i lavori in blocco, e limiti
+# per sessione su lavori in esecuzione e in coda
+JOB_WORKERS = int(os.environ.get("BP_JOB_WORKERS", "4"))
+JOB_BULK_WORKERS = int(os.environ.get("BP_JOB_BULK_WORKERS", "2"))
+JOB_SESSION_RUNNING = int(os.environ.get("BP_JOB_SESSION_RUNNING", "2"))
+JOB_SESSION_QUEUED = int(os.environ.get("BP_JOB_SESSION_QUEUED", "16"))
+JOB_QUEUE = int(os.environ.get("BP_JOB_QUEUE", "256"))
+JOB_RESULT_TTL = float(os.environ.get("BP_JOB_RESULT_TTL", "600"))
+
+# Pagine dei revisori (console degli invii, portafoglio): accesso con questo
+# token, o con reviewer_token in .streamlit/secrets.toml; senza token
+# configurato le pagine restano chiuse
+REVIEWER_TOKEN = os.environ.get("BP_REVIEWER_TOKEN", "")
+# Dopo questo numero di token errati la sessione non può riprovare per
+# REVIEWER_LOCKOUT secondi
+REVIEWER_ATTEMPTS = int(os.environ.get("BP_REVIEWER_ATTEMPTS", "5"))
+REVIEWER_LOCKOUT = float(os.environ.get("BP_REVIEWER_LOCKOUT", "60"))
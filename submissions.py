@@ -0,0 +1,382 @@
+# Archivio degli invii: segmenti JSONL in sola aggiunta.
+#
+# Ogni processo scrive in un proprio segmento attivo (`NNNNNN-<writer>.active.jsonl`)
+# che, superata la dimensione massima, viene sigillato rinominandolo in
+# `.jsonl`. Un thread di scrittura raccoglie gli invii arrivati nella stessa
+# finestra e li rende persistenti con un solo fsync (group commit), così i
+# picchi di invii vicino alle scadenze dei bandi non pagano un fsync ciascuno.
+# I segmenti sigillati possono essere compattati in Parquet, con una colonna
+# tipizzata per ogni campo del modulo oltre ai record completi; la lettura è
+# sempre pigra, segmento per segmento. Il processo che scrive tiene un lock
+# (flock) sul proprio segmento attivo: un segmento attivo viene compattato
+# solo se il lock è libero, cioè se il suo processo non c'è più.
+#
+#   python submissions.py compact
+import argparse
+import os
+import queue
+import socket
+import sys
+import threading
+import time
+import uuid
+from datetime import datetime, timezone
+from pathlib import Path
+
+import schema
+import settings
+from drafts import decode, encode
+
+try:
+    import fcntl
+except ImportError:         # senza flock i segmenti attivi non si compattano mai
+    fcntl = None
+
+SCHEMA_VERSION = 1
+MAX_BATCH = 512
+ACTIVE_SUFFIX = ".active.jsonl"
+
+# Campi del modulo con una colonna propria nei segmenti Parquet (gli allegati
+# restano solo nello stato completo)
+PARQUET_FIELDS = tuple(f for f in schema.FIELDS if f.kind != "files")
+
+
+def segment_name(path):
+    return path.name.split(".", 1)[0]
+
+
+class Receipt:
+    def __init__(self, submission_id):
+        self.id = submission_id
+        self._done = threading.Event()
+        self.error = None
+
+    def wait(self, timeout=None):
+        return self._done.wait(timeout)
+
+    @property
+    def durable(self):
+        return self._done.is_set() and self.error is None
+
+
+class SubmissionSink:
+    def __init__(self, root, segment_bytes=settings.SEGMENT_BYTES,
+                 commit_window=settings.COMMIT_WINDOW):
+        self.root = Path(root)
+        self.segment_bytes = segment_bytes
+        self.commit_window = commit_window
+        self.writer_id = f"{socket.gethostname().replace('.', '_')}-{os.getpid()}"
+        self._queue = queue.SimpleQueue()
+        self._writer = None
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+
+    # Accoda un invio validato; la ricevuta si completa dopo l'fsync
+    def append(self, payload, state=None):
+        receipt = Receipt(uuid.uuid4().hex)
+        record = {
+            'id': receipt.id,
+            'submitted_at': datetime.now(timezone.utc).isoformat(),
+            'schema_version': SCHEMA_VERSION,
+            'payload': payload,
+            'state': state or {},
+        }
+        line = (encode(record) + "\n").encode("utf-8")
+        self._ensure_writer()
+        self._queue.put((line, receipt))
+        return receipt
+
+    def _ensure_writer(self):
+        with self._lock:
+            if self._writer is None:
+                self.root.mkdir(parents=True, exist_ok=True)
+                self._writer = threading.Thread(target=self._run, name="submission-writer",
+                                                daemon=True)
+                self._writer.start()
+
+    def _next_sequence(self):
+        numbers = [int(segment_name(p).split("-", 1)[0]) for p in self.root.glob("*-*.*")
+                   if segment_name(p).split("-", 1)[0].isdigit()]
+        return max(numbers, default=0) + 1
+
+    def _open_segment(self):
+        seq = self._next_sequence()
+        self._path = self.root / f"{seq:06d}-{self.writer_id}{ACTIVE_SUFFIX}"
+        self._file = open(self._path, "ab")
+        if fcntl is not None:
+            # tenuto finché il file è aperto, anche se il processo resta
+            # inattivo per giorni; si libera da solo se il processo muore
+            fcntl.flock(self._file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+
+    def _seal_segment(self):
+        if self._file is None:
+            return
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self._file.close()
+        os.replace(self._path, self._path.with_name(segment_name(self._path) + ".jsonl"))
+        self._file = self._path = None
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.commit_window
+            while len(batch) < MAX_BATCH:
+                timeout = deadline - time.monotonic()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=timeout))
+                except queue.Empty:
+                    break
+            self._commit(batch)
+
+    def _commit(self, batch):
+        error = None
+        try:
+            for line, _ in batch:
+                if not line:
+                    continue
+                if self._file is None:
+                    self._open_segment()
+                elif self._file.tell() and self._file.tell() + len(line) > self.segment_bytes:
+                    self._seal_segment()
+                    self._open_segment()
+                self._file.write(line)
+            if self._file is not None:
+                self._file.flush()
+                os.fsync(self._file.fileno())
+        except OSError as exc:
+            error = exc
+        for _, receipt in batch:
+            receipt.error = error
+            receipt._done.set()
+
+    # Attende la scrittura di quanto accodato e sigilla il segmento attivo
+    def close(self, timeout=None):
+        if self._writer is None:
+            return
+        marker = Receipt(None)
+        self._queue.put((b"", marker))
+        marker.wait(timeout)
+        with self._lock:
+            self._seal_segment()
+
+    def segments(self):
+        return sorted(self.root.glob("*.jsonl")) + sorted(self.root.glob("*.parquet"))
+
+    # Scansione pigra: restituisce (segmento, indice, record). progress
+    # (segmento -> record già letti) permette ai consumatori incrementali di
+    # ripartire da dove erano arrivati; i segmenti in complete, già letti per
+    # intero, non vengono nemmeno aperti
+    def scan(self, progress=None, complete=()):
+        progress = progress or {}
+        paths = {}
+        for path in self.segments():
+            paths.setdefault(segment_name(path), path)
+        for name in sorted(paths):
+            if name in complete:
+                continue
+            path = paths[name]
+            skip = progress.get(name, 0)
+            if path.suffix == ".parquet":
+                yield from _scan_parquet(path, name, skip)
+            else:
+                yield from _scan_jsonl(path, name, skip)
+
+    def __iter__(self):
+        for _, _, record in self.scan():
+            yield record
+
+    # Converte in Parquet i segmenti sigillati e quelli attivi rimasti orfani
+    # (processo di scrittura terminato); richiede pyarrow
+    def compact(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        compacted = []
+        for path in sorted(self.root.glob("*.jsonl")):
+            if path == self._path:
+                continue
+            if not is_sealed(path) and not _orphaned(path):
+                continue
+            rows = {name: [] for name in _parquet_schema(pa).names}
+            for _, _, record in _scan_jsonl(path, segment_name(path), 0):
+                rows['id'].append(record['id'])
+                rows['submitted_at'].append(record['submitted_at'])
+                rows['schema_version'].append(record['schema_version'])
+                rows['payload'].append(encode(record['payload']))
+                rows['state'].append(encode(record['state']))
+                state = schema.normalize(record['state'] or {})
+                for f in PARQUET_FIELDS:
+                    rows[f.key].append(_column_value(f, state.get(f.key)))
+            target = path.with_name(segment_name(path) + ".parquet")
+            tmp = target.with_suffix(".parquet.tmp")
+            pq.write_table(pa.table(rows, schema=_parquet_schema(pa)), tmp)
+            os.replace(tmp, target)
+            path.unlink()
+            compacted.append(target)
+        return compacted
+
+
+# Colonne dei segmenti Parquet: metadati, record completi in JSON e un campo
+# tipizzato per colonna, interrogabile senza decodificare lo stato
+def _parquet_schema(pa):
+    return pa.schema(
+        [('id', pa.string()), ('submitted_at', pa.string()), ('schema_version', pa.int64()),
+         ('payload', pa.string()), ('state', pa.string())]
+        + [(f.key, pa.float64() if f.kind == "number" else pa.string()) for f in PARQUET_FIELDS])
+
+
+def _column_value(field, value):
+    if value in (None, ""):
+        return None
+    if field.kind == "number":
+        try:
+            return float(value)
+        except (TypeError, ValueError):
+            return None
+    return str(value)
+
+
+# Un segmento sigillato (o compattato) non riceve più invii
+def is_sealed(path):
+    return not path.name.endswith(ACTIVE_SUFFIX)
+
+
+# Tabella con cui gli indici SQLite ricordano, per segmento, quanti record
+# hanno già letto e se il segmento, sigillato, è stato letto per intero
+PROGRESS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS progress (
+    segment TEXT PRIMARY KEY,
+    records INTEGER NOT NULL,
+    complete INTEGER NOT NULL DEFAULT 0
+) WITHOUT ROWID;
+"""
+
+
+# Lettura incrementale dell'archivio per gli indici derivati (ricerca,
+# duplicati, portafoglio). progress: segmento -> record già letti; complete:
+# segmenti letti per intero, che non vengono più aperti. batches() restituisce
+# i record nuovi a gruppi di (segmento, indice, record); consumati tutti, i
+# segmenti in sealed sono letti per intero e vanno aggiunti a complete
+class Tail:
+    def __init__(self, sink, progress=None, complete=()):
+        self.sink = sink
+        self.progress = progress or {}
+        self.complete = set(complete)
+        # elencati prima della lettura: un segmento sigillato durante la
+        # scansione potrebbe non essere stato letto fino in fondo
+        self.sealed = {segment_name(path) for path in sink.segments()
+                       if is_sealed(path)} - self.complete
+
+    # Avanzamento salvato nella tabella progress di un indice SQLite
+    @classmethod
+    def from_db(cls, sink, conn):
+        rows = conn.execute("SELECT segment, records, complete FROM progress").fetchall()
+        return cls(sink, {row[0]: row[1] for row in rows},
+                   {row[0] for row in rows if row[2]})
+
+    def batches(self, size):
+        batch = []
+        for item in self.sink.scan(self.progress, self.complete):
+            batch.append(item)
+            if len(batch) >= size:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
+
+    # Salva l'avanzamento dopo un gruppo, nella transazione che lo indicizza
+    @staticmethod
+    def save(conn, batch):
+        conn.executemany(
+            "INSERT INTO progress (segment, records) VALUES (?, ?) "
+            "ON CONFLICT (segment) DO UPDATE SET records = excluded.records",
+            list(positions(batch).items()))
+
+    # Segna come letti per intero i segmenti sigillati, a lettura finita
+    def seal(self, conn):
+        with conn:
+            conn.executemany(
+                "INSERT INTO progress (segment, records, complete) VALUES (?, 0, 1) "
+                "ON CONFLICT (segment) DO UPDATE SET complete = 1",
+                [(name,) for name in self.sealed])
+
+
+# Record letti per segmento alla fine di un gruppo
+def positions(batch):
+    return {segment: index + 1 for segment, index, _ in batch}
+
+
+# True se nessun processo tiene il lock del segmento attivo: chi lo scriveva
+# è terminato e il segmento non riceverà altri invii
+def _orphaned(path):
+    if fcntl is None:
+        return False
+    try:
+        with open(path, "rb") as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                return False
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+            return True
+    except FileNotFoundError:
+        return False        # sigillato nel frattempo
+
+
+def _scan_jsonl(path, name, skip):
+    try:
+        f = open(path, "rb")
+    except FileNotFoundError:
+        # il segmento attivo può essere stato sigillato nel frattempo
+        sealed = path.with_name(name + ".jsonl")
+        if not sealed.exists():
+            return
+        f = open(sealed, "rb")
+    with f:
+        for index, line in enumerate(f):
+            if index < skip:
+                continue
+            if not line.endswith(b"\n"):
+                break       # scrittura ancora in corso
+            yield name, index, decode(line)
+
+
+def _scan_parquet(path, name, skip):
+    import pyarrow.parquet as pq
+
+    index = 0
+    for batch in pq.ParquetFile(path).iter_batches():
+        columns = batch.to_pydict()
+        for i in range(batch.num_rows):
+            if index >= skip:
+                yield name, index, {
+                    'id': columns['id'][i],
+                    'submitted_at': columns['submitted_at'][i],
+                    'schema_version': columns['schema_version'][i],
+                    'payload': decode(columns['payload'][i]),
+                    'state': decode(columns['state'][i]),
+                }
+            index += 1
+
+
+sink = SubmissionSink(settings.SUBMISSIONS_DIR)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Manutenzione dell'archivio invii")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("compact", help="converte in Parquet i segmenti sigillati")
+    parser.parse_args(argv)
+    started = time.perf_counter()
+    compacted = sink.compact()
+    print(f"{len(compacted)} segmenti compattati in {time.perf_counter() - started:.1f} s",
+          file=sys.stderr)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,116 @@
+# Salvataggio delle bozze su Redis attraverso un client sostitutivo in
+# memoria con la stessa interfaccia di redis-py.
+#
+#   python -m pytest tests
+import threading
+import unittest
+
+import drafts
+
+
+class _Client:
+    def __init__(self):
+        self.hashes = {}
+        self.ttl = {}
+        self.lock = threading.Lock()
+
+    def hset(self, name, mapping):
+        with self.lock:
+            values = self.hashes.setdefault(name.encode(), {})
+            for key, value in mapping.items():
+                values[key.encode()] = value.encode()
+
+    def hdel(self, name, *keys):
+        with self.lock:
+            values = self.hashes.get(name.encode(), {})
+            for key in keys:
+                values.pop(key.encode(), None)
+            if not values:
+                self.hashes.pop(name.encode(), None)
+                self.ttl.pop(name.encode(), None)
+
+    def hgetall(self, name):
+        with self.lock:
+            return dict(self.hashes.get(name.encode(), {}))
+
+    def expire(self, name, seconds):
+        with self.lock:
+            if name.encode() in self.hashes:
+                self.ttl[name.encode()] = seconds
+
+
+# Client che rifiuta le prime scritture come un server non raggiungibile
+class _FlakyClient(_Client):
+    def __init__(self, failures):
+        super().__init__()
+        self.failures = failures
+        self.failed = threading.Event()
+
+    def hset(self, name, mapping):
+        if self.failures:
+            self.failures -= 1
+            self.failed.set()
+            raise ConnectionError("redis non raggiungibile")
+        super().hset(name, mapping)
+
+
+class RedisDraftStoreTest(unittest.TestCase):
+    def setUp(self):
+        self._retry_after = drafts.RETRY_AFTER
+        drafts.RETRY_AFTER = 0.01
+
+    def tearDown(self):
+        drafts.RETRY_AFTER = self._retry_after
+
+    def store(self, client, ttl=3600):
+        return drafts.RedisDraftStore(client, ttl=ttl, debounce=0.01)
+
+    def test_save_flush_load_and_delete(self):
+        client = _Client()
+        store = self.store(client)
+        store.save("tok", {'nome_azienda': drafts.encode("Rossi Srl"),
+                           'anni_bp': drafts.encode(3)})
+        self.assertTrue(store.flush(5))
+        self.assertEqual(store.load("tok"), {'nome_azienda': "Rossi Srl", 'anni_bp': 3})
+        self.assertEqual(client.ttl[b"bp:bozza:tok"], 3600)
+
+        store.save("tok", {'anni_bp': drafts.encode(5)}, removed=['nome_azienda'])
+        self.assertTrue(store.flush(5))
+        self.assertEqual(store.load("tok"), {'anni_bp': 5})
+        self.assertEqual(store.load("altro"), {})
+
+        store.save("tok", {}, removed=['anni_bp'])
+        self.assertTrue(store.flush(5))
+        self.assertEqual(store.load("tok"), {})
+        self.assertNotIn(b"bp:bozza:tok", client.hashes)
+
+    def test_without_ttl_keys_do_not_expire(self):
+        client = _Client()
+        store = self.store(client, ttl=0)
+        store.save("tok", {'anni_bp': drafts.encode(3)})
+        self.assertTrue(store.flush(5))
+        self.assertEqual(client.ttl, {})
+
+    def test_retries_after_backend_failure_keeping_newer_edits(self):
+        client = _FlakyClient(failures=2)
+        store = self.store(client)
+        store.save("tok", {'anni_bp': drafts.encode(3), 'nome_azienda': drafts.encode("Rossi")})
+        self.assertTrue(client.failed.wait(5))
+        # modifica successiva mentre la prima scrittura è in sospeso
+        store.save("tok", {'anni_bp': drafts.encode(5)})
+        self.assertTrue(store.flush(5))
+        self.assertEqual(client.failures, 0)
+        self.assertEqual(store.load("tok"), {'anni_bp': 5, 'nome_azienda': "Rossi"})
+
+    def test_flush_waits_while_backend_is_down(self):
+        client = _FlakyClient(failures=10 ** 6)
+        store = self.store(client)
+        store.save("tok", {'anni_bp': drafts.encode(3)})
+        self.assertFalse(store.flush(0.2))
+        client.failures = 0
+        self.assertTrue(store.flush(5))
+        self.assertEqual(store.load("tok"), {'anni_bp': 3})
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,36 @@
+# Anno mediano di pareggio delle simulazioni Monte Carlo.
+#
+#   python -m pytest tests
+import math
+import unittest
+
+import numpy as np
+
+import projections
+
+
+class MedianBreakEvenTest(unittest.TestCase):
+    def test_exactly_half_reaching_break_even_stays_finite(self):
+        self.assertEqual(projections.median_break_even(np.array([2, 0, 1, 0])), 2.0)
+        self.assertEqual(projections.median_break_even(np.array([3, 0])), 3.0)
+
+    def test_less_than_half_is_not_reached(self):
+        self.assertTrue(math.isnan(projections.median_break_even(np.array([0, 0, 4, 0]))))
+        self.assertTrue(math.isnan(projections.median_break_even(np.array([], dtype=int))))
+
+    def test_median_of_reached_years(self):
+        self.assertEqual(projections.median_break_even(np.array([1, 2, 3, 0, 5])), 3.0)
+
+    def test_projection_never_exports_inf(self):
+        # senza volatilità tutte le simulazioni coincidono con il piano
+        reached = projections.project((100.0, 100.0), (150.0, 40.0), volatilita_ricavi=0.0,
+                                      volatilita_costi=0.0, simulazioni=4)
+        self.assertEqual(reached.pareggio_mediano, 2.0)
+        never = projections.project((10.0, 10.0), (50.0, 50.0), volatilita_ricavi=0.0,
+                                    volatilita_costi=0.0, simulazioni=4)
+        self.assertTrue(math.isnan(never.pareggio_mediano))
+        self.assertEqual(never.prob_pareggio, 0.0)
+
+
+if __name__ == "__main__":
+    unittest.main()
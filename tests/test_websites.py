@@ -0,0 +1,199 @@
+# Verifica dei link contro un server HTTP locale che fa le veci dei siti dei
+# concorrenti.
+#
+#   python -m pytest tests
+import asyncio
+import threading
+import time
+import unittest
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import websites
+
+PAGE = (b"<html><head><title> Concorrente  Srl </title>"
+        b'<meta name="description" content="Software gestionale">'
+        b'<link rel="shortcut icon" href="/static/icon.png"></head><body></body></html>')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"       # keep-alive
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        self.server.requests += 1
+        if self.path == "/":
+            self._send(200, PAGE, content_type="text/html; charset=utf-8")
+        elif self.path == "/redirect":
+            self.send_response(302)
+            self.send_header("Location", "/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/metadata":
+            self.send_response(302)
+            self.send_header("Location", "http://169.254.169.254/latest/meta-data/")
+            self.send_header("Content-Length", "0")
+            self.end_headers()
+        elif self.path == "/missing":
+            self._send(404, b"non trovato")
+        elif self.path == "/chunked":
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html")
+            self.send_header("Transfer-Encoding", "chunked")
+            self.end_headers()
+            for part in (PAGE[:40], PAGE[40:]):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(part), part))
+            self.wfile.write(b"0\r\n\r\n")
+        elif self.path in ("/empty", "/not-modified"):
+            # nessun Content-Length e connessione lasciata aperta
+            self.send_response(204 if self.path == "/empty" else 304)
+            self.end_headers()
+        elif self.path == "/slow":
+            self.send_response(200)
+            self.send_header("Content-Length", str(len(PAGE)))
+            self.end_headers()
+            self.wfile.write(PAGE[:10])
+            self.wfile.flush()
+            if self.server.release.wait(10):
+                self.wfile.write(PAGE[10:])
+        else:
+            self._send(404, b"")
+
+    def _send(self, status, body, content_type="text/plain"):
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+
+class FetcherTest(unittest.TestCase):
+    def setUp(self):
+        self.server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+        self.server.daemon_threads = True
+        self.server.requests = 0
+        self.server.release = threading.Event()
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.base = f"http://127.0.0.1:{self.server.server_address[1]}"
+        self.fetcher = websites.Fetcher(ttl=60, timeout=3, allow=("127.0.0.1/32",))
+
+    def tearDown(self):
+        self.server.release.set()
+        self.server.shutdown()
+        self.server.server_close()
+
+    def fetch(self, path, fetcher=None):
+        return asyncio.run((fetcher or self.fetcher).fetch(self.base + path))
+
+    def test_reads_title_description_and_favicon(self):
+        info = self.fetch("/")
+        self.assertTrue(info.ok)
+        self.assertEqual(info.status, 200)
+        self.assertEqual(info.title, "Concorrente Srl")
+        self.assertEqual(info.description, "Software gestionale")
+        self.assertEqual(info.favicon, self.base + "/static/icon.png")
+
+    def test_follows_redirects_and_chunked_bodies(self):
+        info = self.fetch("/redirect")
+        self.assertTrue(info.ok)
+        self.assertEqual(info.final_url, self.base + "/")
+        chunked = self.fetch("/chunked", fetcher=websites.Fetcher(timeout=3, allow=("127.0.0.1/32",)))
+        self.assertEqual(chunked.title, "Concorrente Srl")
+
+    def test_reports_dead_links(self):
+        info = self.fetch("/missing")
+        self.assertFalse(info.ok)
+        self.assertEqual(info.error, "HTTP 404")
+        self.server.shutdown()
+        self.server.server_close()
+        refused = self.fetch("/", fetcher=websites.Fetcher(timeout=3, allow=("127.0.0.1/32",)))
+        self.assertFalse(refused.ok)
+        self.assertTrue(refused.error)
+
+    def test_reuses_connections(self):
+        async def run():
+            await self.fetcher.fetch(self.base + "/")
+            await self.fetcher.fetch(self.base + "/redirect")
+            return self.fetcher._idle
+        idle = asyncio.run(run())
+        self.assertEqual(sum(len(conns) for conns in idle.values()), 1)
+
+    def test_responses_without_body_do_not_wait_for_timeout(self):
+        async def run():
+            started = time.monotonic()
+            empty = await self.fetcher.fetch(self.base + "/empty")
+            not_modified = await self.fetcher.fetch(self.base + "/not-modified")
+            page = await self.fetcher.fetch(self.base + "/")
+            return time.monotonic() - started, empty, not_modified, page
+        elapsed, empty, not_modified, page = asyncio.run(run())
+        self.assertLess(elapsed, 1)
+        self.assertEqual((empty.status, not_modified.status), (204, 304))
+        # la connessione resta utilizzabile per la richiesta successiva
+        self.assertEqual(page.title, "Concorrente Srl")
+        self.assertEqual(sum(len(conns) for conns in self.fetcher._idle.values()), 1)
+
+    def test_cancelled_request_closes_pooled_connection(self):
+        async def run():
+            await self.fetcher.fetch(self.base + "/")
+            (reader, writer), = next(iter(self.fetcher._idle.values()))
+            with self.assertRaises(asyncio.TimeoutError):
+                await asyncio.wait_for(self.fetcher.fetch(self.base + "/slow"), 0.3)
+            return writer
+        writer = asyncio.run(run())
+        self.assertTrue(writer.is_closing())
+        self.assertEqual(sum(len(conns) for conns in self.fetcher._idle.values()), 0)
+
+    def test_poll_never_blocks(self):
+        fetcher = websites.Fetcher(ttl=60, timeout=3, allow=("127.0.0.1/32",))
+        url = self.base + "/slow"
+        started = time.monotonic()
+        self.assertIsNone(fetcher.poll(url))
+        self.assertIsNone(fetcher.poll(url))
+        self.assertLess(time.monotonic() - started, 0.2)
+        self.server.release.set()
+        deadline = time.monotonic() + 5
+        while (info := fetcher.poll(url)) is None and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self.assertTrue(info.ok)
+        self.assertEqual(self.server.requests, 1)
+        self.assertIs(fetcher.poll(url), info)       # dalla cache
+
+    def test_rejects_local_and_private_addresses(self):
+        info = self.fetch("/", fetcher=websites.Fetcher(timeout=3))
+        self.assertFalse(info.ok)
+        self.assertIn("non consentito", info.error)
+        self.assertEqual(self.server.requests, 0)
+        urls = ("http://10.0.0.1/", "http://192.168.1.1/", "http://172.16.0.1/",
+                "http://169.254.169.254/latest/meta-data/", "http://[::1]/",
+                "http://[::ffff:127.0.0.1]/", "http://0.0.0.0/")
+
+        async def run():
+            fetcher = websites.Fetcher(timeout=3)
+            return [await fetcher.fetch(url) for url in urls]
+        for url, info in zip(urls, asyncio.run(run())):
+            self.assertIn("non consentito", info.error, url)
+
+    def test_rejects_redirects_to_private_addresses(self):
+        info = self.fetch("/metadata")
+        self.assertFalse(info.ok)
+        self.assertIn("non consentito", info.error)
+
+
+class AddressTest(unittest.TestCase):
+    def test_public_address(self):
+        for address in ("93.184.216.34", "2606:2800:220:1:248:1893:25c8:1946"):
+            self.assertTrue(websites.public_address(address), address)
+        for address in ("127.0.0.1", "10.1.2.3", "172.31.0.1", "192.168.0.1", "169.254.169.254",
+                        "100.64.0.1", "0.0.0.0", "224.0.0.1", "240.0.0.1", "::1", "fe80::1%eth0",
+                        "fc00::1", "::ffff:10.0.0.1"):
+            self.assertFalse(websites.public_address(address), address)
+
+    def test_normalize_url(self):
+        self.assertEqual(websites.normalize_url("esempio.it"), "https://esempio.it")
+        for text in ("localhost", "http://localhost:8501/", "app.localhost", "ftp://esempio.it", "ciao"):
+            self.assertEqual(websites.normalize_url(text), "", text)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,122 @@
+# Anteprime delle immagini caricate, indicizzate per hash del contenuto.
+#
+# Ogni immagine viene decodificata, ridotta e ricodificata una sola volta;
+# i rerun successivi (anche di altre sessioni) ricevono l'anteprima dalla
+# cache LRU condivisa dal processo, limitata sia per numero di elementi sia
+# per byte occupati. L'originale resta disponibile solo per l'esportazione.
+# Nelle pagine le anteprime mancanti vengono preparate da lavori interattivi
+# del pianificatore condiviso (jobs), senza decodificare durante il rerun.
+import io
+import threading
+from collections import OrderedDict
+
+from PIL import Image, ImageOps, UnidentifiedImageError
+
+import jobs
+
+MAX_SIDE = 480
+MAX_ITEMS = 512
+MAX_BYTES = 64 * 1024 * 1024
+JPEG_QUALITY = 80
+
+
+# Riduce l'immagine (byte o file mappato in memoria) al lato massimo indicato
+# e la ricodifica in JPEG, o in PNG se ha un canale alfa; None se non è
+# un'immagine
+def make_thumbnail(data, max_side=MAX_SIDE):
+    try:
+        img = Image.open(io.BytesIO(data) if isinstance(data, bytes) else data)
+        img.draft("RGB", (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        img.thumbnail((max_side, max_side))
+    except (UnidentifiedImageError, OSError, ValueError):
+        return None
+
+    out = io.BytesIO()
+    if img.mode in ("RGBA", "LA") or "transparency" in img.info:
+        img.save(out, format="PNG", optimize=True)
+    else:
+        img.convert("RGB").save(out, format="JPEG", quality=JPEG_QUALITY, optimize=True)
+    return out.getvalue()
+
+
+class ThumbnailCache:
+    def __init__(self, max_items=MAX_ITEMS, max_bytes=MAX_BYTES, max_side=MAX_SIDE):
+        self.max_items = max_items
+        self.max_bytes = max_bytes
+        self.max_side = max_side
+        self._items = OrderedDict()     # digest -> anteprima
+        self._bytes = 0
+        self._rejected = OrderedDict()  # digest dei file che non sono immagini
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._items)
+
+    def get(self, digest):
+        with self._lock:
+            thumb = self._items.get(digest)
+            if thumb is not None:
+                self._items.move_to_end(digest)
+            return thumb
+
+    def put(self, digest, thumb):
+        if len(thumb) > self.max_bytes:
+            return
+        with self._lock:
+            old = self._items.pop(digest, None)
+            if old is not None:
+                self._bytes -= len(old)
+            self._items[digest] = thumb
+            self._bytes += len(thumb)
+            while len(self._items) > self.max_items or self._bytes > self.max_bytes:
+                _, evicted = self._items.popitem(last=False)
+                self._bytes -= len(evicted)
+
+    # True se il contenuto è già risultato non essere un'immagine
+    def rejected(self, digest):
+        with self._lock:
+            return digest in self._rejected
+
+    def _reject(self, digest):
+        with self._lock:
+            self._rejected[digest] = None
+            self._rejected.move_to_end(digest)
+            while len(self._rejected) > self.max_items:
+                self._rejected.popitem(last=False)
+
+    # Anteprima di un allegato già archiviato: il digest è il nome del file,
+    # quindi non serve ricalcolare l'hash
+    def preview_stored(self, store, handle):
+        thumb = self.get(handle.digest)
+        if thumb is None and not self.rejected(handle.digest):
+            with store.open_mmap(handle) as mm:
+                thumb = make_thumbnail(mm, self.max_side)
+            if thumb is not None:
+                self.put(handle.digest, thumb)
+            else:
+                self._reject(handle.digest)
+        return thumb
+
+
+# Cache condivisa da tutte le sessioni del processo
+cache = ThumbnailCache()
+
+
+# Anteprima di un allegato archiviato senza mai bloccare: restituisce
+# (anteprima, in_attesa). Se non è in cache viene preparata da un lavoro
+# interattivo; anteprima None e in_attesa falso: il file non è un'immagine
+# (ricordato per digest, così i rerun successivi non accodano altri lavori)
+def request_stored(store, handle, session=None):
+    thumb = cache.get(handle.digest)
+    if thumb is not None or cache.rejected(handle.digest):
+        return thumb, False
+    try:
+        job = jobs.scheduler.submit(lambda job: cache.preview_stored(store, handle),
+                                    priority=jobs.INTERACTIVE, session=session,
+                                    key=f"anteprima:{handle.digest}")
+    except jobs.Busy:
+        return None, True
+    if job.finished:
+        return job.result, False
+    return None, True
@@ -0,0 +1,202 @@
+# Motore di validazione incrementale.
+#
+# Le regole sono definite una volta per processo, ciascuna con le chiavi
+# dello stato da cui dipende; l'indice inverso chiave -> regole permette di
+# rivalutare, a ogni modifica di un widget (callback on_change), solo le
+# regole toccate. Gli esiti restano in una mappa nella sessione che sidebar,
+# schede e invio leggono senza ricalcolare nulla. Le regole bloccanti
+# impediscono l'invio; gli avvisi vengono solo mostrati.
+import re
+from dataclasses import dataclass, field
+
+import schema
+from projections import MAX_ANNI
+
+EMAIL = re.compile(r"^[^@\s]+@[^@\s]+\.[a-z]{2,}$", re.I)
+URL = re.compile(r"^(https?://)?([\w-]+\.)+[a-z]{2,}(:\d+)?(/\S*)?$", re.I)
+PARTITA_IVA = re.compile(r"^\d{11}$")
+
+_KEY = '_validazione'
+
+
+@dataclass(frozen=True)
+class Rule:
+    target: str                 # chiave a cui si riferisce il messaggio
+    inputs: tuple               # chiavi dello stato lette dalla regola
+    check: object               # funzione(stato) -> messaggio o None
+    blocking: bool = True
+
+
+@dataclass
+class Issues:
+    errors: dict = field(default_factory=dict)      # target -> messaggio bloccante
+    warnings: dict = field(default_factory=dict)    # target -> avviso
+
+
+def _value(state, key):
+    f = schema.BY_KEY.get(key)
+    return schema.get_value(state, f) if f else state.get(key)
+
+
+# Cifra di controllo della partita IVA: somma delle cifre dispari più le
+# cifre pari raddoppiate (ridotte di 9 se > 9)
+def partita_iva_valida(value):
+    if not PARTITA_IVA.match(value):
+        return False
+    digits = [int(c) for c in value]
+    total = sum(digits[0:10:2])
+    total += sum(d * 2 - 9 if d * 2 > 9 else d * 2 for d in digits[1:10:2])
+    return (10 - total % 10) % 10 == digits[10]
+
+
+def _societa_capitali(state):
+    return _value(state, 'forma_giuridica') == "Società di Capitali"
+
+
+def _email(state):
+    value = (_value(state, 'email_aziendale') or "").strip()
+    if value and not EMAIL.match(value):
+        return "Inserisci un indirizzo email valido"
+
+
+def _partita_iva(state):
+    value = (_value(state, 'partita_iva') or "").strip()
+    if not value or not _societa_capitali(state):
+        return None
+    if not PARTITA_IVA.match(value):
+        return "La partita IVA deve essere composta da 11 cifre"
+    if not partita_iva_valida(value):
+        return "La partita IVA non è valida (cifra di controllo errata)"
+
+
+def _capitale_sociale(state):
+    if _societa_capitali(state) and schema.number(_value(state, 'capitale_sociale')) <= 0:
+        return "Il capitale sociale deve essere maggiore di 0"
+
+
+def _url(key, multiple=False):
+    def check(state):
+        text = (_value(state, key) or "").strip()
+        parts = text.replace(",", " ").split() if multiple else ([text] if text else [])
+        invalid = [part for part in parts if not URL.match(part)]
+        if invalid:
+            return f"URL non valido: {', '.join(invalid[:3])}"
+    return check
+
+
+def _range(key, minimum, maximum, label):
+    def check(state):
+        value = schema.number(_value(state, key), None)
+        if value is None:
+            return f"{label} deve essere un numero"
+        if not minimum <= value <= maximum:
+            return f"{label} deve essere compreso tra {minimum:,} e {maximum:,}"
+    return check
+
+
+def _anno_attivo(state, anno):
+    return anno <= int(schema.number(_value(state, 'anni_bp')))
+
+
+def _perdita(anno):
+    def check(state):
+        if not _anno_attivo(state, anno):
+            return None
+        ricavi = schema.number(state.get(f"ricavi_anno{anno}"))
+        costi = schema.number(state.get(f"costi_anno{anno}"))
+        if costi > ricavi:
+            return "Attenzione: Proiezione di perdita per questo anno"
+        if costi and costi == ricavi:
+            return "Proiezione di pareggio per questo anno"
+    return check
+
+
+def _valori_anno(anno):
+    def check(state):
+        if not _anno_attivo(state, anno):
+            return None
+        for kind in ("ricavi", "costi"):
+            value = schema.number(state.get(f"{kind}_anno{anno}"), None)
+            if value is None or value < 0:
+                return f"I {kind} dell'anno {anno} devono essere un numero non negativo"
+    return check
+
+
+def _budget_marketing(state):
+    budget = schema.number(_value(state, 'budget_marketing'))
+    anni = range(1, int(schema.number(_value(state, 'anni_bp'))) + 1)
+    costi = sum(schema.number(state.get(f"costi_anno{anno}")) for anno in anni)
+    if budget and costi and budget > costi:
+        return "Il budget marketing supera i costi totali del piano"
+
+
+_YEAR_KEYS = tuple(f"{kind}_anno{anno}" for anno in range(1, MAX_ANNI + 1)
+                   for kind in ("ricavi", "costi"))
+
+RULES = (
+    Rule('email_aziendale', ('email_aziendale',), _email),
+    Rule('partita_iva', ('partita_iva', 'forma_giuridica'), _partita_iva),
+    Rule('capitale_sociale', ('capitale_sociale', 'forma_giuridica'), _capitale_sociale),
+    Rule('sito_web', ('sito_web',), _url('sito_web')),
+    Rule('siti_concorrenti', ('siti_concorrenti',), _url('siti_concorrenti', multiple=True)),
+    Rule('fonti_mercato', ('fonti_mercato',), _url('fonti_mercato', multiple=True)),
+    Rule('anni_bp', ('anni_bp',), _range('anni_bp', 1, MAX_ANNI, "La durata del piano")),
+    Rule('budget_marketing', ('budget_marketing',),
+         _range('budget_marketing', 0, 10 ** 12, "Il budget marketing")),
+    Rule('variazione_scenari', ('variazione_scenari',),
+         _range('variazione_scenari', 0, 90, "La variazione degli scenari")),
+    Rule('volatilita_ricavi', ('volatilita_ricavi',),
+         _range('volatilita_ricavi', 0, 100, "La volatilità dei ricavi")),
+    Rule('volatilita_costi', ('volatilita_costi',),
+         _range('volatilita_costi', 0, 100, "La volatilità dei costi")),
+    Rule('simulazioni', ('simulazioni',), _range('simulazioni', 100, 20000, "Le simulazioni")),
+    Rule('budget_vs_costi', ('budget_marketing', 'anni_bp') + _YEAR_KEYS,
+         _budget_marketing, blocking=False),
+) + tuple(
+    Rule(f"valori_anno{anno}", ('anni_bp', f"ricavi_anno{anno}", f"costi_anno{anno}"),
+         _valori_anno(anno))
+    for anno in range(1, MAX_ANNI + 1)
+) + tuple(
+    Rule(f"perdita_anno{anno}", ('anni_bp', f"ricavi_anno{anno}", f"costi_anno{anno}"),
+         _perdita(anno), blocking=False)
+    for anno in range(1, MAX_ANNI + 1)
+)
+
+# Indice inverso precalcolato: chiave dello stato -> regole che la leggono
+BY_INPUT = {}
+for _rule in RULES:
+    for _key in _rule.inputs:
+        BY_INPUT.setdefault(_key, []).append(_rule)
+BY_INPUT = {key: tuple(rules) for key, rules in BY_INPUT.items()}
+WATCHED = frozenset(BY_INPUT)
+
+
+def _apply(rules, state, issues):
+    for rule in rules:
+        message = rule.check(state)
+        target = issues.errors if rule.blocking else issues.warnings
+        if message:
+            target[rule.target] = message
+        else:
+            target.pop(rule.target, None)
+
+
+def validate_all(state):
+    issues = Issues()
+    _apply(RULES, state, issues)
+    return issues
+
+
+# Rivaluta solo le regole che dipendono dalle chiavi cambiate
+def revalidate(state, issues, keys):
+    rules = dict.fromkeys(rule for key in keys for rule in BY_INPUT.get(key, ()))
+    _apply(rules, state, issues)
+    return issues
+
+
+# Mappa degli esiti nella sessione, calcolata per intero solo la prima volta
+def session_issues(state):
+    issues = state.get(_KEY)
+    if issues is None:
+        issues = state[_KEY] = validate_all(state)
+    return issues
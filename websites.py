@@ -0,0 +1,354 @@
+# Metadati dei siti indicati nel modulo (concorrenti, fonti di mercato).
+#
+# Gli URL vengono risolti in un event loop asyncio su un thread dedicato,
+# con un piccolo client HTTP/1.1 della libreria standard: connessioni
+# keep-alive riutilizzate per host, un limite di richieste contemporanee per
+# host e uno complessivo. Di ogni pagina si leggono solo i primi KB, quanto
+# basta per titolo, descrizione e favicon; i link irraggiungibili o con
+# errore HTTP vengono segnalati. I risultati stanno in una cache con scadenza
+# condivisa da tutte le sessioni, e la pagina li chiede con poll(), che non
+# blocca mai: restituisce None finché la risposta non è pronta.
+#
+# Gli URL arrivano dai richiedenti: prima di connettersi il nome viene
+# risolto e si rifiutano gli indirizzi non pubblici (loopback, reti private,
+# link-local come 169.254.169.254, riservati, multicast); la connessione va
+# poi all'indirizzo verificato, non a una nuova risoluzione. Solo i test
+# consentono indirizzi locali, passando allow al Fetcher.
+import asyncio
+import ipaddress
+import socket
+import ssl
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from html.parser import HTMLParser
+from urllib.parse import urljoin, urlsplit
+
+import settings
+
+MAX_BYTES = 64 * 1024
+MAX_REDIRECTS = 5
+MAX_ENTRIES = 4096
+USER_AGENT = "raccolta-business-plan/1.0 (+verifica link)"
+
+
+@dataclass(frozen=True)
+class PageInfo:
+    url: str
+    ok: bool
+    status: int = 0
+    final_url: str = ""
+    title: str = ""
+    description: str = ""
+    favicon: str = ""
+    error: str = ""
+
+
+# Aggiunge lo schema mancante; "" se il testo non è un URL http(s)
+def normalize_url(text):
+    text = (text or "").strip()
+    if not text:
+        return ""
+    if "://" not in text:
+        text = "https://" + text
+    parts = urlsplit(text)
+    if parts.scheme not in ("http", "https") or not parts.hostname:
+        return ""
+    if "." not in parts.hostname or parts.hostname.rstrip(".").endswith(".localhost"):
+        return ""
+    return text
+
+
+class BlockedAddress(ValueError):
+    pass
+
+
+# True se l'indirizzo è raggiungibile su Internet, o rientra nelle reti allow
+def public_address(address, allow=()):
+    ip = ipaddress.ip_address(address.split("%", 1)[0])
+    if ip.version == 6 and ip.ipv4_mapped is not None:
+        ip = ip.ipv4_mapped
+    if any(ip in network for network in allow):
+        return True
+    return ip.is_global and not ip.is_multicast
+
+
+# URL di un campo con più indirizzi separati da virgole o spazi
+def split_urls(text):
+    urls = (normalize_url(part) for part in (text or "").replace(",", " ").split())
+    return list(dict.fromkeys(url for url in urls if url))
+
+
+class _HeadParser(HTMLParser):
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.title = ""
+        self.description = ""
+        self.favicon = ""
+        self._in_title = False
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {name: value or "" for name, value in attrs}
+        if tag == "title":
+            self._in_title = True
+        elif tag == "meta":
+            name = (attrs.get("name") or attrs.get("property") or "").lower()
+            if name in ("description", "og:description") and not self.description:
+                self.description = attrs.get("content", "")
+            elif name == "og:title" and not self.title:
+                self.title = attrs.get("content", "")
+        elif tag == "link" and "icon" in attrs.get("rel", "").lower().split():
+            self.favicon = self.favicon or attrs.get("href", "")
+
+    def handle_endtag(self, tag):
+        if tag == "title":
+            self._in_title = False
+
+    def handle_data(self, data):
+        if self._in_title:
+            self.title += data
+
+
+def parse_head(html, base_url):
+    parser = _HeadParser()
+    try:
+        parser.feed(html)
+    except Exception:
+        pass        # HTML malformato: si tiene quanto letto
+    favicon = urljoin(base_url, parser.favicon or "/favicon.ico")
+    return " ".join(parser.title.split())[:300], " ".join(parser.description.split())[:500], favicon
+
+
+class _Response:
+    def __init__(self, status, headers, body, reusable):
+        self.status = status
+        self.headers = headers
+        self.body = body
+        self.reusable = reusable
+
+
+class Fetcher:
+    def __init__(self, ttl=settings.FETCH_TTL, per_host=settings.FETCH_PER_HOST,
+                 max_connections=settings.FETCH_CONNECTIONS, timeout=settings.FETCH_TIMEOUT,
+                 allow=()):
+        self.ttl = ttl
+        self.per_host = per_host
+        self.max_connections = max_connections
+        self.timeout = timeout
+        self.allow = tuple(ipaddress.ip_network(network) for network in allow)
+        self._cache = OrderedDict()      # url -> (scadenza, PageInfo)
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._loop = None
+        self._idle = {}                  # (schema, host, porta) -> [(reader, writer)]
+        self._host_limits = {}
+        self._limit = None
+        self._ssl = ssl.create_default_context()
+
+    def _ensure_loop(self):
+        with self._lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name="website-fetcher",
+                                 daemon=True).start()
+        return self._loop
+
+    # Metadati dell'URL se già in cache, altrimenti avvia la richiesta e
+    # restituisce None; non blocca mai
+    def poll(self, url):
+        url = normalize_url(url)
+        if not url:
+            return None
+        with self._lock:
+            hit = self._cache.get(url)
+            if hit is not None and hit[0] > time.monotonic():
+                self._cache.move_to_end(url)
+                return hit[1]
+            if url in self._pending:
+                return None
+            self._pending.add(url)
+        asyncio.run_coroutine_threadsafe(self._resolve(url), self._ensure_loop())
+        return None
+
+    def _remember(self, url, info):
+        # i link non funzionanti si ricontrollano prima
+        ttl = self.ttl if info.ok else min(self.ttl, settings.FETCH_RETRY_AFTER)
+        with self._lock:
+            self._pending.discard(url)
+            self._cache[url] = (time.monotonic() + ttl, info)
+            self._cache.move_to_end(url)
+            while len(self._cache) > MAX_ENTRIES:
+                self._cache.popitem(last=False)
+
+    async def _resolve(self, url):
+        try:
+            info = await asyncio.wait_for(self.fetch(url), self.timeout)
+        except asyncio.TimeoutError:
+            info = PageInfo(url, False, error="tempo scaduto")
+        except Exception as exc:
+            info = PageInfo(url, False, error=str(exc) or type(exc).__name__)
+        self._remember(url, info)
+        return info
+
+    # Segue i redirect e legge l'inizio della pagina
+    async def fetch(self, url):
+        current = url
+        for _ in range(MAX_REDIRECTS + 1):
+            try:
+                response = await self._get(current)
+            except (OSError, asyncio.IncompleteReadError, ValueError) as exc:
+                return PageInfo(url, False, final_url=current,
+                                error=str(exc) or type(exc).__name__)
+            location = response.headers.get("location")
+            if response.status in (301, 302, 303, 307, 308) and location:
+                current = urljoin(current, location)
+                continue
+            if response.status >= 400:
+                return PageInfo(url, False, response.status, current,
+                                error=f"HTTP {response.status}")
+            charset = "utf-8"
+            content_type = response.headers.get("content-type", "")
+            if "charset=" in content_type:
+                charset = content_type.split("charset=", 1)[1].split(";")[0].strip() or charset
+            try:
+                html = response.body.decode(charset, errors="replace")
+            except LookupError:
+                html = response.body.decode("utf-8", errors="replace")
+            title, description, favicon = parse_head(html, current)
+            return PageInfo(url, True, response.status, current, title, description, favicon)
+        return PageInfo(url, False, final_url=current, error="troppi redirect")
+
+    def _host_limit(self, key):
+        if self._limit is None:
+            self._limit = asyncio.Semaphore(self.max_connections)
+        if key not in self._host_limits:
+            self._host_limits[key] = asyncio.Semaphore(self.per_host)
+        return self._host_limits[key]
+
+    async def _get(self, url):
+        parts = urlsplit(url)
+        port = parts.port or (443 if parts.scheme == "https" else 80)
+        key = (parts.scheme, parts.hostname, port)
+        path = (parts.path or "/") + (f"?{parts.query}" if parts.query else "")
+        host = parts.hostname if parts.port is None else f"{parts.hostname}:{parts.port}"
+        request = (f"GET {path} HTTP/1.1\r\nHost: {host}\r\nUser-Agent: {USER_AGENT}\r\n"
+                   "Accept: text/html,application/xhtml+xml;q=0.9,*/*;q=0.5\r\n"
+                   "Accept-Encoding: identity\r\nConnection: keep-alive\r\n\r\n").encode("ascii")
+
+        async with self._host_limit(key), self._limit:
+            pooled = self._take_idle(key)
+            if pooled is not None:
+                try:
+                    response = await self._exchange(*pooled, request)
+                except (OSError, asyncio.IncompleteReadError, ValueError):
+                    # connessione chiusa dal server nel frattempo: se ne apre una nuova
+                    pooled[1].close()
+                except BaseException:
+                    # richiesta annullata (tempo scaduto): la risposta non è
+                    # stata letta, la connessione non si può riusare
+                    pooled[1].close()
+                    raise
+                else:
+                    self._release(key, pooled, response)
+                    return response
+            conn = await self._connect(parts.scheme, parts.hostname, port)
+            try:
+                response = await self._exchange(*conn, request)
+            except BaseException:
+                conn[1].close()
+                raise
+            self._release(key, conn, response)
+            return response
+
+    # Indirizzi dell'host, tutti verificati: basta uno non pubblico per
+    # rifiutare il nome (un DNS può mescolarli)
+    async def _addresses(self, hostname, port):
+        infos = await asyncio.get_running_loop().getaddrinfo(
+            hostname, port, type=socket.SOCK_STREAM)
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        for address in addresses:
+            if not public_address(address, self.allow):
+                raise BlockedAddress(f"indirizzo non consentito: {address}")
+        if not addresses:
+            raise OSError(f"nessun indirizzo per {hostname}")
+        return addresses
+
+    # Connessione a un indirizzo verificato; per HTTPS il certificato resta
+    # controllato sul nome dell'host
+    async def _connect(self, scheme, hostname, port):
+        error = None
+        for address in await self._addresses(hostname, port):
+            try:
+                return await asyncio.open_connection(
+                    address, port,
+                    ssl=self._ssl if scheme == "https" else None,
+                    server_hostname=hostname if scheme == "https" else None)
+            except OSError as exc:
+                error = exc
+        raise error
+
+    def _take_idle(self, key):
+        idle = self._idle.get(key, [])
+        while idle:
+            reader, writer = idle.pop()
+            if not writer.is_closing() and not reader.at_eof():
+                return reader, writer
+            writer.close()
+        return None
+
+    def _release(self, key, conn, response):
+        idle = self._idle.setdefault(key, [])
+        if response.reusable and len(idle) < self.per_host:
+            idle.append(conn)
+        else:
+            conn[1].close()
+
+    async def _exchange(self, reader, writer, request):
+        writer.write(request)
+        await writer.drain()
+        status_line = await reader.readline()
+        if not status_line:
+            raise ConnectionResetError("connessione chiusa dal server")
+        parts = status_line.decode("latin-1").split(None, 2)
+        if len(parts) < 2 or not parts[0].startswith("HTTP/"):
+            raise ValueError("risposta HTTP non valida")
+        status = int(parts[1])
+        headers = {}
+        while True:
+            line = await reader.readline()
+            if line in (b"\r\n", b"\n", b""):
+                break
+            name, _, value = line.decode("latin-1").partition(":")
+            headers[name.strip().lower()] = value.strip()
+
+        reusable = headers.get("connection", "").lower() != "close"
+        if status in (204, 304):
+            # risposte senza corpo, anche senza Content-Length
+            body, complete = b"", True
+        elif headers.get("transfer-encoding", "").lower() == "chunked":
+            body, complete = await self._read_chunked(reader)
+        elif "content-length" in headers:
+            length = int(headers["content-length"])
+            body = await reader.readexactly(min(length, MAX_BYTES))
+            complete = length <= MAX_BYTES
+        else:
+            body = await reader.read(MAX_BYTES)
+            complete = False
+        # con il corpo letto solo in parte la connessione non è riutilizzabile
+        return _Response(status, headers, body, reusable and complete)
+
+    async def _read_chunked(self, reader):
+        body = bytearray()
+        while len(body) < MAX_BYTES:
+            size = int((await reader.readline()).split(b";")[0].strip() or b"0", 16)
+            if size == 0:
+                while (await reader.readline()) not in (b"\r\n", b"\n", b""):
+                    pass        # trailer
+                return bytes(body), True
+            body += await reader.readexactly(size)
+            await reader.readexactly(2)
+        return bytes(body[:MAX_BYTES]), False
+
+
+fetcher = Fetcher()